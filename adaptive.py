@@ -0,0 +1,100 @@
+""" Adaptive question order with an early stop, enabled per test with ?mode=adaptive (or for every test with
+PERSONALITY_ADAPTIVE=1, where ?mode=full keeps the full-length test)
+
+Answers are modelled as linear in a hidden per-person trait level theta: answer value = mean + weights . theta
++ noise, with a normal prior on theta. The running test_results are all the posterior needs (they are the
+weighted sum of the answers), so the test state stays the same as in the full-length test. From the posterior
+the unanswered questions get an expected answer, which gives the expected full-length result and how uncertain
+it still is.
+
+The next question is the unanswered one that shrinks that uncertainty the most, counting traits that sit close
+to a meta type threshold extra. The test stops once at least MIN_QUESTIONS are answered, no trait is more
+uncertain than MAX_STD and CONFIDENCE of the plausible full-length results show the same top trait and meta
+types as the expected one. The expected full-length result is what gets shown.
+"""
+import numpy as np
+
+from scoring import ScoringEngine
+from meta_types import MetaTypeIndex
+
+PRIOR_STD = 1.0 # spread of the trait levels between people, in answer value units
+NOISE_STD = 0.9 # spread of one person's answers around what their levels predict
+MIN_QUESTIONS = 16
+MAX_STD = 0.12 # largest std of any expected trait score to stop at
+CONFIDENCE = 0.95 # share of the sampled results that must agree with the expected one to stop
+SAMPLES = 256 # results sampled to check the agreement
+
+class AdaptiveSelector:
+    """ Picks questions and decides when to stop for one question bank, holds nothing about the sessions
+    """
+    def __init__(self, engine: ScoringEngine, meta_index: MetaTypeIndex, prior_std: float = PRIOR_STD,
+                 noise_std: float = NOISE_STD, seed: int = 0):
+        self.engine = engine
+        self.meta_index = meta_index
+        self.noise_var = noise_std**2
+        self.prior_precision = np.eye(len(engine.traits)) / prior_std**2
+        self.mean_answer = float(engine.conversion.mean())
+        self.weights = engine.weights
+        self.outer = engine.weights[:, :, None] * engine.weights[:, None, :] # (questions x traits x traits)
+        self.scale = np.outer(engine.normalization, engine.normalization)
+        # the same draws for every check, so a decision only depends on the test state
+        self.draws = np.random.default_rng(seed).standard_normal((SAMPLES, len(engine.traits)))
+        self.thresholds = np.where(meta_index.thresholds > 0, meta_index.thresholds, np.nan)
+        for array in (self.outer, self.draws):
+            array.setflags(write=False)
+
+    def _indices(self, question_ids) -> np.ndarray:
+        return np.array([self.engine.question_index[str(qid)] for qid in question_ids], dtype=int)
+
+    def _project(self, answered: np.ndarray, results: dict) -> tuple:
+        """ -> posterior precision of theta, (traits x traits) Gram matrix of the unanswered weights, expected
+        full-length result and its covariance
+        """
+        raw = np.array([results[trait] for trait in self.engine.traits]) * self.engine.normalization
+        precision = self.prior_precision + self.outer[answered].sum(axis=0) / self.noise_var
+        cov = np.linalg.inv(precision)
+        # weights^T (answers - mean answer) is the raw score minus what the mean answer would have scored
+        theta = cov @ (raw - self.mean_answer * self.weights[answered].sum(axis=0)) / self.noise_var
+        unanswered = np.ones(len(self.weights), dtype=bool)
+        unanswered[answered] = False
+        gram = self.outer[unanswered].sum(axis=0)
+        mean = (raw + self.mean_answer * self.weights[unanswered].sum(axis=0) + gram @ theta) / self.engine.normalization
+        return precision, gram, mean, (gram @ cov @ gram + self.noise_var * gram) / self.scale
+
+    def project(self, answered_ids, results: dict) -> tuple:
+        """ Expected full-length result and its (traits x traits) covariance, given the answers so far
+        """
+        return self._project(self._indices(answered_ids), results)[2:]
+
+    def next_question(self, answered_ids, remaining_ids, results: dict) -> str:
+        """ The remaining question whose answer is expected to settle the result the most, ties in remaining order
+        """
+        remaining = self._indices(remaining_ids)
+        precision, gram, mean, projected_cov = self._project(self._indices(answered_ids), results)
+        variance = np.diag(projected_cov)
+        # traits near a threshold decide which meta types show up: standard normal density at every threshold
+        z = (mean - self.thresholds) / np.sqrt(np.maximum(variance, 1e-12))
+        relevance = np.nansum(np.exp(-0.5 * z**2), axis=0)
+
+        grams = gram - self.outer[remaining] # unanswered after answering each candidate
+        covs = np.linalg.inv(precision + self.outer[remaining] / self.noise_var)
+        after = np.einsum("cij,cjk,cki->ci", grams, covs, grams) + self.noise_var * np.einsum("cii->ci", grams)
+        reduction = variance - after / np.diag(self.scale)
+        return str(remaining_ids[int(np.argmax(reduction @ (1.0 + relevance)))])
+
+    def is_settled(self, answered_ids, results: dict) -> tuple:
+        """ -> (stop now?, expected full-length result)
+        """
+        mean, cov = self.project(answered_ids, results)
+        if len(answered_ids) < MIN_QUESTIONS:
+            return False, mean
+        if len(answered_ids) == len(self.weights):
+            return True, mean
+        if np.sqrt(np.max(np.diag(cov))) > MAX_STD:
+            return False, mean
+        samples = mean + self.draws @ np.linalg.cholesky(cov + 1e-12 * np.eye(len(mean))).T
+        expected_types, _ = self.meta_index.top_k(mean, k=3)
+        sample_types, _ = self.meta_index.top_k(samples, k=3)
+        same = (np.argmax(samples, axis=1) == np.argmax(mean)) & \
+            np.all(np.sort(sample_types, axis=1) == np.sort(expected_types, axis=1), axis=1)
+        return bool(np.mean(same) >= CONFIDENCE), mean
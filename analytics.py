@@ -0,0 +1,90 @@
+""" Analytics page over the results log: trait distributions, meta type frequencies and team-average polygons
+
+Everything here is built from ResultAggregates, never from the log rows, so the page costs the same at a
+hundred results as at a few hundred thousand.
+"""
+import numpy as np
+from dash import html, dcc
+import dash_bootstrap_components as dbc
+
+from personality_test import get_result_template, get_result_polygons
+from meta_types import NO_MATCH
+from results_log import ResultAggregates, HIST_BINS
+
+MAX_TEAM_POLYGONS = 8 # largest teams drawn on the hexagon, besides everyone
+REFRESH_INTERVAL = 10 # seconds between refreshes while the page is open
+TEAM_COLORS = ["#ff7f0e", "#2ca02c", "#d62728", "#9467bd", "#e377c2", "#bcbd22", "#17becf", "#8c564b"]
+
+def get_team_overlay(aggregates: ResultAggregates, teams: list, source_url: str = None) -> dict:
+    """ Base hexagon with the average polygon of everyone and of the largest teams
+    """
+    template = get_result_template(source_url, aggregates.means())
+    everyone = dict(template["data"][0], name=f"Everyone ({aggregates.results})", fillcolor="cyan", opacity=0.5)
+
+    counts = aggregates.team_counts.copy()
+    counts[0] = 0 # results without a team are only part of everyone
+    largest = [i for i in np.argsort(-counts, kind="stable")[:MAX_TEAM_POLYGONS] if counts[i] > 0]
+    polygons = get_result_polygons(aggregates.team_means()[largest]) if largest else []
+    traces = [everyone]
+    for color, i, polygon in zip(TEAM_COLORS, largest, polygons):
+        traces.append(dict(type="scatter", name=f"{teams[i]} ({counts[i]})", x=polygon[:, 0].tolist(), y=polygon[:, 1].tolist(),
+                           fill="toself", fillcolor=color, line=dict(color=color), opacity=0.35))
+    layout = dict(template["layout"], showlegend=True, legend=dict(font=dict(color="white")))
+    return {"data": traces, "layout": layout}
+
+def get_trait_distributions(aggregates: ResultAggregates, traits: list) -> dict:
+    """ Heatmap of the share of results in every score bin, one row per trait
+    """
+    edges = np.linspace(0.0, 1.0, HIST_BINS + 1)
+    shares = aggregates.histograms / max(aggregates.results, 1)
+    labels = [f"{low:.2f}-{high:.2f}" for low, high in zip(edges[:-1], edges[1:])]
+    hover = [f"mean {mean:.2f}, std {std:.2f}" for mean, std in zip(aggregates.means(), aggregates.stds())]
+    return {
+        "data": [dict(type="heatmap", x=labels, y=list(traits), z=shares.round(4).tolist(), colorscale="Viridis",
+                      customdata=[[text] * HIST_BINS for text in hover],
+                      hovertemplate="%{y} %{x}: %{z:.1%}<br>%{customdata}<extra></extra>")],
+        "layout": dict(title="Trait score distribution", height=400, xaxis=dict(title="score"), yaxis=dict(autorange="reversed")),
+    }
+
+def get_meta_frequencies(aggregates: ResultAggregates, meta_types: list) -> dict:
+    """ How often every meta type matched, and how often nothing did
+    """
+    counts = aggregates.meta_counts.tolist() + [aggregates.no_match]
+    names = list(meta_types)[:len(aggregates.meta_counts)] + [NO_MATCH] # types added after the snapshot have no counts yet
+    order = np.argsort(counts, kind="stable")
+    return {
+        "data": [dict(type="bar", orientation="h", x=[counts[i] for i in order], y=[names[i] for i in order])],
+        "layout": dict(title="Meta type matches", height=max(300, 24 * len(names)), margin=dict(l=200)),
+    }
+
+def get_summary(aggregates: ResultAggregates) -> str:
+    with_team = int(aggregates.team_counts[1:].sum())
+    summary = f"{aggregates.results} results, {with_team} of them from {np.count_nonzero(aggregates.team_counts[1:])} teams"
+    if aggregates.adaptive:
+        summary += f" ({aggregates.adaptive} adaptive tests that stopped early are left out, their results are partly estimated)"
+    return summary
+
+def get_analytics_page() -> html.Div:
+    """ Hidden until the url is /analytics, filled in by the analytics callback
+    """
+    return html.Div(
+        id='analytics_page',
+        children=[
+            html.H1('Team Analytics'),
+            html.P(id='analytics_summary'),
+            html.P("Add ?team=<name> to the test link to group results by team."),
+            dbc.Row(
+                [
+                    dbc.Col(dcc.Graph(id='analytics_teams'), width="auto"),
+                    dbc.Col(
+                        [
+                            dcc.Graph(id='analytics_traits'),
+                            dcc.Graph(id='analytics_meta'),
+                        ],
+                    ),
+                ]
+            ),
+            dcc.Interval(id='analytics_interval', interval=REFRESH_INTERVAL * 1000, disabled=True),
+        ],
+        hidden=True,
+    )
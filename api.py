@@ -0,0 +1,239 @@
+""" JSON API to score complete answer sheets without going through the Dash UI
+
+    POST /api/score  {"answers": {"H1": "Agree", "Y3": 0, ...}}      -> {"scores": {...}, "meta_types": [...]}
+                     {"sheets": [{...}, {...}], "team": "platform"}   -> {"results": [{"scores": ..., "meta_types": ...}, ...]}
+
+"bank" picks a question bank other than the default one (see question_banks.py).
+
+Answers are the option text or its index in the form (0 = "Strongly Agree"), like batch_score.py, and every
+question in questions.json has to be answered. Invalid requests get a 400 with {"error": ...}.
+
+Sheets from concurrent requests are queued and scored together by a ScoreBatcher: one score_batch and one
+match_batch for everything that arrived within BATCH_WINDOW seconds. It serves the Flask route from any number
+of threads and asyncio code through score_async, see asgi.py for running the API on an asyncio server.
+"""
+import asyncio
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from scoring import ScoringEngine
+from meta_types import MetaTypeIndex
+
+MAX_SHEETS = 1000 # per request
+BATCH_WINDOW = 0.002 # seconds to wait for more sheets once the first one is queued
+BATCH_MAX = 8192 # sheets scored in one pass at most
+RESULT_TIMEOUT = 30 # seconds
+
+class APIError(ValueError):
+    """ Problem with the request, reported back to the client
+    """
+
+class ScoreBatcher:
+    """ Scores sheets queued from many threads in shared vectorized passes, on one background thread per process
+    """
+    def __init__(self, engine: ScoringEngine, meta_index: MetaTypeIndex, window: float = BATCH_WINDOW, max_batch: int = BATCH_MAX):
+        self.engine = engine
+        self.meta_index = meta_index
+        self.window = window
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._pid = None
+        self.batches = 0 # passes run so far, with `sheets` makes the average batch size
+        self.sheets = 0
+
+    def _ensure_thread(self):
+        # started on first use so it lives in the worker process, not in a preloading parent
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue()
+                    threading.Thread(target=self._run, name="score-batcher", daemon=True).start()
+                    self._pid = os.getpid()
+
+    def submit(self, values: np.ndarray, bank=None) -> Future:
+        """ Queue (N x questions) answer values -> Future of ((N x traits) scores, N lists of meta type names)
+
+        bank: anything with an engine and meta_index (a QuestionBank) to score with instead of the batcher's own
+        """
+        self._ensure_thread()
+        future = Future()
+        engine, meta_index = (bank.engine, bank.meta_index) if bank is not None else (self.engine, self.meta_index)
+        self._queue.put((np.atleast_2d(values), future, engine, meta_index))
+        return future
+
+    def score(self, values: np.ndarray, bank=None, timeout: float = RESULT_TIMEOUT) -> tuple:
+        return self.submit(values, bank).result(timeout)
+
+    async def score_async(self, values: np.ndarray, bank=None) -> tuple:
+        return await asyncio.wrap_future(self.submit(values, bank))
+
+    def _run(self):
+        while True:
+            pending = [self._queue.get()]
+            try:
+                size = len(pending[0][0])
+                deadline = time.monotonic() + self.window
+                while size < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = self._queue.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                    pending.append(item)
+                    size += len(item[0])
+                # one pass per question bank in the batch
+                by_engine = {}
+                for item in pending:
+                    by_engine.setdefault(id(item[2]), []).append(item)
+                for items in by_engine.values():
+                    self._score_pending(items)
+            except Exception as e:
+                # fail this batch, never the thread: every later request would wait for it forever
+                for _, future, *_ in pending:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _score_pending(self, pending: list):
+        # a caller can give up on its future (e.g. an ASGI client that disconnected), those are skipped and
+        # the rest can no longer be cancelled
+        pending = [item for item in pending if item[1].set_running_or_notify_cancel()]
+        if not pending:
+            return
+        _, _, engine, meta_index = pending[0]
+        try:
+            scores = engine.score_batch(np.concatenate([values for values, *_ in pending]))
+            meta_types = meta_index.match_batch(scores, k=3) # same as get_meta_results
+        except Exception as e:
+            for _, future, *_ in pending:
+                future.set_exception(e)
+            return
+        self.batches += 1
+        self.sheets += len(scores)
+        start = 0
+        for values, future, *_ in pending:
+            stop = start + len(values)
+            future.set_result((scores[start:stop], meta_types[start:stop]))
+            start = stop
+
+def encode_sheets(body, engine: ScoringEngine) -> tuple:
+    """ Validate a request body against the question bank -> ((N x questions) answer values, single sheet?)
+    """
+    if not isinstance(body, dict) or ("answers" in body) == ("sheets" in body):
+        raise APIError('Expected a JSON object with either "answers" (one sheet) or "sheets" (a list of sheets)')
+    single = "answers" in body
+    sheets = [body["answers"]] if single else body["sheets"]
+    if not isinstance(sheets, list) or not 0 < len(sheets) <= MAX_SHEETS:
+        raise APIError(f'"sheets" must be a list of 1 to {MAX_SHEETS} sheets')
+
+    values = np.empty((len(sheets), len(engine)))
+    for i, sheet in enumerate(sheets):
+        where = "answers" if single else f"sheet {i}"
+        if not isinstance(sheet, dict):
+            raise APIError(f"{where}: expected an object of question id -> answer")
+        unknown = [qid for qid in sheet if qid not in engine.question_index]
+        if unknown:
+            raise APIError(f"{where}: unknown questions {', '.join(map(str, unknown[:5]))}")
+        if any(isinstance(answer, bool) for answer in sheet.values()):
+            raise APIError(f"{where}: answers are option texts or option indices")
+        try:
+            values[i] = engine.encode_sheet(sheet)
+        except ValueError as e:
+            raise APIError(f"{where}: {e}") from None
+    return values, single
+
+def get_bank(body, banks):
+    """ Bank named in the request, None for the batcher's own
+    """
+    name = body.get("bank")
+    if name is None:
+        return banks.get() if banks is not None else None
+    if banks is None or name not in banks.names():
+        raise APIError(f"Unknown question bank: {name!r}")
+    return banks.get(name)
+
+def format_results(scores: np.ndarray, meta_types: list, engine: ScoringEngine, single: bool) -> dict:
+    results = [{"scores": engine.to_dict(result), "meta_types": meta} for result, meta in zip(scores, meta_types)]
+    return results[0] if single else {"results": results}
+
+def log_results(results_log, scores: np.ndarray, meta_index: MetaTypeIndex, team: str):
+    """ Log every meta type each result matches, not just the 3 in the response
+    """
+    if results_log is None:
+        return
+    team_index = results_log.team_index(team if isinstance(team, str) else "")
+    masks = [results_log.meta_mask(matches) for matches in meta_index.match_all(scores)]
+    results_log.append_batch(scores, masks, [team_index] * len(scores))
+
+def register_api(server, batcher: ScoreBatcher, prefix: str = "/api", results_log=None, banks=None):
+    """ Mount the API on the Flask server behind the Dash app, banks is a BankRegistry to pick banks from
+    """
+    import flask
+
+    @server.route(f"{prefix}/score", methods=["POST"])
+    def api_score():
+        body = flask.request.get_json(silent=True)
+        try:
+            bank = get_bank(body if isinstance(body, dict) else {}, banks)
+            engine = bank.engine if bank is not None else batcher.engine
+            values, single = encode_sheets(body, engine)
+        except APIError as e:
+            return flask.jsonify(error=str(e)), 400
+        scores, meta_types = batcher.score(values, bank)
+        log_results(results_log, scores, bank.meta_index if bank is not None else batcher.meta_index, body.get("team"))
+        return flask.jsonify(format_results(scores, meta_types, engine, single))
+
+def get_asgi_app(batcher: ScoreBatcher, prefix: str = "/api", results_log=None, banks=None):
+    """ The same API as a plain ASGI application (no framework needed), e.g. for uvicorn
+    """
+    async def send_json(send, status: int, payload: dict):
+        body = json.dumps(payload).encode()
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]})
+        await send({"type": "http.response.body", "body": body})
+
+    async def app(scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown":
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+        if scope["type"] != "http":
+            return
+        if scope["path"] != f"{prefix}/score":
+            return await send_json(send, 404, {"error": "Not found"})
+        if scope["method"] != "POST":
+            return await send_json(send, 405, {"error": "Method not allowed"})
+
+        chunks = []
+        while True:
+            message = await receive()
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body"):
+                break
+        try:
+            body = json.loads(b"".join(chunks) or b"null")
+            bank = get_bank(body if isinstance(body, dict) else {}, banks)
+            engine = bank.engine if bank is not None else batcher.engine
+            values, single = encode_sheets(body, engine)
+        except ValueError as e: # APIError, or a body that isn't JSON
+            return await send_json(send, 400, {"error": str(e)})
+        scores, meta_types = await batcher.score_async(values, bank)
+        if results_log is not None:
+            # the log takes a file lock and writes to disk, off the event loop
+            await asyncio.get_running_loop().run_in_executor(
+                None, log_results, results_log, scores, bank.meta_index if bank is not None else batcher.meta_index, body.get("team"))
+        await send_json(send, 200, format_results(scores, meta_types, engine, single))
+
+    return app
@@ -0,0 +1,18 @@
+""" Asyncio entry point for the scoring API on its own, without the Dash UI
+
+    uvicorn asgi:app --app-dir personality_test_app --workers 4
+
+Serves the same POST /api/score as the Flask server in personality_app.py, with concurrent requests scored
+together by the ScoreBatcher.
+"""
+import os
+
+from bundle import get_app_data
+from api import ScoreBatcher, get_asgi_app
+from question_banks import get_bank_registry
+from results_log import get_results_log
+
+app_data = get_app_data()
+question_banks = get_bank_registry(app_data, os.environ.get("PERSONALITY_BANKS") or None)
+results_log = get_results_log(os.environ.get("PERSONALITY_RESULTS_LOG", ""), app_data.engine.traits, list(app_data.meta_index.names))
+app = get_asgi_app(ScoreBatcher(app_data.engine, app_data.meta_index), results_log=results_log, banks=question_banks)
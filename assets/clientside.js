@@ -0,0 +1,143 @@
+// Browser-side versions of the question callbacks in personality_app.py.
+// Only registered when the app runs with PERSONALITY_CLIENTSIDE=1, in which
+// case the question bank is shipped once in the 'question_bank_stored' store
+// and only the final results step talks to the server.
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    personality: {
+        cycle_questions: function(n1, n2, n3, selection, q_index, test_results, question_ids, input_name, stored_name, bank) {
+            const ctx = window.dash_clientside.callback_context;
+            const triggered_id = ctx.triggered_id !== undefined
+                ? ctx.triggered_id
+                : (ctx.triggered.length ? ctx.triggered[0].prop_id.split('.')[0] : null);
+
+            const local_test_results = Object.assign({}, test_results);
+            let hide_next_btn = false;
+            let hide_result_btn = true;
+            let hide_form_div = false;
+            const disable_next_btn = true;
+            let disable_reset_btn = true;
+            let disable_start_btn = false;
+            const hide_screenshot_msg = true;
+            let hide_troll_question = true;
+            let name_output = stored_name;
+            const form_reset = null; // reset the form value each time the questions are cycled
+
+            const question_text = function(idx) {
+                return `Q${idx+1}/${bank.ids.length}: ${bank.questions[question_ids[idx]].text}`;
+            };
+            const question_debug = function(idx) {
+                return `[${bank.questions[question_ids[idx]].type.join(', ')}]`;
+            };
+            const score_debug = function() {
+                return JSON.stringify(Object.entries(local_test_results));
+            };
+            const pack = function(text, results, index, debug_text, score_debug_text) {
+                return [text,
+                        hide_next_btn,
+                        hide_result_btn,
+                        hide_form_div,
+                        disable_next_btn,
+                        disable_reset_btn,
+                        disable_start_btn,
+                        form_reset,
+                        results,
+                        index,
+                        question_ids,
+                        debug_text,
+                        score_debug_text,
+                        hide_screenshot_msg,
+                        hide_troll_question,
+                        name_output];
+            };
+
+            if (triggered_id === 'start_btn' || triggered_id === 'reset_btn') {
+                // randomize question order each time (Fisher-Yates)
+                question_ids = bank.ids.slice();
+                for (let i = question_ids.length - 1; i > 0; i--) {
+                    const j = Math.floor(Math.random() * (i + 1));
+                    [question_ids[i], question_ids[j]] = [question_ids[j], question_ids[i]];
+                }
+                hide_troll_question = false;
+                hide_form_div = true;
+                return pack("", Object.assign({}, bank.original_results), 0, "", "");
+            }
+
+            // Need to update the stored name after the first cycle
+            if (q_index === 0 && stored_name.length === 0) {
+                name_output = input_name;
+                // Do a little trolling
+                if (bank.troll_names.includes(input_name.toLowerCase())) {
+                    hide_next_btn = true;
+                    hide_form_div = true;
+                    hide_result_btn = false;
+                    disable_reset_btn = false;
+                    disable_start_btn = true;
+                    return pack("", local_test_results, q_index, "", "");
+                }
+                return pack(question_text(q_index), local_test_results, q_index, question_debug(q_index), score_debug());
+            }
+
+            // Increment results for the question that was just answered
+            const question = bank.questions[question_ids[q_index]];
+            const value = bank.conversion[bank.options.indexOf(selection)];
+            question.type.forEach(function(item, idx) {
+                local_test_results[item] = local_test_results[item] + value * question.scale[idx] / bank.normalization[item];
+            });
+
+            // Return if the last question was just answered
+            if (q_index + 1 === bank.ids.length) {
+                hide_next_btn = true;
+                hide_form_div = true;
+                hide_result_btn = false;
+                disable_reset_btn = false;
+                disable_start_btn = true;
+                return pack("", local_test_results, q_index, "", "");
+            }
+
+            // Need to set up for the next question
+            q_index += 1;
+            return pack(question_text(q_index), local_test_results, q_index, question_debug(q_index), score_debug());
+        },
+
+        // Warm the HTTP cache with every possible result image while the questions are being answered.
+        // Each one is loaded through an off-page <picture> with the same sources as the real one, so the
+        // browser downloads exactly the variant it will pick once the result is shown. Only resized variants
+        // are sent (see get_result_images_data), at low priority so they never compete with the questions.
+        prefetch_result_images: function(n_clicks, images) {
+            if (!images || !images.length || window._personality_prefetched) {
+                return window.dash_clientside.no_update;
+            }
+            window._personality_prefetched = true;
+            images.forEach(function(image) {
+                const picture = document.createElement('picture');
+                [['image/avif', image.avif], ['image/webp', image.webp]].forEach(function([type, srcset]) {
+                    if (srcset) {
+                        const source = document.createElement('source');
+                        source.type = type;
+                        source.srcset = srcset;
+                        source.sizes = image.sizes;
+                        picture.appendChild(source);
+                    }
+                });
+                // the img has to be inside the picture before it gets a src, or the original file is fetched too
+                const img = document.createElement('img');
+                img.decoding = 'async';
+                img.fetchPriority = 'low';
+                img.sizes = image.sizes;
+                picture.appendChild(img);
+                img.src = image.src;
+            });
+            return true;
+        },
+
+        // /analytics swaps the test for the analytics page and starts its refresh interval.
+        // The test page is the initial state, so it changes nothing and never wakes the analytics callback.
+        show_page: function(pathname) {
+            if (!pathname || !pathname.replace(/\/+$/, '').endsWith('/analytics')) {
+                const no_update = window.dash_clientside.no_update;
+                return [no_update, no_update, no_update];
+            }
+            return [true, false, false];
+        }
+    }
+});
@@ -0,0 +1,206 @@
+""" Score answer sheets from CSV or JSONL dumps without going through the Dash UI
+
+Every row/line is one answer sheet keyed by question id (H1, Y3, ...) with the selected option as its text
+("Strongly Agree") or its index in the form (0 = "Strongly Agree" ... 5 = "Strongly Disagree"). An optional
+"id" column/key is copied to the output. Scoring uses the same ScoringEngine as the app, so trait vectors and
+meta types match what the web app would show.
+
+A sheet that can't be scored (missing or unknown answers, a line that isn't a JSON object) doesn't stop the
+run: its output row has empty scores and an "error" naming the input line, the failures are listed at the
+end and the exit status is 1.
+
+    python batch_score.py answers.csv results.csv
+    python batch_score.py answers.jsonl results.jsonl --workers 8 --chunk-size 20000
+    python batch_score.py answers.csv results.csv --nearest 3 --profiles custom_profiles.json
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from scoring import ScoringEngine, TRAITS
+from meta_types import MetaTypeIndex, ArchetypeIndex
+
+app_folder = os.path.dirname(os.path.abspath(__file__))
+ID_FIELD = "id"
+ERROR_FIELD = "error"
+_questions_path = os.path.join(app_folder, "questions.json")
+_meta_path = os.path.join(app_folder, "meta_traits.json")
+
+# Set once per process by init_worker so chunks only carry the answers
+_engine: ScoringEngine = None
+_meta_index: MetaTypeIndex = None
+_archetypes: ArchetypeIndex = None
+_nearest = 0
+
+def init_worker(questions_path: str, meta_path: str, profiles_path: str = None, nearest: int = 0):
+    global _engine, _meta_index, _archetypes, _nearest
+    with open(questions_path, encoding="utf8") as f:
+        _engine = ScoringEngine(json.load(f))
+    with open(meta_path, encoding="utf8") as f:
+        meta_json = json.load(f)
+    _meta_index = MetaTypeIndex.from_dict(meta_json)
+    _nearest = nearest
+    if nearest:
+        profile_dicts = [meta_json]
+        if profiles_path:
+            with open(profiles_path, encoding="utf8") as f:
+                profile_dicts.append(json.load(f))
+        _archetypes = ArchetypeIndex.from_dicts(*profile_dicts)
+
+def parse_answer(value):
+    """ CSV cells are always strings, so numeric option indices need converting back
+    """
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value)
+    return value
+
+def score_chunk(rows: list) -> list:
+    """ Score a list of (input line, answer sheet) -> list of output records, with an error for the sheets
+    that can't be scored
+    """
+    values = np.empty((len(rows), len(_engine)))
+    errors = [None] * len(rows)
+    for i, (line, row) in enumerate(rows):
+        try:
+            if not isinstance(row, dict):
+                raise ValueError("not a JSON object")
+            values[i] = _engine.encode_sheet({qid: parse_answer(row[qid]) for qid in _engine.question_ids if qid in row})
+        except ValueError as e:
+            errors[i] = f"line {line}: {e}"
+    valid = np.array([error is None for error in errors], dtype=bool)
+    scores = _engine.score_batch(values[valid])
+    meta_types = _meta_index.match_batch(scores, k=3) # same as get_meta_results, for the whole chunk at once
+    nearest = _archetypes.match_batch(scores, k=_nearest) if _nearest else [None] * len(scores)
+
+    records = []
+    scored = iter(zip(scores, meta_types, nearest))
+    for (_, row), error in zip(rows, errors):
+        record = {ID_FIELD: row.get(ID_FIELD, "") if isinstance(row, dict) else ""}
+        if error is not None:
+            record.update({trait: None for trait in _engine.traits})
+            record.update({"meta_types": [], ERROR_FIELD: error})
+            records.append(record)
+            continue
+        result, meta, closest = next(scored)
+        record.update(_engine.to_dict(result))
+        record["meta_types"] = meta
+        if closest is not None:
+            record["nearest"] = [[name, round(distance, 4)] for name, distance in closest]
+        records.append(record)
+    return records
+
+def read_sheets(path: str, fmt: str):
+    """ Stream (input line, answer sheet) one at a time, the sheet is None for a line that isn't valid JSON
+    """
+    with open(path, encoding="utf8", newline="") as f:
+        if fmt == "csv":
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, row
+        else:
+            for line, text in enumerate(f, start=1):
+                if not text.strip():
+                    continue
+                try:
+                    yield line, json.loads(text)
+                except ValueError:
+                    yield line, None
+
+def read_chunks(path: str, fmt: str, chunk_size: int):
+    chunk = []
+    for sheet in read_sheets(path, fmt):
+        chunk.append(sheet)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+class RecordWriter:
+    """ Writes scored records as CSV (meta types joined with ';', nearest archetypes as name:distance) or JSONL
+    """
+    def __init__(self, f, fmt: str, nearest: bool = False):
+        self.fmt = fmt
+        self.f = f
+        if fmt == "csv":
+            self.writer = csv.DictWriter(f, fieldnames=[ID_FIELD, *TRAITS, "meta_types"] + (["nearest"] if nearest else []) + [ERROR_FIELD])
+            self.writer.writeheader()
+
+    def write(self, records: list):
+        for record in records:
+            if self.fmt == "csv":
+                row = {**record, "meta_types": ";".join(record["meta_types"])}
+                if "nearest" in record:
+                    row["nearest"] = ";".join(f"{name}:{distance}" for name, distance in record["nearest"])
+                self.writer.writerow(row)
+            else:
+                self.f.write(json.dumps(record) + "\n")
+
+def scored_chunks(chunks, workers: int, init_args: tuple):
+    """ Score chunks in order, with at most 2 chunks per worker in flight so memory stays bounded
+    """
+    if workers <= 1:
+        for chunk in chunks:
+            yield score_chunk(chunk)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=init_args) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(score_chunk, chunk))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def get_format(path: str, fmt: str) -> str:
+    if fmt:
+        return fmt
+    return "csv" if path.lower().endswith(".csv") else "jsonl"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score personality test answer sheets in bulk")
+    parser.add_argument("input", help="CSV or JSONL file of answer sheets")
+    parser.add_argument("output", help="CSV or JSONL file for trait vectors and meta types ('-' for stdout)")
+    parser.add_argument("--input-format", choices=["csv", "jsonl"], help="defaults to the input file extension")
+    parser.add_argument("--output-format", choices=["csv", "jsonl"], help="defaults to the output file extension")
+    parser.add_argument("--chunk-size", type=int, default=10000, help="answer sheets scored per batch")
+    parser.add_argument("--workers", type=int, default=1, help="number of scoring processes")
+    parser.add_argument("--questions", default=_questions_path)
+    parser.add_argument("--meta-traits", default=_meta_path)
+    parser.add_argument("--nearest", type=int, default=0, help="also write the K closest archetypes with their distances")
+    parser.add_argument("--profiles", help="custom archetype profiles (meta_traits.json format) added to the meta types for --nearest")
+    args = parser.parse_args(argv)
+
+    init_args = (args.questions, args.meta_traits, args.profiles, args.nearest)
+    init_worker(*init_args)
+
+    in_fmt = get_format(args.input, args.input_format)
+    out_fmt = get_format(args.output, args.output_format)
+    out = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf8", newline="")
+    try:
+        writer = RecordWriter(out, out_fmt, nearest=args.nearest > 0)
+        n = 0
+        errors = []
+        for records in scored_chunks(read_chunks(args.input, in_fmt, args.chunk_size), args.workers, init_args):
+            writer.write(records)
+            n += len(records)
+            errors += [record for record in records if ERROR_FIELD in record]
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print(f"Scored {n - len(errors)} answer sheets", file=sys.stderr)
+    if errors:
+        print(f"{len(errors)} answer sheets could not be scored, see the {ERROR_FIELD} field:", file=sys.stderr)
+        for record in errors[:10]:
+            print(f"  {record[ERROR_FIELD]}" + (f" (id {record[ID_FIELD]})" if record[ID_FIELD] else ""), file=sys.stderr)
+    return 1 if errors else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
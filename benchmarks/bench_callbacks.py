@@ -0,0 +1,99 @@
+""" Per-call latency and allocations of the app callbacks and the helpers they use
+
+    python benchmarks/bench_callbacks.py               # call the functions directly
+    python benchmarks/bench_callbacks.py --http        # also time every callback through app.server, JSON included
+
+Latency is reported as min/median/p99 over --repeat calls, allocations as the bytes allocated by one call and
+its peak memory (tracemalloc, measured in a separate pass so it doesn't skew the timings).
+"""
+import argparse
+import gc
+import time
+import tracemalloc
+
+import numpy as np
+
+from dash_client import setup_app_path, FlaskTransport, DashSession, run_test, percentile
+
+setup_app_path()
+
+import personality_app as app_module
+from personality_test import get_result_plot, get_meta_results
+
+def measure(fn, repeat: int) -> dict:
+    fn() # warm up caches
+    times = []
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - start)
+    finally:
+        gc.enable()
+
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    fn()
+    after, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"min": min(times), "p50": percentile(times, 50), "p99": percentile(times, 99),
+            "retained": after - before, "peak": peak - before}
+
+def function_cases(rng: np.random.Generator) -> dict:
+    """ Calls representative of one step of a session
+    """
+    engine = app_module.scoring_engine
+    question_ids = list(engine.question_ids)
+    results = dict(zip(app_module.TRAITS, rng.uniform(0, 1, 8)))
+    result_array = np.array(list(results.values()))
+    selection = app_module.form_options[1]
+
+    return {
+        # cycle_questions reads the trigger from the Dash context, advance_questions is everything after that
+        "cycle_questions (answer)": lambda: app_module.advance_questions("next_btn", selection, 10, results, question_ids, "bench", "bench"),
+        "cycle_questions (start)": lambda: app_module.advance_questions("start_btn", None, 0, results, list(question_ids), "", ""),
+        "return_test_results": lambda: app_module.return_test_results(1, results, "bench"),
+        "reset_results": lambda: app_module.reset_results(1),
+        "get_result_plot": lambda: get_result_plot(result_array),
+        "get_meta_results": lambda: get_meta_results(result_array, app_module.meta_index),
+    }
+
+def http_timings(sessions: int) -> dict:
+    """ Callback timings through the full Dash request path for a number of complete tests, each one reset at the end
+    """
+    transport = FlaskTransport(app_module.app.server)
+    dependencies = transport.get_json("/_dash-dependencies")
+    layout = transport.get_json("/_dash-layout")
+    timings = {}
+    for i in range(sessions):
+        session = DashSession.connect(transport, dependencies, layout)
+        run_test(session, app_module.form_options[i % 6:] + app_module.form_options[:i % 6])
+        session.click("reset_btn") # fires reset_results (and cycle_questions starting over), like the Retake button
+        for name, elapsed, size in session.timings:
+            timings.setdefault(name, []).append((elapsed, size))
+    return timings
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--repeat", type=int, default=200, help="calls per function")
+    parser.add_argument("--http", action="store_true", help="also time callbacks through app.server")
+    parser.add_argument("--sessions", type=int, default=20, help="complete tests to run with --http")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'function':<28}{'min us':>10}{'p50 us':>10}{'p99 us':>10}{'alloc KB':>10}{'peak KB':>10}")
+    for name, fn in function_cases(np.random.default_rng(args.seed)).items():
+        m = measure(fn, args.repeat)
+        print(f"{name:<28}{m['min']*1e6:>10.1f}{m['p50']*1e6:>10.1f}{m['p99']*1e6:>10.1f}{m['retained']/1024:>10.1f}{m['peak']/1024:>10.1f}")
+
+    if args.http:
+        print(f"\n{'callback (via app.server)':<28}{'calls':>10}{'p50 us':>10}{'p99 us':>10}{'p50 bytes':>10}")
+        for name, values in sorted(http_timings(args.sessions).items()):
+            times = [t for t, _ in values]
+            sizes = [s for _, s in values]
+            print(f"{name:<28}{len(values):>10}{percentile(times, 50)*1e6:>10.1f}{percentile(times, 99)*1e6:>10.1f}{percentile(sizes, 50):>10}")
+
+if __name__ == "__main__":
+    main()
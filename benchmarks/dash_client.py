@@ -0,0 +1,164 @@
+""" Minimal Dash client that drives the app the way the browser does, through /_dash-update-component
+
+Works in-process against app.server (Flask test client) or over HTTP against a running server.
+"""
+import json
+import os
+import sys
+import time
+import urllib.request
+from abc import ABC, abstractmethod
+
+app_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def setup_app_path():
+    """ Make the app modules importable, like gunicorn.conf.py does
+    """
+    if app_folder not in sys.path:
+        sys.path.insert(0, app_folder)
+
+class Transport(ABC):
+    """ How requests reach the app, in-process or over HTTP
+    """
+    @abstractmethod
+    def get_json(self, path: str):
+        pass
+
+    @abstractmethod
+    def post_json(self, path: str, body: dict) -> tuple:
+        """ returns: (status code, response bytes)
+        """
+
+class FlaskTransport(Transport):
+    def __init__(self, server):
+        self.client = server.test_client()
+
+    def get_json(self, path: str):
+        return self.client.get(path).get_json()
+
+    def post_json(self, path: str, body: dict) -> tuple:
+        response = self.client.post(path, json=body)
+        return response.status_code, response.data
+
+class HTTPTransport(Transport):
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+
+    def get_json(self, path: str):
+        with urllib.request.urlopen(self.url + path) as response:
+            return json.load(response)
+
+    def post_json(self, path: str, body: dict) -> tuple:
+        request = urllib.request.Request(self.url + path, data=json.dumps(body).encode(), headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request) as response:
+            return response.status, response.read()
+
+class DashSession:
+    """ One simulated user: keeps the component properties the callbacks read and fires every server-side
+    callback a button click triggers, the same requests the browser would send
+    """
+    def __init__(self, transport: Transport, dependencies: list, initial: dict = None):
+        self.transport = transport
+        self.dependencies = [dep for dep in dependencies if not dep.get("clientside_function")]
+        self.props = dict(initial or {})
+        self.timings = [] # (callback name, seconds, response bytes)
+
+    @classmethod
+    def connect(cls, transport: Transport, dependencies: list = None, layout: dict = None) -> "DashSession":
+        """ New session starting from the page layout, pass dependencies/layout to skip fetching them again
+        """
+        dependencies = dependencies if dependencies is not None else transport.get_json("/_dash-dependencies")
+        layout = layout if layout is not None else transport.get_json("/_dash-layout")
+        return cls(transport, dependencies, layout_props(layout))
+
+    def set(self, component_id: str, prop: str, value):
+        self.props[f"{component_id}.{prop}"] = value
+
+    def get(self, component_id: str, prop: str, default=None):
+        return self.props.get(f"{component_id}.{prop}", default)
+
+    def click(self, button: str) -> dict:
+        """ Fire every callback triggered by clicking `button`, returns the updated properties
+        """
+        self.props[f"{button}.n_clicks"] = self.props.get(f"{button}.n_clicks", 0) + 1
+        updated = {}
+        for dep in self.dependencies:
+            if not any(i["id"] == button and i["property"] == "n_clicks" for i in dep["inputs"]):
+                continue
+            outputs = dep["output"].strip(".").split("...")
+            body = {
+                "output": dep["output"],
+                "outputs": [{"id": o.split(".")[0], "property": o.split(".")[1].split("@")[0]} for o in outputs],
+                "inputs": [{"id": i["id"], "property": i["property"], "value": self.get(i["id"], i["property"])} for i in dep["inputs"]],
+                "changedPropIds": [f"{button}.n_clicks"],
+                "state": [{"id": s["id"], "property": s["property"], "value": self.get(s["id"], s["property"])} for s in dep["state"]],
+            }
+            start = time.perf_counter()
+            status, data = self.transport.post_json("/_dash-update-component", body)
+            elapsed = time.perf_counter() - start
+            self.timings.append((callback_name(dep), elapsed, len(data)))
+            if status == 204:
+                continue
+            if status != 200:
+                raise RuntimeError(f"{callback_name(dep)} failed with {status}: {data[:200]!r}")
+            for component_id, props in json.loads(data)["response"].items():
+                for prop, value in props.items():
+                    self.set(component_id, prop, value)
+                    updated[f"{component_id}.{prop}"] = value
+        return updated
+
+def callback_name(dep: dict) -> str:
+    """ Name of the app function behind a callback, told apart by its trigger and first output
+    """
+    first = dep["output"].strip(".").split("...")[0].split("@")[0]
+    triggers = {i["id"] for i in dep["inputs"]}
+    if "result_btn" in triggers:
+        return "return_test_results"
+    if first == "result_plot.figure":
+        return "reset_results"
+    if first == "form_question.children":
+        return "cycle_questions"
+    if first == "next_btn.disabled":
+        return "enable_next_btn"
+    return first
+
+def layout_props(layout) -> dict:
+    """ Initial "id.prop" values of every component with an id in a /_dash-layout tree
+    """
+    props = {}
+    stack = [layout]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(node)
+        elif isinstance(node, dict) and "props" in node:
+            component_props = node["props"]
+            if isinstance(component_props.get("id"), str):
+                for prop, value in component_props.items():
+                    if prop != "children" or not isinstance(value, (dict, list)):
+                        props[f"{component_props['id']}.{prop}"] = value
+            stack.append(component_props.get("children"))
+    return props
+
+def run_test(session: DashSession, answers: list, name: str = "benchmark") -> dict:
+    """ Take the whole test: start, enter a name, answer until the results button shows up, get results
+
+    answers: form options, used in order and cycled if there are fewer than questions
+    returns: the properties updated by the results step
+    """
+    session.click("start_btn")
+    session.set("troll_name", "value", name)
+    session.click("next_btn")
+    i = 0
+    while session.get("result_btn", "hidden", True):
+        session.set("form_select", "value", answers[i % len(answers)])
+        session.click("next_btn")
+        i += 1
+    return session.click("result_btn")
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    if not values:
+        return float("nan")
+    idx = min(len(values) - 1, max(0, round(q / 100 * (len(values) - 1))))
+    return values[idx]
@@ -0,0 +1,79 @@
+""" Load generator: many simulated users each taking the full test against app.server
+
+    python benchmarks/load_test.py --users 50 --sessions 4                 # in-process, through the Flask test client
+    python benchmarks/load_test.py --users 200 --url http://127.0.0.1:8080 # against a running server (e.g. server.sh)
+
+Every user runs whole tests back to back (start, name, every question, results) in its own thread and the
+report gives throughput plus p50/p99 latency per callback. In-process runs share one interpreter, so they
+measure the app's own cost per request rather than what a multi-worker deployment can do.
+"""
+import argparse
+import random
+import threading
+import time
+
+from dash_client import setup_app_path, FlaskTransport, HTTPTransport, DashSession, run_test, percentile
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--users", type=int, default=20, help="concurrent simulated users")
+    parser.add_argument("--sessions", type=int, default=2, help="complete tests per user")
+    parser.add_argument("--url", help="base url of a running server, in-process when omitted")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.url:
+        make_transport = lambda: HTTPTransport(args.url)
+        form_options = ["Strongly Agree", "Agree", "Slightly Agree", "Slightly Disagree", "Disagree", "Strongly Disagree"]
+    else:
+        setup_app_path()
+        import personality_app
+        make_transport = lambda: FlaskTransport(personality_app.app.server)
+        form_options = personality_app.form_options
+
+    setup = make_transport()
+    dependencies = setup.get_json("/_dash-dependencies")
+    layout = setup.get_json("/_dash-layout")
+
+    timings = []
+    errors = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(args.users + 1)
+
+    def user(i: int):
+        rng = random.Random(args.seed + i)
+        transport = make_transport()
+        barrier.wait()
+        for _ in range(args.sessions):
+            session = DashSession.connect(transport, dependencies, layout)
+            try:
+                run_test(session, [rng.choice(form_options) for _ in range(64)], name=f"user{i}")
+            except Exception as err:
+                with lock:
+                    errors.append(repr(err))
+            with lock:
+                timings.extend(session.timings)
+
+    threads = [threading.Thread(target=user, args=(i,)) for i in range(args.users)]
+    for t in threads:
+        t.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    completed = args.users * args.sessions - len(errors)
+    print(f"{args.users} users x {args.sessions} tests in {elapsed:.2f} s: {completed / elapsed:.1f} tests/s, {len(timings) / elapsed:.1f} requests/s, {len(errors)} errors")
+    print(f"\n{'callback':<24}{'requests':>10}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}{'KB/req':>10}")
+    by_name = {}
+    for name, seconds, size in timings:
+        by_name.setdefault(name, []).append((seconds, size))
+    for name, values in sorted(by_name.items()):
+        times = [t for t, _ in values]
+        print(f"{name:<24}{len(values):>10}{percentile(times, 50)*1e3:>10.2f}{percentile(times, 99)*1e3:>10.2f}{max(times)*1e3:>10.2f}{sum(s for _, s in values) / len(values) / 1024:>10.2f}")
+    for err in errors[:5]:
+        print("error:", err)
+
+if __name__ == "__main__":
+    main()
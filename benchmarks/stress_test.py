@@ -0,0 +1,112 @@
+""" Concurrency stress test: many sessions taking the test at once must get exactly what they get one at a time
+
+    python benchmarks/stress_test.py --sessions 200 --threads 32                  # in-process, through the Flask test client
+    python benchmarks/stress_test.py --threads 64 --url http://127.0.0.1:8080     # against a running server (e.g. server.sh)
+
+Every session has its own ?seed= (so its question order is reproducible) and its own answers, every other one
+runs in adaptive mode. The sessions are first run one after another as the reference, then all at once from
+--threads threads, hammering cycle_questions and return_test_results. Each concurrent session must show the
+same questions in the same order and end with the same scores, figure, meta types and share link as its
+reference run. Exits with status 1 on any difference.
+"""
+import argparse
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dash_client import setup_app_path, FlaskTransport, HTTPTransport, DashSession, percentile
+
+RESULT_PROPS = ["test_results_stored.data", "result_plot.figure", "meta_result_header.children", "share_link.href", "meme_img.src"]
+
+def take_test(session: DashSession, answers: list, name: str) -> dict:
+    """ run_test that also records every question shown -> {"questions": [...], result props...}
+    """
+    questions = []
+    session.click("start_btn")
+    session.set("troll_name", "value", name)
+    questions.append(session.click("next_btn").get("form_question.children"))
+    i = 0
+    while session.get("result_btn", "hidden", True):
+        session.set("form_select", "value", answers[i % len(answers)])
+        updated = session.click("next_btn")
+        if not updated.get("form_div.hidden"):
+            questions.append(updated.get("form_question.children"))
+        i += 1
+    record = {"questions": questions, "test_results_stored.data": session.get("test_results_stored", "data")}
+    updated = session.click("result_btn")
+    record.update({prop: updated.get(prop) for prop in RESULT_PROPS if prop != "test_results_stored.data"})
+    return record
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--sessions", type=int, default=200, help="tests to run, each with its own seed and answers")
+    parser.add_argument("--threads", type=int, default=32, help="threads running them concurrently")
+    parser.add_argument("--url", help="base url of a running server, in-process when omitted")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.url:
+        make_transport = lambda: HTTPTransport(args.url)
+        form_options = ["Strongly Agree", "Agree", "Slightly Agree", "Slightly Disagree", "Disagree", "Strongly Disagree"]
+    else:
+        setup_app_path()
+        import personality_app
+        make_transport = lambda: FlaskTransport(personality_app.app.server)
+        form_options = personality_app.form_options
+
+    setup = make_transport()
+    dependencies = setup.get_json("/_dash-dependencies")
+    layout = setup.get_json("/_dash-layout")
+
+    def run(i: int) -> tuple:
+        rng = random.Random(args.seed + i)
+        session = DashSession.connect(make_transport(), dependencies, layout)
+        session.set("url", "search", f"?seed={args.seed + i}" + ("&mode=adaptive" if i % 2 else ""))
+        return take_test(session, [rng.choice(form_options) for _ in range(64)], f"user{i}"), session.timings
+
+    start = time.perf_counter()
+    reference = [run(i)[0] for i in range(args.sessions)]
+    sequential = time.perf_counter() - start
+
+    records = [None] * args.sessions
+    errors = []
+    timings = []
+    lock = threading.Lock()
+
+    def concurrent(i: int):
+        try:
+            records[i], session_timings = run(i)
+            with lock:
+                timings.extend(session_timings)
+        except Exception as err:
+            with lock:
+                errors.append(f"session {i}: {err!r}")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        list(pool.map(concurrent, range(args.sessions)))
+    elapsed = time.perf_counter() - start
+
+    mismatches = []
+    for i, (expected, actual) in enumerate(zip(reference, records)):
+        if actual is None:
+            continue
+        different = [key for key in expected if expected[key] != actual[key]]
+        if different:
+            mismatches.append(f"session {i}: {', '.join(different)} differ from the reference run")
+
+    questions = sum(len(record["questions"]) for record in reference)
+    print(f"{args.sessions} sessions ({questions} questions): {sequential:.2f} s one at a time, {elapsed:.2f} s on {args.threads} threads")
+    print(f"{len(timings) / elapsed:.1f} requests/s, {len(errors)} errors, {len(mismatches)} sessions differing from the reference")
+    for name in ["cycle_questions", "return_test_results"]:
+        times = [seconds for callback, seconds, _ in timings if callback == name]
+        print(f"{name:<24}{len(times):>8} requests  p50 {percentile(times, 50)*1e3:.2f} ms  p99 {percentile(times, 99)*1e3:.2f} ms")
+    for problem in (errors + mismatches)[:10]:
+        print(problem)
+    if errors or mismatches:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
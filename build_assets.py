@@ -0,0 +1,92 @@
+""" Build-time stage for the meme images in assets/
+
+Writes resized WebP and AVIF variants at a few widths to assets/build/ with a content hash in every file name,
+plus a manifest.json the app reads to point the result images at them. Hashed files never change, so they are
+served with far-future cache headers.
+
+    python build_assets.py
+"""
+import argparse
+import hashlib
+import io
+import json
+import os
+
+from PIL import Image, features
+
+app_folder = os.path.dirname(os.path.abspath(__file__))
+assets_folder = os.path.join(app_folder, "assets")
+BUILD_DIR = "build" # relative to assets/
+MANIFEST = "manifest.json"
+WIDTHS = [480, 960, 1440]
+FORMATS = {"avif": {"quality": 55}, "webp": {"quality": 80, "method": 6}}
+MIN_SIZE = 32 * 1024 # bytes, smaller images (like the cursor) are not worth it
+
+def available_formats() -> list:
+    return [fmt for fmt in FORMATS if features.check(fmt)]
+
+def build_image(path: str, out_dir: str, formats: list) -> dict:
+    """ Write every variant of one image -> manifest entry
+    """
+    name = os.path.basename(path)
+    stem = os.path.splitext(name)[0]
+    with Image.open(path) as img:
+        img.load()
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if "transparency" in img.info else "RGB")
+        width, height = img.size
+        widths = [w for w in WIDTHS if w < width] + [width]
+
+        entry = {"width": width, "height": height, "variants": {fmt: [] for fmt in formats}}
+        for w in widths:
+            resized = img if w == width else img.resize((w, round(height * w / width)), Image.LANCZOS)
+            for fmt in formats:
+                buffer = io.BytesIO()
+                resized.save(buffer, format=fmt.upper(), **FORMATS[fmt])
+                data = buffer.getvalue()
+                digest = hashlib.sha256(data).hexdigest()[:12]
+                filename = f"{stem}-{w}.{digest}.{fmt}"
+                with open(os.path.join(out_dir, filename), "wb") as f:
+                    f.write(data)
+                entry["variants"][fmt].append({"path": f"{BUILD_DIR}/{filename}", "width": w, "bytes": len(data)})
+    return entry
+
+def build(min_size: int = MIN_SIZE) -> dict:
+    out_dir = os.path.join(assets_folder, BUILD_DIR)
+    os.makedirs(out_dir, exist_ok=True)
+    # start clean so stale hashes don't pile up
+    for entry in os.scandir(out_dir):
+        os.remove(entry.path)
+
+    formats = available_formats()
+    manifest = {}
+    for entry in sorted(os.scandir(assets_folder), key=lambda e: e.name):
+        if entry.is_file() and entry.name.lower().endswith((".png", ".jpg", ".jpeg")) and entry.stat().st_size >= min_size:
+            manifest[entry.name] = build_image(entry.path, out_dir, formats)
+            smallest = min((v for variants in manifest[entry.name]["variants"].values() for v in variants), key=lambda v: v["bytes"])
+            print(f"{entry.name}: {entry.stat().st_size // 1024} KB -> {smallest['bytes'] // 1024} KB at {smallest['width']}px")
+
+    with open(os.path.join(out_dir, MANIFEST), "w", encoding="utf8") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+def load_manifest() -> dict:
+    """ Manifest written by build(), empty when the build stage has not been run
+    """
+    try:
+        with open(os.path.join(assets_folder, BUILD_DIR, MANIFEST), encoding="utf8") as f:
+            return json.load(f)
+    except OSError:
+        return {}
+
+def get_srcsets(manifest: dict, src: str, get_asset_url) -> dict:
+    """ srcSet strings per format for an image in assets/, empty when it has no built variants
+    """
+    variants = manifest.get(src, {}).get("variants", {})
+    return {fmt: ", ".join(f"{get_asset_url(v['path'])} {v['width']}w" for v in variants.get(fmt, [])) for fmt in FORMATS}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build resized, content-hashed image variants for assets/")
+    parser.add_argument("--min-size", type=int, default=MIN_SIZE, help="skip images smaller than this many bytes")
+    args = parser.parse_args()
+    build(args.min_size)
@@ -0,0 +1,168 @@
+""" Precompiled data bundle so the app starts without parsing, compiling or encoding anything
+
+bundle.npz holds the question bank and meta traits, their compiled matrices, and the base figure layout with
+the background already encoded, so startup neither builds a plotly figure nor opens the background with PIL.
+It is checked against the size and modification time of the source files and ignored (with the data compiled
+from the sources instead) when it is missing or stale, or when PERSONALITY_BUNDLE=0.
+
+The bundle only saves the data loading. Most of the import time is dash itself, which also imports
+plotly.graph_objects, so that part is the same with or without the bundle.
+
+    python bundle.py            # build bundle.npz
+    python bundle.py --check    # say whether the bundle is up to date
+    python bundle.py --report   # import-time cost of the app, with and without the bundle
+"""
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+from functools import lru_cache
+
+import numpy as np
+
+from scoring import ScoringEngine
+from meta_types import MetaTypeIndex
+
+app_folder = os.path.dirname(os.path.abspath(__file__))
+BUNDLE_PATH = os.path.join(app_folder, "bundle.npz")
+BUNDLE_VERSION = 1
+BUNDLE_ENABLED = os.environ.get("PERSONALITY_BUNDLE", "1") == "1" # 0 always compiles from the sources
+SOURCES = {
+    "questions": os.path.join(app_folder, "questions.json"),
+    "meta_traits": os.path.join(app_folder, "meta_traits.json"),
+    "background": os.path.join(app_folder, "images", "results_dark_mode.png"),
+}
+
+class AppData:
+    """ Everything the app loads at startup
+    """
+    def __init__(self, questions_json: dict, meta_json: dict, engine: ScoringEngine, meta_index: MetaTypeIndex,
+                 base_layout: dict, background_version: str, loaded_from: str):
+        self.questions_json = questions_json
+        self.meta_json = meta_json
+        self.engine = engine
+        self.meta_index = meta_index
+        self.base_layout = base_layout # plotly layout of the base figure, background inlined as a data uri
+        self.background_version = background_version # content hash of the background, for cache busting
+        self.loaded_from = loaded_from # "bundle" or "sources"
+
+def source_stamp() -> str:
+    """ Size and modification time of every source file, a bundle is only used while these match
+    """
+    stamp = {name: [os.path.getsize(path), os.stat(path).st_mtime_ns] for name, path in SOURCES.items()}
+    return json.dumps({"version": BUNDLE_VERSION, "sources": stamp}, sort_keys=True)
+
+def compile_app_data() -> AppData:
+    """ Build everything from the source files (slow path: builds the base figure and encodes the background)
+    """
+    from personality_test import build_base_layout
+
+    with open(SOURCES["questions"], encoding="utf8") as f:
+        questions_json = json.load(f)
+    with open(SOURCES["meta_traits"], encoding="utf8") as f:
+        meta_json = json.load(f)
+    with open(SOURCES["background"], "rb") as f:
+        background_version = hashlib.sha256(f.read()).hexdigest()[:12]
+
+    return AppData(questions_json, meta_json, ScoringEngine(questions_json), MetaTypeIndex.from_dict(meta_json),
+                   build_base_layout(SOURCES["background"]), background_version, "sources")
+
+def save_bundle(data: AppData, path: str = BUNDLE_PATH):
+    tmp_path = path + ".tmp.npz"
+    np.savez(tmp_path,
+             stamp=np.array(source_stamp()),
+             questions_json=np.array(json.dumps(data.questions_json)),
+             meta_json=np.array(json.dumps(data.meta_json)),
+             question_ids=data.engine.question_ids,
+             weights=data.engine.weights,
+             normalization=data.engine.normalization,
+             meta_names=data.meta_index.names,
+             meta_thresholds=data.meta_index.thresholds,
+             base_layout=np.array(json.dumps(data.base_layout)),
+             background_version=np.array(data.background_version))
+    os.replace(tmp_path, path)
+
+def load_bundle(path: str = BUNDLE_PATH):
+    """ returns: AppData, or None when the bundle is missing or out of date
+    """
+    try:
+        bundle = np.load(path, allow_pickle=False)
+    except OSError:
+        return None
+    with bundle:
+        if str(bundle["stamp"]) != source_stamp():
+            return None
+        return AppData(json.loads(str(bundle["questions_json"])),
+                       json.loads(str(bundle["meta_json"])),
+                       ScoringEngine.from_compiled(bundle["question_ids"], bundle["weights"], bundle["normalization"]),
+                       MetaTypeIndex(bundle["meta_names"].tolist(), bundle["meta_thresholds"]),
+                       json.loads(str(bundle["base_layout"])),
+                       str(bundle["background_version"]),
+                       "bundle")
+
+@lru_cache(maxsize=None)
+def get_app_data() -> AppData:
+    """ The bundle when it is current, the source files otherwise. Loaded once per process.
+    """
+    data = load_bundle() if BUNDLE_ENABLED else None
+    if data is None:
+        data = compile_app_data()
+    return data
+
+def import_report(env: dict) -> tuple:
+    """ Import the app in a fresh interpreter -> (total seconds, [(cumulative seconds, module)] slowest first)
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import personality_app"],
+                            cwd=app_folder, env=env, capture_output=True, text=True, check=True)
+    children = [] # direct imports of personality_app, listed before it with one more level of indentation
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        seconds, name = int(cumulative) / 1e6, name.rstrip()
+        if name == " personality_app":
+            return seconds, sorted(children, reverse=True)
+        if not name.startswith("  "):
+            children = []
+        elif not name.startswith("    "):
+            children.append((seconds, name.strip()))
+    raise RuntimeError("personality_app missing from the import report")
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the precompiled data bundle")
+    parser.add_argument("--check", action="store_true", help="only check whether the bundle is current")
+    parser.add_argument("--report", action="store_true", help="report the import-time cost of the app")
+    args = parser.parse_args()
+
+    if args.check:
+        current = load_bundle() is not None
+        print("bundle is up to date" if current else "bundle is missing or stale")
+        sys.exit(0 if current else 1)
+
+    if args.report:
+        current = load_bundle() is not None
+        if not current:
+            print("bundle is missing or stale, build it first to compare")
+        runs = [("without the bundle", "0")] + ([("with the bundle", "1")] if current else [])
+        reports = {label: import_report(dict(os.environ, PYTHONPATH=app_folder, PERSONALITY_BUNDLE=flag)) for label, flag in runs}
+        for label, (total, modules) in reports.items():
+            print(f"import personality_app {label}: {total:.3f} s")
+            for seconds, name in modules[:10]:
+                print(f"  {seconds:8.3f} s  {name}")
+        if len(reports) == 2:
+            (without, _), (with_bundle, _) = reports.values()
+            print(f"the bundle saves {without - with_bundle:.3f} s of {without:.3f} s")
+        return
+
+    start = time.perf_counter()
+    data = compile_app_data()
+    save_bundle(data)
+    print(f"Wrote {BUNDLE_PATH} ({os.path.getsize(BUNDLE_PATH) // 1024} KB) in {time.perf_counter() - start:.2f} s")
+
+if __name__ == "__main__":
+    main()
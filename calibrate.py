@@ -0,0 +1,256 @@
+""" Monte Carlo calibration of the score normalization and the meta type thresholds
+
+Simulates answer sheets against questions.json, scores them with the app's ScoringEngine in vectorized chunks
+spread over a process pool, and reports how the hand-picked constants behave: trait score distributions, how
+often the result plot clips a trait at 0 or 1, and how often each meta type (and "Yourself!") comes up. Then it
+proposes constants:
+
+    normalization  one divisor per trait so that only --clip-rate of the results go over 1.0
+    thresholds     the meta_traits.json thresholds scaled by one factor so that --no-match of the results
+                   end up as "Yourself!" under the proposed normalization
+
+    python calibrate.py --sheets 1000000 --workers 8
+    python calibrate.py --model uniform --output calibration.json --meta-out meta_traits.calibrated.json
+
+Respondent models: "uniform" picks every answer independently, "latent" gives every simulated person a
+normally distributed level per trait and answers each question by how well it fits that person, plus noise,
+so answers are consistent the way real ones are. Sheets are generated from per-chunk seeds, so a run is
+reproducible for a given --seed and --chunk-size whatever the number of workers.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from scoring import ScoringEngine, TRAITS, FORM_OPTIONS, SCORE_NORMALIZATION
+from meta_types import MetaTypeIndex, NO_MATCH
+
+app_folder = os.path.dirname(os.path.abspath(__file__))
+_questions_path = os.path.join(app_folder, "questions.json")
+_meta_path = os.path.join(app_folder, "meta_traits.json")
+
+MODELS = ["latent", "uniform"]
+RAW_BINS = 4096 # histogram bins over the range of possible raw (unnormalized) scores
+RATIO_MAX = 4.0 # threshold scale factors from 0 to RATIO_MAX are resolved...
+RATIO_BINS = 4000 # ...in steps of RATIO_MAX / RATIO_BINS
+LATENT_CUTS = np.array([-1.5, -0.75, 0.0, 0.75, 1.5]) # fit + noise -> option, above the last cut is "Strongly Agree"
+
+# Set once per process by init_worker so tasks only carry a seed and a normalization
+_engine: ScoringEngine = None
+_meta_index: MetaTypeIndex = None
+
+def init_worker(questions_path: str, meta_path: str):
+    global _engine, _meta_index
+    with open(questions_path, encoding="utf8") as f:
+        _engine = ScoringEngine(json.load(f))
+    with open(meta_path, encoding="utf8") as f:
+        _meta_index = MetaTypeIndex.from_dict(json.load(f))
+
+def raw_range(engine: ScoringEngine) -> tuple:
+    """ Lowest and highest raw score any sheet can reach, over every trait
+    """
+    low = np.minimum(engine.weights * engine.conversion.max(), engine.weights * engine.conversion.min()).sum(axis=0)
+    high = np.maximum(engine.weights * engine.conversion.max(), engine.weights * engine.conversion.min()).sum(axis=0)
+    return float(low.min()), float(high.max())
+
+def simulate_answers(rng: np.random.Generator, n: int, weights: np.ndarray, model: str, spread: float) -> np.ndarray:
+    """ (n x questions) option indices, 0 = "Strongly Agree"
+    """
+    n_questions = len(weights)
+    if model == "uniform":
+        return rng.integers(0, len(FORM_OPTIONS), size=(n, n_questions), dtype=np.uint8)
+    # how much each question is about each trait, as a unit vector
+    directions = weights / np.maximum(np.linalg.norm(weights, axis=1, keepdims=True), 1e-12)
+    fit = rng.normal(0.0, spread, size=(n, len(TRAITS))) @ directions.T
+    fit += rng.normal(size=fit.shape)
+    return (len(LATENT_CUTS) - np.searchsorted(LATENT_CUTS, fit)).astype(np.uint8)
+
+class CalibrationStats:
+    """ Counts over simulated sheets that chunks from any worker can be added together
+    """
+    def __init__(self, n_traits: int, n_meta: int, raw_low: float, raw_high: float):
+        self.raw_low = raw_low
+        self.raw_high = raw_high
+        self.sheets = 0
+        self.raw_sums = np.zeros(n_traits)
+        self.raw_squares = np.zeros(n_traits)
+        self.raw_histograms = np.zeros((n_traits, RAW_BINS), dtype=np.int64)
+        self.clipped_low = np.zeros(n_traits, dtype=np.int64) # normalized score < 0
+        self.clipped_high = np.zeros(n_traits, dtype=np.int64) # normalized score > 1
+        self.meta_hits = np.zeros(n_meta, dtype=np.int64) # results each meta type matches at the current thresholds
+        self.no_match = 0
+        self.type_ratios = np.zeros((n_meta, RATIO_BINS), dtype=np.int64) # largest threshold scale each type still matches at
+        self.best_ratios = np.zeros(RATIO_BINS, dtype=np.int64) # same for the best matching type of each result
+
+    def update(self, raw: np.ndarray, scores: np.ndarray, meta_index: MetaTypeIndex):
+        n_traits = raw.shape[1]
+        self.sheets += len(raw)
+        self.raw_sums += raw.sum(axis=0)
+        self.raw_squares += (raw**2).sum(axis=0)
+        bins = np.clip(((raw - self.raw_low) / (self.raw_high - self.raw_low) * RAW_BINS).astype(int), 0, RAW_BINS - 1)
+        self.raw_histograms += np.bincount((bins + np.arange(n_traits) * RAW_BINS).ravel(),
+                                           minlength=n_traits * RAW_BINS).reshape(n_traits, RAW_BINS)
+        self.clipped_low += np.count_nonzero(scores < 0.0, axis=0)
+        self.clipped_high += np.count_nonzero(scores > 1.0, axis=0)
+
+        # a type matches at thresholds * s exactly when s < min over its required traits of score / threshold
+        required = meta_index.thresholds > 0
+        ratios = scores[:, None, :] / np.where(required, meta_index.thresholds, 1.0)[None, :, :]
+        ratios = np.where(required[None, :, :], ratios, np.inf).min(axis=2) # (N x types)
+        matched = ratios > 1.0
+        self.meta_hits += np.count_nonzero(matched, axis=0)
+        self.no_match += int(np.count_nonzero(~matched.any(axis=1)))
+        ratio_bins = np.minimum((np.clip(ratios, 0.0, RATIO_MAX) / RATIO_MAX * RATIO_BINS).astype(int), RATIO_BINS - 1)
+        n_meta = ratios.shape[1]
+        self.type_ratios += np.bincount((ratio_bins + np.arange(n_meta) * RATIO_BINS).ravel(),
+                                        minlength=n_meta * RATIO_BINS).reshape(n_meta, RATIO_BINS)
+        self.best_ratios += np.bincount(ratio_bins.max(axis=1), minlength=RATIO_BINS)
+
+    def merge(self, other: "CalibrationStats"):
+        for name in ["sheets", "raw_sums", "raw_squares", "raw_histograms", "clipped_low", "clipped_high",
+                     "meta_hits", "no_match", "type_ratios", "best_ratios"]:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+
+    def raw_means(self) -> np.ndarray:
+        return self.raw_sums / max(self.sheets, 1)
+
+    def raw_stds(self) -> np.ndarray:
+        return np.sqrt(np.maximum(self.raw_squares / max(self.sheets, 1) - self.raw_means()**2, 0.0))
+
+    def raw_quantiles(self, q: float) -> np.ndarray:
+        """ Per trait raw score below which a share q of the results falls, to within one bin
+        """
+        cumulative = np.cumsum(self.raw_histograms, axis=1)
+        bins = np.argmax(cumulative >= q * cumulative[:, -1:], axis=1)
+        return self.raw_low + (bins + 1) * (self.raw_high - self.raw_low) / RAW_BINS
+
+    def threshold_scale(self, no_match: float) -> float:
+        """ Factor for every threshold that leaves a share no_match of the results without a meta type
+        """
+        cumulative = np.cumsum(self.best_ratios)
+        return float(np.argmax(cumulative >= no_match * cumulative[-1]) + 1) * RATIO_MAX / RATIO_BINS
+
+    def hit_rates(self, scale: float) -> np.ndarray:
+        """ Share of results each meta type matches with every threshold multiplied by scale
+        """
+        first = int(round(scale / RATIO_MAX * RATIO_BINS))
+        return self.type_ratios[:, first:].sum(axis=1) / max(self.sheets, 1)
+
+def simulate_chunk(seed: np.random.SeedSequence, n: int, normalization: np.ndarray, model: str, spread: float) -> CalibrationStats:
+    """ Simulate and score n sheets -> their counts
+    """
+    rng = np.random.default_rng(seed)
+    answers = simulate_answers(rng, n, _engine.weights, model, spread)
+    raw = _engine.conversion[answers] @ _engine.weights
+    stats = CalibrationStats(len(_engine.traits), len(_meta_index), *raw_range(_engine))
+    stats.update(raw, raw / normalization, _meta_index)
+    return stats
+
+def simulate(sheets: int, chunk_size: int, normalization: np.ndarray, model: str, spread: float, seed: int,
+             workers: int, init_args: tuple) -> CalibrationStats:
+    """ Simulate sheets in chunks, in this process or on a pool of workers, with at most 2 chunks per worker in flight
+    """
+    sizes = [chunk_size] * (sheets // chunk_size) + ([sheets % chunk_size] if sheets % chunk_size else [])
+    tasks = [(chunk_seed, size, normalization, model, spread) for chunk_seed, size in zip(np.random.SeedSequence(seed).spawn(len(sizes)), sizes)]
+    stats = CalibrationStats(len(_engine.traits), len(_meta_index), *raw_range(_engine))
+    if workers <= 1:
+        for task in tasks:
+            stats.merge(simulate_chunk(*task))
+        return stats
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=init_args) as pool:
+        pending = deque()
+        for task in tasks:
+            pending.append(pool.submit(simulate_chunk, *task))
+            if len(pending) >= 2 * workers:
+                stats.merge(pending.popleft().result())
+        while pending:
+            stats.merge(pending.popleft().result())
+    return stats
+
+def print_report(title: str, stats: CalibrationStats, normalization: np.ndarray, names: list, out=sys.stdout):
+    n = max(stats.sheets, 1)
+    print(f"\n{title}", file=out)
+    print(f"{'trait':<10} {'divisor':>8} {'mean':>6} {'std':>6} {'p1':>6} {'p50':>6} {'p99':>6} {'<0':>7} {'>1':>7}", file=out)
+    low, median, high = (stats.raw_quantiles(q) / normalization for q in (0.01, 0.5, 0.99))
+    means, stds = stats.raw_means() / normalization, stats.raw_stds() / normalization
+    for i, trait in enumerate(_engine.traits):
+        print(f"{trait:<10} {normalization[i]:>8.2f} {means[i]:>6.2f} {stds[i]:>6.2f} {low[i]:>6.2f} {median[i]:>6.2f} {high[i]:>6.2f} "
+              f"{stats.clipped_low[i] / n:>7.2%} {stats.clipped_high[i] / n:>7.2%}", file=out)
+    print(f"\n{'meta type':<56} {'matches':>8}", file=out)
+    for i in np.argsort(-stats.meta_hits, kind="stable"):
+        print(f"{names[i]:<56} {stats.meta_hits[i] / n:>8.2%}", file=out)
+    print(f"{NO_MATCH:<56} {stats.no_match / n:>8.2%}", file=out)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Calibrate score normalization and meta type thresholds on simulated answer sheets")
+    parser.add_argument("--sheets", type=int, default=1000000, help="answer sheets to simulate")
+    parser.add_argument("--model", choices=MODELS, default="latent", help="how simulated people answer")
+    parser.add_argument("--spread", type=float, default=1.0, help="std of the per-trait levels of the latent model")
+    parser.add_argument("--clip-rate", type=float, default=0.01, help="share of results the proposed normalization lets go over 1.0")
+    parser.add_argument("--no-match", type=float, default=0.2, help=f'share of results the proposed thresholds leave as "{NO_MATCH}"')
+    parser.add_argument("--chunk-size", type=int, default=50000, help="sheets simulated per task")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="number of simulation processes")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--questions", default=_questions_path)
+    parser.add_argument("--meta-traits", default=_meta_path)
+    parser.add_argument("--output", help="write the proposed constants and rates to this JSON file")
+    parser.add_argument("--meta-out", help="write meta_traits.json with the proposed thresholds to this file")
+    args = parser.parse_args(argv)
+
+    init_args = (args.questions, args.meta_traits)
+    init_worker(*init_args)
+    with open(args.meta_traits, encoding="utf8") as f:
+        meta_json = json.load(f)
+    names = _meta_index.names.tolist()
+    run = lambda normalization: simulate(args.sheets, args.chunk_size, normalization, args.model, args.spread, args.seed, args.workers, init_args)
+
+    start = time.perf_counter()
+    current = run(_engine.normalization)
+    print(f"Simulated {current.sheets} sheets ({args.model} model) in {time.perf_counter() - start:.1f}s on {args.workers} workers")
+    print_report(f"Current constants (normalization {SCORE_NORMALIZATION:g}, thresholds from {os.path.basename(args.meta_traits)})",
+                 current, _engine.normalization, names)
+
+    # same seed, so the second pass scores the very same sheets with the proposed divisors
+    normalization = np.maximum(np.round(current.raw_quantiles(1.0 - args.clip_rate), 2), 0.01)
+    proposed = run(normalization)
+    scale = proposed.threshold_scale(args.no_match)
+    print_report("Proposed normalization, current thresholds", proposed, normalization, names)
+    print(f"\nThreshold scale for {args.no_match:.0%} {NO_MATCH}: {scale:.3f}")
+    rates = proposed.hit_rates(scale)
+    for i in np.argsort(-rates, kind="stable"):
+        print(f"{names[i]:<56} {rates[i]:>8.2%}")
+
+    thresholds = {key: {trait: round(meta[trait] * scale, 3) for trait in TRAITS} for key, meta in meta_json.items()}
+    print("\nProposed constants")
+    print(f"  normalization: {dict(zip(_engine.traits, normalization.tolist()))}")
+    print(f"  single divisor: {float(np.max(normalization)):g} (no trait clips more than {args.clip_rate:.0%})")
+    print(f"  thresholds: {sorted({value for meta in thresholds.values() for value in meta.values() if value > 0})}")
+    print(f"Done in {time.perf_counter() - start:.1f}s")
+
+    if args.output:
+        report = {
+            "sheets": current.sheets, "model": args.model, "seed": args.seed,
+            "current": {"normalization": _engine.normalization.tolist(),
+                        "clipped_high": (current.clipped_high / current.sheets).tolist(),
+                        "clipped_low": (current.clipped_low / current.sheets).tolist(),
+                        "meta_hits": dict(zip(names, (current.meta_hits / current.sheets).tolist())),
+                        "no_match": current.no_match / current.sheets},
+            "proposed": {"normalization": dict(zip(_engine.traits, normalization.tolist())),
+                         "threshold_scale": scale,
+                         "meta_hits": dict(zip(names, rates.tolist())),
+                         "no_match": args.no_match},
+        }
+        with open(args.output, "w", encoding="utf8") as f:
+            json.dump(report, f, indent=4)
+    if args.meta_out:
+        with open(args.meta_out, "w", encoding="utf8") as f:
+            json.dump({key: {**thresholds[key], "type": meta["type"]} for key, meta in meta_json.items()}, f, indent=4)
+
+if __name__ == "__main__":
+    main()
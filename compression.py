@@ -0,0 +1,165 @@
+""" Response compression for the Flask server behind the Dash app
+
+Callback responses, the index page, the API and the Dash/Plotly/Bootstrap component bundles go out gzip or
+brotli compressed, whichever the browser accepts (brotli only when the brotli package is installed). Bodies
+under COMPRESS_MIN_BYTES and formats that are compressed already (PNG, WebP, AVIF) are sent as they are.
+
+Static files (component bundles and /assets/) are compressed once at the highest level and the compressed
+bodies are kept in memory, so only callback payloads are compressed per request, at a faster level.
+precompress() fills that cache ahead of time, wsgi.py does it before gunicorn forks the workers.
+
+Disable with PERSONALITY_COMPRESS=0, e.g. when a proxy in front of the app already compresses.
+"""
+import gzip
+import os
+import re
+import threading
+import zlib
+from collections import OrderedDict
+
+try:
+    import brotli # optional, smaller than gzip for text
+except ImportError:
+    brotli = None
+
+COMPRESS_ENABLED = os.environ.get("PERSONALITY_COMPRESS", "1") == "1"
+COMPRESS_MIN_BYTES = int(os.environ.get("PERSONALITY_COMPRESS_MIN_BYTES", 1024)) # smaller bodies don't gain enough to pay for it
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/javascript", "application/xml", "image/svg+xml")
+DYNAMIC_LEVELS = {"br": 5, "gzip": 6} # per request, fast
+STATIC_LEVELS = {"br": 11, "gzip": 9} # once per static file, as small as it gets
+STATIC_PREFIXES = ("/_dash-component-suites/", "/assets/")
+MAX_STATIC_BYTES = 32 * 1024 * 1024 # compressed static bodies kept in memory
+
+def available_encodings() -> list:
+    """ Encodings this process can produce, preferred first
+    """
+    return ["br", "gzip"] if brotli is not None else ["gzip"]
+
+def negotiate(accept_encoding: str, encodings: list = None) -> str:
+    """ Best encoding the client accepts -> "br", "gzip" or None for identity
+    """
+    accepted = {}
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        match = re.search(r"q=([0-9.]+)", params)
+        try:
+            accepted[name.strip().lower()] = float(match.group(1)) if match else 1.0
+        except ValueError:
+            continue
+    for encoding in encodings or available_encodings():
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+def compress(data: bytes, encoding: str, level: int) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=level)
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+class StaticCache:
+    """ Compressed static bodies by (path, encoding), a byte-bounded LRU
+
+    Entries carry a checksum of the uncompressed body, so a file that changed on disk is compressed again
+    instead of serving the old version.
+    """
+    def __init__(self, max_bytes: int = MAX_STATIC_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict() # (path, encoding) -> (checksum, compressed body), least recently used first
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get_or_compress(self, path: str, encoding: str, data: bytes) -> bytes:
+        key, checksum = (path, encoding), zlib.crc32(data)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == checksum:
+                self._entries.move_to_end(key)
+                return entry[1]
+        body = compress(data, encoding, STATIC_LEVELS[encoding])
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous[1])
+            if len(body) <= self.max_bytes:
+                self._entries[key] = (checksum, body)
+                self._bytes += len(body)
+            while self._bytes > self.max_bytes:
+                _, (_, oldest) = self._entries.popitem(last=False)
+                self._bytes -= len(oldest)
+        return body
+
+    def __len__(self):
+        return len(self._entries)
+
+def is_compressible(response, min_bytes: int) -> bool:
+    if response.status_code != 200 or "Content-Encoding" in response.headers:
+        return False
+    if not (response.mimetype or "").startswith(COMPRESSIBLE_TYPES):
+        return False
+    if response.is_streamed and not response.direct_passthrough:
+        return False # a generator, compressing would mean buffering all of it
+    length = response.content_length
+    return length is None or length >= min_bytes
+
+def compress_responses(server, min_bytes: int = COMPRESS_MIN_BYTES, static_cache: StaticCache = None) -> StaticCache:
+    """ Compress the responses of a Flask server, does nothing unless compression is enabled
+
+    Register it before any other after_request hook: Flask runs them last registered first, so this one
+    sees the final response.
+    returns: the cache of compressed static files, None when compression is disabled
+    """
+    if not COMPRESS_ENABLED:
+        return None
+    import flask
+    from dash.fingerprint import check_fingerprint
+
+    static_cache = static_cache if static_cache is not None else StaticCache()
+
+    @server.after_request
+    def compress_response(response):
+        response.vary.add("Accept-Encoding")
+        encoding = negotiate(flask.request.headers.get("Accept-Encoding"))
+        if encoding is None or flask.request.method == "HEAD" or not is_compressible(response, min_bytes):
+            return response
+        response.direct_passthrough = False # files from send_file are read into memory, they are small
+        data = response.get_data()
+        if len(data) < min_bytes:
+            return response
+        if flask.request.path.startswith(STATIC_PREFIXES):
+            # the same file under any fingerprint or cache-busting query shares one entry, the checksum catches changes
+            body = static_cache.get_or_compress(check_fingerprint(flask.request.path)[0], encoding, data)
+        else:
+            body = compress(data, encoding, DYNAMIC_LEVELS[encoding])
+        if len(body) >= len(data):
+            return response
+        response.set_data(body)
+        response.headers["Content-Encoding"] = encoding
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True) # same content, other bytes; weak tags still answer If-None-Match
+        return response
+
+    return static_cache
+
+def precompress(app, paths: list = None) -> int:
+    """ Compress the component bundles (or `paths`) into the cache ahead of the first visitors: the ones the
+    index page links to and the ones Dash loads on demand, like plotly.js
+
+    returns: number of files compressed
+    """
+    if not COMPRESS_ENABLED:
+        return 0
+    client = app.server.test_client()
+    if paths is None:
+        index = client.get(app.get_relative_path("/")).get_data(as_text=True)
+        paths = re.findall(r'(?:src|href)="([^"]+\.(?:js|css)(?:\?[^"]*)?)"', index)
+        paths += [app.get_relative_path(f"/_dash-component-suites/{package}/{path}")
+                  for package, package_paths in app.registered_paths.items() for path in sorted(package_paths) if path.endswith(".js")]
+    count = 0
+    for path in paths:
+        if not path.startswith("/"):
+            continue # external, e.g. the Bootstrap CDN
+        for encoding in available_encodings():
+            response = client.get(path, headers={"Accept-Encoding": encoding})
+            count += response.headers.get("Content-Encoding") == encoding
+    return count
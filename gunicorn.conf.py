@@ -0,0 +1,25 @@
+""" gunicorn settings for wsgi.py, every value can be overridden from the environment
+
+    PERSONALITY_BIND     address to listen on (default 0.0.0.0:8080)
+    PERSONALITY_WORKERS  worker processes (default 2 x cores + 1)
+    PERSONALITY_THREADS  threads per worker (default 4)
+    PERSONALITY_TIMEOUT  seconds before a stuck worker is restarted (default 30)
+"""
+import multiprocessing
+import os
+
+app_folder = os.path.dirname(os.path.abspath(__file__))
+
+pythonpath = app_folder
+wsgi_app = "wsgi:server"
+
+bind = os.environ.get("PERSONALITY_BIND", "0.0.0.0:8080")
+workers = int(os.environ.get("PERSONALITY_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get("PERSONALITY_THREADS", 4))
+worker_class = "gthread" # a slow client only ties up one thread instead of a whole worker
+timeout = int(os.environ.get("PERSONALITY_TIMEOUT", 30))
+preload_app = True
+
+def on_starting(server):
+    if workers > 1 and os.environ.get("PERSONALITY_SESSION_STORE", "").startswith("memory"):
+        server.log.warning("PERSONALITY_SESSION_STORE=memory is per process, use file: or sqlite: to share sessions between workers")
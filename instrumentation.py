@@ -0,0 +1,153 @@
+""" Opt-in timing and payload-size metrics, exposed in Prometheus text format
+
+Enable with PERSONALITY_METRICS=1. Then:
+    - functions decorated with @timed record wall and CPU time
+    - every Dash callback request records wall time, CPU time and response size, so the gap between the
+      callback request and its @timed function is the Dash/JSON serialization overhead
+    - /metrics serves everything as histograms
+
+/metrics answers requests with "Authorization: Bearer <PERSONALITY_METRICS_TOKEN>". Without a token it only
+answers requests made directly from the machine itself: behind a reverse proxy every request arrives from
+127.0.0.1, so requests carrying the proxy's forwarding headers are refused and a scraper going through the
+proxy needs the token.
+
+When disabled @timed returns the function untouched and no request hooks are installed, so it costs nothing.
+Metrics are kept per process, with several workers every worker reports its own.
+"""
+import bisect
+import hmac
+import os
+import threading
+import time
+from functools import wraps
+
+METRICS_ENABLED = os.environ.get("PERSONALITY_METRICS", "0") == "1"
+METRICS_TOKEN = os.environ.get("PERSONALITY_METRICS_TOKEN", "")
+FORWARDING_HEADERS = ("Forwarded", "X-Forwarded-For", "X-Real-IP") # set by the proxy in front of gunicorn
+
+TIME_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+class Histogram:
+    """ Cumulative-bucket histogram, buckets are upper bounds with an implicit +Inf
+    """
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class MetricsRegistry:
+    """ Histograms grouped into families, each labelled by the function or callback name
+    """
+    def __init__(self):
+        self._families = {} # name -> (help, label name, buckets, {label value: Histogram})
+        self._lock = threading.Lock()
+
+    def family(self, name: str, help_text: str, label: str, buckets: tuple):
+        with self._lock:
+            self._families.setdefault(name, (help_text, label, buckets, {}))
+
+    def observe(self, name: str, label_value: str, value: float):
+        _, _, buckets, histograms = self._families[name]
+        with self._lock:
+            histogram = histograms.get(label_value)
+            if histogram is None:
+                histogram = histograms[label_value] = Histogram(buckets)
+            histogram.observe(value)
+
+    def render(self) -> str:
+        """ Prometheus text exposition format
+        """
+        lines = []
+        with self._lock:
+            for name, (help_text, label, buckets, histograms) in self._families.items():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} histogram")
+                for label_value, histogram in sorted(histograms.items()):
+                    cumulative = 0
+                    for bound, count in zip(list(buckets) + ["+Inf"], histogram.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{{{label}="{label_value}",le="{bound}"}} {cumulative}')
+                    lines.append(f'{name}_sum{{{label}="{label_value}"}} {histogram.sum!r}')
+                    lines.append(f'{name}_count{{{label}="{label_value}"}} {histogram.count}')
+        return "\n".join(lines) + "\n"
+
+registry = MetricsRegistry()
+registry.family("personality_function_wall_seconds", "Wall time of instrumented functions", "function", TIME_BUCKETS)
+registry.family("personality_function_cpu_seconds", "CPU time of instrumented functions", "function", TIME_BUCKETS)
+registry.family("personality_callback_wall_seconds", "Wall time of Dash callback requests, serialization included", "callback", TIME_BUCKETS)
+registry.family("personality_callback_cpu_seconds", "CPU time of Dash callback requests, serialization included", "callback", TIME_BUCKETS)
+registry.family("personality_callback_response_bytes", "Size of Dash callback responses", "callback", SIZE_BUCKETS)
+
+def timed(name: str = None):
+    """ Record wall and CPU time of every call, a no-op unless metrics are enabled
+    """
+    def decorator(func):
+        if not METRICS_ENABLED:
+            return func
+        label = name or func.__name__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            wall, cpu = time.perf_counter(), time.thread_time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                registry.observe("personality_function_cpu_seconds", label, time.thread_time() - cpu)
+                registry.observe("personality_function_wall_seconds", label, time.perf_counter() - wall)
+        return wrapper
+    return decorator
+
+def may_read_metrics(request, token: str = METRICS_TOKEN) -> bool:
+    """ The bearer token when one is set, otherwise a local request that didn't come through a proxy
+    """
+    if token:
+        return hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}")
+    if any(header in request.headers for header in FORWARDING_HEADERS):
+        return False
+    return request.remote_addr in ("127.0.0.1", "::1", None)
+
+def instrument_app(app, path: str = "/metrics"):
+    """ Time every Dash callback request and serve the metrics, does nothing unless metrics are enabled
+    """
+    if not METRICS_ENABLED:
+        return
+    import flask
+
+    server = app.server
+    update_path = app.config.requests_pathname_prefix + "_dash-update-component"
+    callback_names = {}
+
+    def callback_name(output: str) -> str:
+        if output not in callback_names:
+            func = app.callback_map.get(output, {}).get("callback")
+            callback_names[output] = getattr(func, "__wrapped__", func).__name__ if func else output
+        return callback_names[output]
+
+    @server.before_request
+    def start_callback_timer():
+        if flask.request.path == update_path:
+            flask.g.metrics_start = (time.perf_counter(), time.thread_time())
+
+    @server.after_request
+    def record_callback(response):
+        start = flask.g.pop("metrics_start", None)
+        if start is not None:
+            body = flask.request.get_json(silent=True) or {}
+            name = callback_name(body.get("output", "unknown"))
+            registry.observe("personality_callback_wall_seconds", name, time.perf_counter() - start[0])
+            registry.observe("personality_callback_cpu_seconds", name, time.thread_time() - start[1])
+            registry.observe("personality_callback_response_bytes", name, response.calculate_content_length() or 0)
+        return response
+
+    @server.route(path)
+    def metrics():
+        if not may_read_metrics(flask.request):
+            flask.abort(404)
+        return flask.Response(registry.render(), mimetype="text/plain; version=0.0.4")
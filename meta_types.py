@@ -0,0 +1,207 @@
+import json
+
+import numpy as np
+
+from scoring import TRAITS
+
+NO_MATCH = "Yourself!" # we can't figure out what you are :)
+
+class MetaTypeIndex:
+    """ meta_traits.json compiled into a (types x traits) threshold matrix
+
+    A meta type matches when every trait with a nonzero threshold is above that threshold. Matches are
+    ranked by how strongly they qualify: the smallest margin (score - threshold) over the required traits,
+    with ties kept in file order.
+    """
+    def __init__(self, names: list, thresholds: np.ndarray, traits: list = TRAITS):
+        self.traits = list(traits)
+        self.names = np.array(names)
+        self.thresholds = np.array(thresholds, dtype=float)
+        self.thresholds.setflags(write=False)
+        if self.thresholds.shape != (len(self.names), len(self.traits)):
+            raise ValueError(f"Expected thresholds of shape {(len(self.names), len(self.traits))}, got {self.thresholds.shape}")
+        # Traits that don't matter for a type never limit its margin
+        self._ignored = ~(self.thresholds > 0)
+
+    @classmethod
+    def from_dict(cls, meta_dict: dict, traits: list = TRAITS) -> "MetaTypeIndex":
+        names = [meta['type'] for meta in meta_dict.values()]
+        thresholds = [[meta[trait] for trait in traits] for meta in meta_dict.values()]
+        return cls(names, thresholds, traits)
+
+    def __len__(self):
+        return len(self.names)
+
+    def margins(self, results: np.ndarray) -> np.ndarray:
+        """ (N x traits) results -> (N x types) qualifying margins, a type matches when its margin is > 0
+        """
+        results = np.atleast_2d(np.asarray(results, dtype=float))
+        diff = results[:, None, :] - self.thresholds[None, :, :]
+        diff[:, self._ignored] = np.inf
+        return diff.min(axis=2)
+
+    def top_k(self, results: np.ndarray, k: int = 3) -> tuple:
+        """ Indices and margins of the k strongest matching types for every result
+
+        returns: (N x k) type indices, -1 where fewer than k types match, and the (N x k) margins
+        """
+        margins = self.margins(results)
+        order = np.argsort(-margins, axis=1, kind="stable")[:, :k]
+        top = np.take_along_axis(margins, order, axis=1)
+        return np.where(top > 0, order, -1), top
+
+    def match_batch(self, results: np.ndarray, k: int = 3, fallback: str = NO_MATCH) -> list:
+        """ Names of the k strongest matching types for every result, [fallback] when nothing matches
+        """
+        indices, _ = self.top_k(results, k)
+        matches = []
+        for row in indices:
+            names = self.names[row[row >= 0]].tolist()
+            matches.append(names if names or fallback is None else [fallback])
+        return matches
+
+    def match(self, results: np.ndarray, k: int = 3, fallback: str = NO_MATCH) -> list:
+        return self.match_batch(results, k, fallback)[0]
+
+    def match_all(self, results: np.ndarray) -> list:
+        """ Names of every matching type for every result, strongest first and [] when nothing matches, e.g.
+        for counting how often each type matches
+        """
+        return self.match_batch(results, k=len(self), fallback=None)
+
+INDEX_MIN_PROFILES = 2048 # below this every query is compared with every profile
+N_PROBE = 8 # cells searched per query once the profiles are indexed
+
+class ArchetypeIndex:
+    """ Archetype profiles as unit vectors for nearest-neighbour search
+
+    Unlike MetaTypeIndex there is no pass/fail: every result gets the k closest profiles with their cosine
+    distance (0 = same shape, 1 = nothing in common), so only the direction of the trait vector counts. The
+    meta_traits.json thresholds are the built-in profiles and custom ones use the same format.
+
+    With INDEX_MIN_PROFILES or more profiles they are split into about sqrt(n) cells with k-means and a query
+    only looks at the profiles in its N_PROBE closest cells. That makes large profile sets much faster to
+    search at the cost of an occasional near neighbour sitting in a cell that isn't probed; exact=True
+    skips the cells.
+    """
+    def __init__(self, names: list, profiles: np.ndarray, traits: list = TRAITS, seed: int = 0):
+        self.traits = list(traits)
+        self.names = np.array(names)
+        profiles = np.array(profiles, dtype=float)
+        if profiles.shape != (len(self.names), len(self.traits)):
+            raise ValueError(f"Expected profiles of shape {(len(self.names), len(self.traits))}, got {profiles.shape}")
+        norms = np.linalg.norm(profiles, axis=1, keepdims=True)
+        if np.any(norms == 0):
+            raise ValueError("Every profile needs at least one nonzero trait")
+        self.profiles = profiles / norms
+        self.profiles.setflags(write=False)
+        self.cells = None
+        if len(self.names) >= INDEX_MIN_PROFILES:
+            self.centroids, self.cells = self._build_cells(np.random.default_rng(seed))
+
+    @classmethod
+    def from_dict(cls, profile_dict: dict, traits: list = TRAITS) -> "ArchetypeIndex":
+        """ Profiles in the meta_traits.json format
+        """
+        return cls.from_dicts(profile_dict, traits=traits)
+
+    @classmethod
+    def from_dicts(cls, *profile_dicts: dict, traits: list = TRAITS) -> "ArchetypeIndex":
+        """ Several profile files combined, e.g. meta_traits.json plus custom profiles
+        """
+        profiles = [profile for profile_dict in profile_dicts for profile in profile_dict.values()]
+        return cls([profile['type'] for profile in profiles], [[profile.get(trait, 0.0) for trait in traits] for profile in profiles], traits)
+
+    def __len__(self):
+        return len(self.names)
+
+    def _build_cells(self, rng: np.random.Generator, iterations: int = 10) -> tuple:
+        """ Spherical k-means over the profiles -> (cells x traits) centroids, profile indices of every cell
+        """
+        n_cells = int(np.sqrt(len(self.profiles)))
+        centroids = self.profiles[rng.choice(len(self.profiles), n_cells, replace=False)]
+        for _ in range(iterations):
+            assignment = np.argmax(self.profiles @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, self.profiles)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            centroids = np.where(norms > 0, sums / np.maximum(norms, 1e-12), centroids) # empty cells keep their centroid
+        assignment = np.argmax(self.profiles @ centroids.T, axis=1)
+        return centroids, [np.flatnonzero(assignment == cell) for cell in range(n_cells)]
+
+    def _queries(self, results: np.ndarray) -> np.ndarray:
+        results = np.atleast_2d(np.asarray(results, dtype=float))
+        norms = np.linalg.norm(results, axis=1, keepdims=True)
+        return results / np.where(norms > 0, norms, 1.0) # an all-zero result is equally far (1.0) from everything
+
+    def nearest(self, results: np.ndarray, k: int = 3, exact: bool = False) -> tuple:
+        """ The k closest profiles for every result, closest first
+
+        returns: (N x k) profile indices and (N x k) cosine distances, -1 and inf where fewer than k were found
+        """
+        queries = self._queries(results)
+        k_found = min(k, len(self.names))
+        if self.cells is None or exact:
+            distances = 1.0 - queries @ self.profiles.T
+            indices = self._smallest(distances, k_found)
+            distances = np.take_along_axis(distances, indices, axis=1)
+        else:
+            indices, distances = self._nearest_in_cells(queries, k_found)
+        if k_found < k:
+            indices = np.pad(indices, ((0, 0), (0, k - k_found)), constant_values=-1)
+            distances = np.pad(distances, ((0, 0), (0, k - k_found)), constant_values=np.inf)
+        return indices, distances
+
+    @staticmethod
+    def _smallest(distances: np.ndarray, k: int) -> np.ndarray:
+        """ Column indices of the k smallest distances per row, in order, ties kept in profile order
+        """
+        if k < distances.shape[1]:
+            candidates = np.sort(np.argpartition(distances, k - 1, axis=1)[:, :k], axis=1)
+        else:
+            candidates = np.broadcast_to(np.arange(distances.shape[1]), distances.shape)
+        order = np.argsort(np.take_along_axis(distances, candidates, axis=1), axis=1, kind="stable")
+        return np.take_along_axis(candidates, order, axis=1)
+
+    def _nearest_in_cells(self, queries: np.ndarray, k: int) -> tuple:
+        """ Cell by cell: every query that probes a cell is compared with that cell's profiles in one product,
+        and the running top k of each query is merged with the cell's best k
+        """
+        probes = np.argsort(-(queries @ self.centroids.T), axis=1)[:, :N_PROBE]
+        best_indices = np.full((len(queries), k), -1)
+        best_distances = np.full((len(queries), k), np.inf)
+        for cell, members in enumerate(self.cells):
+            rows = np.flatnonzero((probes == cell).any(axis=1))
+            if len(rows) == 0 or len(members) == 0:
+                continue
+            distances = 1.0 - queries[rows] @ self.profiles[members].T
+            indices = np.broadcast_to(members, distances.shape)
+            merged_distances = np.concatenate([best_distances[rows], distances], axis=1)
+            merged_indices = np.concatenate([best_indices[rows], indices], axis=1)
+            order = np.argsort(merged_distances, axis=1, kind="stable")[:, :k]
+            best_distances[rows] = np.take_along_axis(merged_distances, order, axis=1)
+            best_indices[rows] = np.take_along_axis(merged_indices, order, axis=1)
+        return best_indices, best_distances
+
+    def match_batch(self, results: np.ndarray, k: int = 3, exact: bool = False) -> list:
+        """ [(name, distance), ...] of the k closest profiles for every result
+        """
+        indices, distances = self.nearest(results, k, exact)
+        return [[(str(self.names[i]), float(d)) for i, d in zip(row_indices, row_distances) if i >= 0]
+                for row_indices, row_distances in zip(indices, distances)]
+
+    def match(self, results: np.ndarray, k: int = 3, exact: bool = False) -> list:
+        return self.match_batch(results, k, exact)[0]
+
+def get_archetype_index(spec: str, meta_dict: dict):
+    """ Build the archetypes from a spec: "meta" for the meta types alone, or the path of a custom profile
+    file (meta_traits.json format) whose profiles are added to them
+
+    returns: None for an empty spec, meaning unmatched results stay "Yourself!"
+    """
+    if not spec:
+        return None
+    if spec == "meta":
+        return ArchetypeIndex.from_dict(meta_dict)
+    with open(spec, encoding="utf8") as f:
+        return ArchetypeIndex.from_dicts(meta_dict, json.load(f))
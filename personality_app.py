@@ -1,32 +1,59 @@
+import time
+startup_timings = {} # seconds per startup stage, printed with PERSONALITY_STARTUP_REPORT=1
+_stage_start = time.perf_counter()
+
+def mark_startup(stage: str):
+    global _stage_start
+    now = time.perf_counter()
+    startup_timings[stage] = now - _stage_start
+    _stage_start = now
+
 import numpy as np
-from copy import deepcopy
-import plotly.graph_objects as go
-from dash import Dash, html, Input, Output, State, callback, ctx, dcc, clientside_callback
+from dash import Dash, html, Input, Output, State, callback, ctx, dcc, clientside_callback, ClientsideFunction
+from dash.exceptions import PreventUpdate
 import dash_bootstrap_components as dbc
-import json
 import os
+import json
+import hashlib
+import secrets
+from types import MappingProxyType
+import flask
+from markupsafe import escape
+from urllib.parse import parse_qs, urlencode
 
-from personality_test import get_result_plot, get_base_image, get_meta_results, construct_meta_list
+from personality_test import get_result_template, get_result_patch, get_nearest_archetypes, format_archetypes, construct_meta_list
+from scoring import TRAITS, FORM_OPTIONS, FORM_CONVERSION
+from meta_types import NO_MATCH
+from bundle import get_app_data, app_folder
+from question_banks import QuestionBank, get_bank_registry
+from session_store import get_session_store
+from results_log import get_results_log, MODE_FULL, MODE_ADAPTIVE
+from result_cards import CardCache, CARD_FORMATS, card_key, parse_card_key, render_png, render_svg
+from api import ScoreBatcher, register_api
+from analytics import get_analytics_page, get_team_overlay, get_trait_distributions, get_meta_frequencies, get_summary
+from build_assets import load_manifest, get_srcsets, BUILD_DIR
+from instrumentation import timed, instrument_app
+from compression import compress_responses
+mark_startup("imports")
 
 external_stylesheets = [dbc.themes.BOOTSTRAP]
 
-original_fig = get_base_image()
 HIDE_DEBUG = True # Disable to see question mapping and scores while taking the test
+CLIENTSIDE_QUESTIONS = os.environ.get("PERSONALITY_CLIENTSIDE", "0") == "1" # Advance and score questions in the browser, only the results step hits the server
+SESSION_STORE = get_session_store(os.environ.get("PERSONALITY_SESSION_STORE", "")) # e.g. "memory", "sqlite:sessions.db"; keeps the test state on the server
+if CLIENTSIDE_QUESTIONS and SESSION_STORE is not None:
+    raise ValueError("PERSONALITY_CLIENTSIDE keeps the test state in the browser, it can't be combined with PERSONALITY_SESSION_STORE")
+ADAPTIVE_QUESTIONS = os.environ.get("PERSONALITY_ADAPTIVE", "0") == "1" # Pick questions by what's still uncertain and stop early, ?mode=full/adaptive overrides it per test
+if CLIENTSIDE_QUESTIONS and ADAPTIVE_QUESTIONS:
+    raise ValueError("PERSONALITY_ADAPTIVE picks the questions on the server, it can't be combined with PERSONALITY_CLIENTSIDE")
 
-# Dictionary to update as the test is taken
-test_results = {
-    "clown": 0.0,
-    "hater": 0.0,
-    "grinder": 0.0,
-    "brick": 0.0,
-    "sender": 0.0,
-    "yapper": 0.0,
-    "wanderer": 0.0, 
-    "organizer": 0.0
-}
-original_results = deepcopy(test_results)
+# Results every test starts from. Module level data is shared by every request thread, so it is read-only
+# and each test works on its own copy
+original_results = MappingProxyType({trait: 0.0 for trait in TRAITS})
 
-img_folder = "./personality_test_app/images/"
+img_folder = os.path.join(app_folder, "images")
+background_file = "results_dark_mode.png"
+asset_manifest = load_manifest() # resized variants of the meme images, see build_assets.py
 results_meme_srcs = {
     "clown": {"src": "meme_page_clown.png", 
               "title": "Welcome to the Clown Council"},
@@ -46,19 +73,47 @@ results_meme_srcs = {
                   "title": "Born to Excel"},
 }
 
-questions_json: dict = {}
-# with open('./questions.json', encoding="utf8") as f:  # use this when running from the .bat file
-with open('./personality_test_app/questions.json', encoding="utf8") as f:
-    questions_json = json.load(f)
-question_ids = np.array(list(questions_json.keys()))
-
-meta_json: dict = {}
-with open('./personality_test_app/meta_traits.json', encoding="utf8") as f:
-    meta_json = json.load(f)
+# questions.json, meta_traits.json and their compiled matrices, from bundle.npz when it is up to date
+app_data = get_app_data()
+questions_json: dict = app_data.questions_json
+question_ids = tuple(questions_json)
+meta_index = app_data.meta_index
+mark_startup(f"data ({app_data.loaded_from})")
+# "meta" or a custom profile file: show the closest archetypes instead of "Yourself!" when no meta type matches
+ARCHETYPES = os.environ.get("PERSONALITY_ARCHETYPES", "") # built per question bank version (see question_banks.py)
+# directory to log every result to, feeds /analytics. Starts with the default bank's meta types, names from
+# other banks or reloaded versions are added to its schema the first time a result matches them
+RESULTS_LOG = get_results_log(os.environ.get("PERSONALITY_RESULTS_LOG", ""), TRAITS, list(meta_index.names))
 
 q_index = 0
-form_options = ["Strongly Agree", "Agree", "Slightly Agree", "Slightly Disagree", "Disagree", "Strongly Disagree"]
-form_conversion = np.array([3.25, 3.0, 2.0, 1.0, 0.0, -0.25])
+form_options = FORM_OPTIONS
+form_conversion = FORM_CONVERSION
+scoring_engine = app_data.engine # questions.json compiled into a weight matrix
+troll_names = ["nic", "nicolas"]
+
+# Every question bank, reloaded when its files change. The globals above are the default bank as it was at
+# startup, sessions use the version of their bank they started with (see question_banks.py).
+question_banks = get_bank_registry(app_data, os.environ.get("PERSONALITY_BANKS") or None, ARCHETYPES)
+
+def get_question_bank_data() -> dict:
+    """ Everything the browser needs to run the questions on its own, sent once with the layout
+    """
+    questions = {}
+    for qid, weights in zip(scoring_engine.question_ids, scoring_engine.weights):
+        traits = np.nonzero(weights)[0]
+        questions[qid] = {"text": questions_json[qid]['text'],
+                          "type": [TRAITS[i] for i in traits],
+                          "scale": weights[traits].tolist()}
+
+    return {
+        "ids": list(questions_json.keys()),
+        "questions": questions,
+        "options": form_options,
+        "conversion": form_conversion.tolist(),
+        "normalization": scoring_engine.to_dict(scoring_engine.normalization),
+        "original_results": dict(original_results),
+        "troll_names": troll_names,
+    }
 
 entered_name = ""
 troll_div = html.Div(
@@ -81,24 +136,144 @@ form_div = html.Div(
     hidden=True
 )
 
+meme_img_sizes = '25vw'
 meta_div = html.Div(
     id='meta_div',
     children=[
         html.H2("Congrats! You're a ..."),
         html.H3("",id="meta_result_header"),
         html.Br(),
-        html.Img(id='meme_img',
-                 style={
-                     "width": "25vw",
-                     "height": "50%",
-                 }
+        html.Picture( # the browser picks the best format and width it supports, meme_img is the fallback
+            [
+                html.Source(id='meme_avif', type='image/avif', sizes=meme_img_sizes),
+                html.Source(id='meme_webp', type='image/webp', sizes=meme_img_sizes),
+                html.Img(id='meme_img',
+                         style={
+                             "width": "25vw",
+                             "height": "50%",
+                         }
+                ),
+            ]
         ),
     ],
     hidden=True,
 )
 
 app = Dash(__name__, external_stylesheets=external_stylesheets)
-app.layout = html.Div(
+compress_responses(app.server) # gzip/brotli for callbacks and bundles, registered first so it runs after every other hook
+instrument_app(app) # per-callback timings at /metrics when PERSONALITY_METRICS=1
+
+@app.server.route("/images/<path:filename>")
+def serve_image(filename):
+    """ Serve the result background as a static file so figures reference it by url instead of inline base64
+    """
+    return flask.send_from_directory(img_folder, filename, max_age=31536000)
+
+@app.server.after_request
+def cache_built_assets(response):
+    """ Built asset names change with their content, so browsers can keep them forever
+    """
+    if flask.request.path.startswith(app.get_asset_url(BUILD_DIR + "/")) and response.status_code == 200:
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = 31536000
+        response.cache_control.immutable = True
+    return response
+
+# The version query busts the year long browser cache whenever the image changes
+background_url = app.get_relative_path(f"/images/{background_file}?v={app_data.background_version}")
+original_fig = get_result_template(background_url) # cached base figure with an empty result trace
+
+# Rendered result cards, optionally shared by every worker through PERSONALITY_CARD_CACHE=<directory>.
+# Names carry a version of everything a card shows besides the result, so edits never serve stale cards.
+card_cache = CardCache(os.environ.get("PERSONALITY_CARD_CACHE") or None)
+
+def get_card_version(bank: QuestionBank) -> str:
+    return hashlib.sha256(json.dumps([bank.name, bank.version, bank.archetypes, app_data.background_version]).encode()).hexdigest()[:8]
+
+def get_card_bank(args) -> tuple:
+    """ The bank version a card's meta type indices refer to, from ?bank=&v= on the card url
+
+    returns: bank, whether it is that exact version (if it is gone the current version of the bank is used)
+    """
+    bank = question_banks.resolve([args.get("bank", ""), args["v"]]) if args.get("v") else None
+    if bank is None:
+        return question_banks.get(args.get("bank")), False
+    return bank, True
+
+def get_card_names(results: np.ndarray, meta_indices: list, archetypes: list, bank: QuestionBank) -> list:
+    """ What a card shows under the result: the names the result page showed when the key carries them,
+    worked out again from the result for keys that don't (or whose bank version is gone)
+    """
+    if meta_indices is not None and all(i < len(bank.meta_index) for i in meta_indices):
+        return bank.meta_index.names[meta_indices].tolist() or [NO_MATCH]
+    archetype_index = bank.archetype_index
+    if archetypes is not None and archetype_index is not None and all(i < len(archetype_index) for i, _ in archetypes):
+        return format_archetypes(archetypes, archetype_index)
+    return get_shown_results(results, bank)[0]
+
+def get_card_query(bank: QuestionBank) -> str:
+    return "?" + urlencode({"bank": bank.name, "v": bank.version})
+
+@app.server.route("/cards/<key>.<fmt>")
+def serve_card(key, fmt):
+    """ Result card as a static image, the key is the quantized result and what the page showed (see result_cards.py)
+    """
+    try:
+        results, meta_indices, archetypes = parse_card_key(key, len(TRAITS))
+    except ValueError:
+        flask.abort(404)
+    if fmt not in CARD_FORMATS:
+        flask.abort(404)
+    bank, pinned = get_card_bank(flask.request.args)
+    if not pinned:
+        meta_indices = archetypes = None # indices into a version that is gone
+    names = lambda: get_card_names(results, meta_indices, archetypes, bank)
+    background_path = os.path.join(img_folder, background_file)
+    if fmt == "png":
+        render = lambda: render_png(results, names(), background_path)
+    else:
+        render = lambda: render_svg(results, names(), background_path)
+    name = f"{get_card_version(bank)}-{key}.{fmt}"
+    response = flask.Response(card_cache.get_or_render(name, render), mimetype=CARD_FORMATS[fmt])
+    response.cache_control.public = True
+    response.cache_control.max_age = 86400
+    response.set_etag(name)
+    return response.make_conditional(flask.request)
+
+@app.server.route("/share/<key>")
+def share_card(key):
+    """ Page to share a result, its preview image is the card
+    """
+    try:
+        parse_card_key(key, len(TRAITS))
+    except ValueError:
+        flask.abort(404)
+    bank_args = {name: flask.request.args[name] for name in ("bank", "v") if name in flask.request.args}
+    query = "?" + urlencode(bank_args) if bank_args else ""
+    card_url = escape(flask.request.host_url.rstrip("/") + app.get_relative_path(f"/cards/{key}.png") + query)
+    test_url = escape(flask.request.host_url.rstrip("/") + app.get_relative_path("/")) # the host comes from the Host header
+    return (f'<!DOCTYPE html><html><head><meta charset="utf-8"><title>{app.title}</title>'
+            f'<meta property="og:title" content="{app.title}"><meta property="og:image" content="{card_url}">'
+            f'<meta name="twitter:card" content="summary_large_image"></head>'
+            f'<body style="background-color:#212121"><a href="{test_url}"><img src="{card_url}" alt="{app.title} result"></a></body></html>')
+
+# JSON scoring API for headless clients, concurrent submissions are scored together (see api.py)
+register_api(app.server, ScoreBatcher(scoring_engine, meta_index), results_log=RESULTS_LOG, banks=question_banks)
+
+def get_result_images_data() -> list:
+    """ Every image the result step can show, so the browser can fetch them while the questions are answered.
+    Only images with resized variants (build_assets.py) are listed: without the build they are the full-size
+    originals, several MB together, mostly for results nobody gets.
+    """
+    images = []
+    for src in [meme["src"] for meme in results_meme_srcs.values()] + ["software_results.png"]:
+        srcsets = get_srcsets(asset_manifest, src, app.get_asset_url)
+        if srcsets["avif"] or srcsets["webp"]:
+            images.append({"src": app.get_asset_url(src), "avif": srcsets["avif"], "webp": srcsets["webp"], "sizes": meme_img_sizes})
+    return images
+
+test_page = html.Div(
     [
         html.Div(
             dbc.Row(
@@ -127,7 +302,14 @@ app.layout = html.Div(
                             [
                                 form_div,
                                 troll_div,
-                                html.P("Screenshot to share with your friends and/or coworkers! :)", id='screenshot_msg',hidden=True),
+                                html.P(
+                                    [
+                                        "Screenshot to share with your friends and/or coworkers! :) ",
+                                        html.A("Or share this link", id='share_link', target='_blank'),
+                                    ],
+                                    id='screenshot_msg',
+                                    hidden=True
+                                ),
                                 html.Br(),
                                 html.Button(
                                     "Start Questions",
@@ -188,7 +370,7 @@ app.layout = html.Div(
         # meta_div,
         dcc.Store( # Stores the test results client side 
             id='test_results_stored',
-            data=original_results,
+            data=dict(original_results),
             storage_type='memory',
         ),
         dcc.Store( # Stores the question index that is currently active client side
@@ -205,13 +387,55 @@ app.layout = html.Div(
             id='troll_entered_name',
             data=entered_name,
             storage_type='memory',
-        )
+        ),
+        dcc.Store( # Seed of the question order, ?seed=<it> replays the same order
+            id='seed_stored',
+            data=None,
+            storage_type='memory',
+        ),
+        dcc.Store( # [name, version] of the question bank the test was started with
+            id='bank_stored',
+            data=None,
+            storage_type='memory',
+        ),
+        dcc.Store( # Token for the test state kept in SESSION_STORE, the other stores stay unused then
+            id='session_token',
+            data=None,
+            storage_type='memory',
+        ),
+        dcc.Store( # Result images to prefetch once the test is started
+            id='result_images_stored',
+            data=get_result_images_data(),
+            storage_type='memory',
+        ),
+        dcc.Store(
+            id='result_images_prefetched',
+            data=False,
+            storage_type='memory',
+        ),
+        dcc.Store( # Question bank for the clientside callbacks, only sent when they are enabled
+            id='question_bank_stored',
+            data=get_question_bank_data() if CLIENTSIDE_QUESTIONS else None,
+            storage_type='memory',
+        ),
+    ],
+    id='test_page',
+)
+
+app.layout = html.Div(
+    [
+        dcc.Location(id='url', refresh=False), # ?team= tags the result, /analytics shows the analytics page
+        test_page,
+        get_analytics_page(),
     ]
 )
 
 app.title = 'Brainrot Personality Test'
 
-@callback(
+# Stores that carry the test state through the browser when SESSION_STORE is not used
+browser_state_stores = ['test_results_stored', 'q_index_stored', 'question_ids_stored', 'troll_entered_name', 'bank_stored', 'seed_stored']
+
+cycle_questions_outputs = [
     Output('form_question','children'),
     Output('next_btn','hidden',allow_duplicate=True),
     Output('result_btn','hidden',allow_duplicate=True),
@@ -228,6 +452,8 @@ app.title = 'Brainrot Personality Test'
     Output('screenshot_msg','hidden',allow_duplicate=True),
     Output('troll_div','hidden',allow_duplicate=True),
     Output('troll_entered_name','data'),
+]
+cycle_questions_inputs = [
     Input('next_btn','n_clicks'),
     Input('start_btn','n_clicks'),
     Input('reset_btn','n_clicks'),
@@ -237,10 +463,104 @@ app.title = 'Brainrot Personality Test'
     State('question_ids_stored','data'),
     State('troll_name','value'),
     State('troll_entered_name','data'),
-    prevent_initial_call=True
-)
-def cycle_questions(n1,n2,n3,selection,q_index,test_results:dict,question_ids,input_name,stored_name):
-    local_test_results = deepcopy(test_results)
+]
+
+def get_query_param(search: str, name: str) -> str:
+    """ Value of ?name= on the test link, e.g. team or bank
+    """
+    return parse_qs((search or "").lstrip("?")).get(name, [""])[0]
+
+def is_adaptive(search: str) -> bool:
+    """ Whether a test runs in adaptive mode (see adaptive.py), ?mode=full keeps the full-length test
+    """
+    mode = get_query_param(search, "mode")
+    return mode == "adaptive" if mode in ("adaptive", "full") else ADAPTIVE_QUESTIONS
+
+def get_session_seed(search: str) -> int:
+    """ Seed for the question order of a new test, ?seed=<n> replays the order of an earlier one
+    """
+    seed = get_query_param(search, "seed")
+    return int(seed) if seed.isdigit() else secrets.randbits(63)
+
+def get_question_order(bank: QuestionBank, seed: int = None) -> list:
+    """ Shuffled question ids from the test's own generator, never the global np.random state
+    """
+    order = np.random.default_rng(seed).permutation(len(bank.question_ids))
+    return [bank.question_ids[i] for i in order]
+
+def get_session_bank(trigger, bank_ref, search) -> tuple:
+    """ The pinned bank version of a running test, or the current version of the ?bank= one for a new test
+
+    returns: bank, trigger (a test whose bank version is gone starts over)
+    """
+    bank = question_banks.resolve(bank_ref) if trigger not in ['start_btn', 'reset_btn'] else None
+    if bank is None:
+        bank = question_banks.get(get_query_param(search, "bank"))
+        trigger = 'start_btn' if trigger not in ['start_btn', 'reset_btn'] else trigger
+    return bank, trigger
+
+def cycle_questions(n1,n2,n3,selection,q_index,test_results:dict,question_ids,input_name,stored_name,search=None,bank_ref=None,seed=None):
+    bank, trigger = get_session_bank(ctx.triggered_id, bank_ref, search)
+    if trigger in ['start_btn', 'reset_btn']:
+        seed = get_session_seed(search) # kept with the test like in SESSION_STORE, so its order can be replayed
+    return advance_questions(trigger,selection,q_index,test_results,question_ids,input_name,stored_name,bank,is_adaptive(search),
+                             seed) + (bank.ref, seed)
+
+def new_session_state(bank: QuestionBank, seed: int) -> dict:
+    """ Test state kept in SESSION_STORE, the same values the browser stores hold otherwise plus the seed of
+    the question order
+    """
+    return {"test_results": dict(original_results),
+            "q_index": 0,
+            "question_ids": list(bank.question_ids),
+            "entered_name": "",
+            "bank": bank.ref,
+            "seed": seed}
+
+@timed()
+def cycle_questions_session(n1,n2,n3,selection,input_name,token,search=None):
+    """ cycle_questions for SESSION_STORE, only the token and the answer come from the browser
+    """
+    trigger = ctx.triggered_id
+    state = SESSION_STORE.get(token) if token else None
+    bank, trigger = get_session_bank(trigger if state is not None else 'start_btn', state and state.get("bank"), search)
+    if trigger in ['start_btn', 'reset_btn']:
+        if token:
+            SESSION_STORE.delete(token)
+        token = SESSION_STORE.new_token()
+        state = new_session_state(bank, get_session_seed(search))
+        trigger = 'start_btn' # an expired session starts over
+
+    (text, hide_next_btn, hide_result_btn, hide_form_div, disable_next_btn, disable_reset_btn, disable_start_btn, form_reset,
+     results, q_index, question_ids, debug_text, score_debug_text, hide_screenshot_msg, hide_troll_question, name_output) = advance_questions(
+        trigger, selection, state["q_index"], state["test_results"], state["question_ids"], input_name, state["entered_name"], bank,
+        is_adaptive(search), state.get("seed"))
+    SESSION_STORE.set(token, {"test_results": {trait: float(score) for trait, score in results.items()},
+                              "q_index": int(q_index),
+                              "question_ids": [str(qid) for qid in question_ids],
+                              "entered_name": name_output,
+                              "bank": bank.ref,
+                              "seed": state.get("seed")})
+
+    return (text, hide_next_btn, hide_result_btn, hide_form_div, disable_next_btn, disable_reset_btn, disable_start_btn, form_reset,
+            debug_text, score_debug_text, hide_screenshot_msg, hide_troll_question, token)
+
+def get_question_text(questions_json: dict, question_ids: list, q_index: int, adaptive: bool = False) -> str:
+    """ "Q3/48: ...", adaptive tests can stop before the last question so they show the most there can be
+    """
+    count = f"Q{q_index+1} of at most {len(questions_json)}" if adaptive else f"Q{q_index+1}/{len(questions_json)}"
+    return f"{count}: {questions_json[question_ids[q_index]]['text']}"
+
+@timed()
+def advance_questions(trigger,selection,q_index,test_results:dict,question_ids,input_name,stored_name,bank:QuestionBank=None,adaptive=False,seed=None):
+    """ Shared question logic, trigger is the id of the button that was clicked, bank defaults to the current default bank
+
+    adaptive: pick the next question from the unanswered ones and stop once the result is settled (see adaptive.py)
+    seed: for the question order of a new test, a fresh one when None
+    """
+    bank = bank if bank is not None else question_banks.get()
+    questions_json = bank.questions_json
+    local_test_results = dict(test_results)
     hide_next_btn = False
     hide_result_btn = True
     hide_form_div = False
@@ -251,8 +571,8 @@ def cycle_questions(n1,n2,n3,selection,q_index,test_results:dict,question_ids,in
     hide_troll_question = True
     name_output = stored_name
     form_reset = None # reset the form value each time the questions are cycled
-    if ctx.triggered_id in ['start_btn', 'reset_btn']:
-        np.random.shuffle(question_ids) # randomize question order each time
+    if trigger in ['start_btn', 'reset_btn']:
+        question_ids = get_question_order(bank, seed) # randomize question order each time
         text = ""
         debug_text = ""
         score_debug_text = ""
@@ -266,7 +586,7 @@ def cycle_questions(n1,n2,n3,selection,q_index,test_results:dict,question_ids,in
                 disable_reset_btn, 
                 disable_start_btn, 
                 form_reset, 
-                deepcopy(original_results), 
+                dict(original_results), 
                 0,
                 question_ids,
                 debug_text,
@@ -279,7 +599,7 @@ def cycle_questions(n1,n2,n3,selection,q_index,test_results:dict,question_ids,in
     if q_index == 0 and len(stored_name) == 0:
         name_output = input_name
         # Do a little trolling
-        if input_name.lower() in ["nic", "nicolas"]:
+        if input_name.lower() in troll_names:
             text = ''
             hide_next_btn = True
             hide_form_div = True
@@ -308,7 +628,7 @@ def cycle_questions(n1,n2,n3,selection,q_index,test_results:dict,question_ids,in
         
         else:
             # Need to set up for the next question with the current q index
-            text = f"Q{q_index+1}/{len(questions_json)}: {questions_json[question_ids[q_index]]['text']}"
+            text = get_question_text(questions_json, question_ids, q_index, adaptive)
             debug_text = f"[{questions_json[question_ids[q_index]]['type']}]"
             score_debug_text = f"{[f'{itype, float(score)}' for itype, score in local_test_results.items()]}"
 
@@ -330,19 +650,26 @@ def cycle_questions(n1,n2,n3,selection,q_index,test_results:dict,question_ids,in
                     name_output)
     
     else:
-        # Get necessary info for incrementing results of the question that was just answered
-        scale = questions_json[question_ids[q_index]]['scale']
-        architype = questions_json[question_ids[q_index]]['type']
-
-        # Increment results
-        if type(architype) == list:
-            for idx, item in enumerate(architype):
-                local_test_results[item] = local_test_results[item] + form_conversion[np.where(selection==np.array(form_options))][0] * scale[idx] / 18.0
-        else:
-            local_test_results[architype] = local_test_results[architype] + form_conversion[np.where(selection==np.array(form_options))][0] * scale / 18.0
-    
-        # Return if the last question was just answered
-        if q_index+1 == len(questions_json):
+        # Increment results with the answer's row of the weight matrix
+        increment = bank.engine.score_answer(question_ids[q_index], selection)
+        for trait, value in zip(bank.engine.traits, increment):
+            local_test_results[trait] = local_test_results[trait] + value
+
+        finished = q_index+1 == len(questions_json)
+        if adaptive and not finished:
+            answered = question_ids[:q_index+1]
+            finished, projected = bank.selector.is_settled(answered, local_test_results)
+            if finished:
+                local_test_results = bank.engine.to_dict(projected) # what the full-length test would most likely have given
+            else:
+                # move the most informative question up next, the ones after it stay in their random order
+                question_ids = list(question_ids)
+                next_id = bank.selector.next_question(answered, question_ids[q_index+1:], local_test_results)
+                swap = question_ids.index(next_id, q_index+1)
+                question_ids[q_index+1], question_ids[swap] = question_ids[swap], question_ids[q_index+1]
+
+        # Return if the last question was just answered, or the adaptive test is settled
+        if finished:
             text = ''
             hide_next_btn = True
             hide_form_div = True
@@ -372,7 +699,7 @@ def cycle_questions(n1,n2,n3,selection,q_index,test_results:dict,question_ids,in
         else:
             # Need to set up for the next question
             q_index += 1
-            text = f"Q{q_index+1}/{len(questions_json)}: {questions_json[question_ids[q_index]]['text']}" # we're zero indexing now :(
+            text = get_question_text(questions_json, question_ids, q_index, adaptive) # we're zero indexing now :(
             debug_text = f"[{questions_json[question_ids[q_index]]['type']}]"
             score_debug_text = f"{[f'{itype, float(score)}' for itype, score in local_test_results.items()]}"
 
@@ -393,8 +720,53 @@ def cycle_questions(n1,n2,n3,selection,q_index,test_results:dict,question_ids,in
                     hide_troll_question,
                     name_output)
 
+if CLIENTSIDE_QUESTIONS:
+    # Same logic as cycle_questions, but run in the browser (see assets/clientside.js)
+    clientside_callback(
+        ClientsideFunction(namespace='personality', function_name='cycle_questions'),
+        *cycle_questions_outputs,
+        *cycle_questions_inputs,
+        State('question_bank_stored','data'),
+        prevent_initial_call=True
+    )
+elif SESSION_STORE is not None:
+    callback(*[output for output in cycle_questions_outputs if output.component_id not in browser_state_stores],
+             Output('session_token','data'),
+             *cycle_questions_inputs[:3],
+             State('form_select','value'),
+             State('troll_name','value'),
+             State('session_token','data'),
+             State('url','search'),
+             prevent_initial_call=True)(cycle_questions_session)
+else:
+    callback(*cycle_questions_outputs,
+             Output('bank_stored','data'),
+             Output('seed_stored','data'),
+             *cycle_questions_inputs,
+             State('url','search'),
+             State('bank_stored','data'),
+             State('seed_stored','data'),
+             prevent_initial_call=True)(cycle_questions)
 
-@callback(
+# Start downloading the result images as soon as the test starts instead of when the result is shown
+clientside_callback(
+    ClientsideFunction(namespace='personality', function_name='prefetch_result_images'),
+    Output('result_images_prefetched','data'),
+    Input('start_btn','n_clicks'),
+    State('result_images_stored','data'),
+    prevent_initial_call=True
+)
+
+# Switch to the analytics page in the browser, nothing is sent to the server for the test page
+clientside_callback(
+    ClientsideFunction(namespace='personality', function_name='show_page'),
+    Output('test_page','hidden'),
+    Output('analytics_page','hidden'),
+    Output('analytics_interval','disabled'),
+    Input('url','pathname'),
+)
+
+return_test_results_outputs = [
     Output('result_plot','figure',allow_duplicate=True),
     Output('results_graph_div','hidden',allow_duplicate=True),
     Output('next_btn','hidden',allow_duplicate=True),
@@ -406,30 +778,85 @@ def cycle_questions(n1,n2,n3,selection,q_index,test_results:dict,question_ids,in
     Output('meme_img','title',allow_duplicate=True),
     Output('screenshot_msg','hidden',allow_duplicate=True),
     Output('troll_div','hidden',allow_duplicate=True),
-    Input('result_btn','n_clicks'),
-    State('test_results_stored','data'),
-    State('troll_entered_name','data'),
-    prevent_initial_call=True
-)
-def return_test_results(n,test_results: dict, stored_name: str):
-    results = np.array(list(test_results.values()))
+    Output('meme_avif','srcSet',allow_duplicate=True),
+    Output('meme_webp','srcSet',allow_duplicate=True),
+    Output('share_link','href'),
+]
+
+@timed()
+def get_shown_results(results: np.ndarray, bank: QuestionBank) -> tuple:
+    """ What the result shows under "Congrats! You're a ...": up to 3 meta types, or the closest archetypes
+    when none match and PERSONALITY_ARCHETYPES is set
+
+    returns: display names, card key that shows exactly these names (see result_cards.py)
+    """
+    indices, _ = bank.meta_index.top_k(results, k=3)
+    meta_indices = [int(i) for i in indices[0] if i >= 0]
+    if not meta_indices and bank.archetype_index is not None:
+        nearest = get_nearest_archetypes(results, bank.archetype_index)
+        return format_archetypes(nearest, bank.archetype_index), card_key(results, archetypes=nearest)
+    return bank.meta_index.names[meta_indices].tolist() or [NO_MATCH], card_key(results, meta_indices=meta_indices)
+
+@timed()
+def return_test_results(n,test_results: dict, stored_name: str, search: str = None, bank_ref: list = None, q_index: int = None):
+    """ q_index: of the last question answered, fewer than the whole bank means an adaptive test stopped early
+    """
+    results = np.array([test_results[trait] for trait in TRAITS]) # the stores come back with their keys sorted
     idx_max = np.where(results == np.max(results))[0][0]
-    type_max = list(test_results.keys())[idx_max]
+    type_max = TRAITS[idx_max]
     # We do a little trolling
-    if stored_name.lower() in ["nic", "nicolas"]:
+    if stored_name.lower() in troll_names:
         img_src = "software_results.png"
         img_alt = "Hate to break the news to you like this, bud"
         meta_children = [html.Ul(id='meta_list', children=[html.Li("Software Engineer")])]
+        share_href = None # the card would give the joke away
     else:
         img_src = results_meme_srcs[type_max]["src"]
         img_alt = results_meme_srcs[type_max]["title"]
-        meta_results_text = get_meta_results(results, meta_json)
-        meta_children = construct_meta_list(meta_results_text)
+        bank = question_banks.resolve(bank_ref) or question_banks.get()
+        names, key = get_shown_results(results, bank)
+        meta_children = construct_meta_list(names)
+        share_href = app.get_relative_path(f"/share/{key}") + get_card_query(bank) # the card shows the same names
+        if RESULTS_LOG is not None:
+            # every match, not just the 3 shown, so the analytics count each meta type whenever it applies
+            stopped_early = q_index is not None and q_index + 1 < len(bank.question_ids)
+            RESULTS_LOG.append(results, bank.meta_index.match_all(results)[0], get_query_param(search, "team"),
+                               MODE_ADAPTIVE if stopped_early else MODE_FULL)
+    srcsets = get_srcsets(asset_manifest, img_src, app.get_asset_url)
     q_index = 0
     hide_plot = False
-    return get_result_plot(results), hide_plot, True, deepcopy(original_results), q_index, meta_children, False, app.get_asset_url(img_src), img_alt, False, True
+    return (get_result_patch(results), hide_plot, True, dict(original_results), q_index, meta_children, False, app.get_asset_url(img_src), img_alt, False, True,
+            srcsets["avif"], srcsets["webp"], share_href)
 
-@callback(
+@timed()
+def return_test_results_session(n, token, search=None):
+    """ return_test_results for SESSION_STORE
+    """
+    state = SESSION_STORE.get(token) if token else None
+    if state is None:
+        raise PreventUpdate # nothing to show for an expired session
+    outputs = list(return_test_results(n, state["test_results"], state["entered_name"], search, state.get("bank"), state.get("q_index")))
+    SESSION_STORE.set(token, dict(state, test_results=outputs[3], q_index=outputs[4]))
+    del outputs[3:5]
+    return tuple(outputs)
+
+if SESSION_STORE is not None:
+    callback(*[output for output in return_test_results_outputs if output.component_id not in browser_state_stores],
+             Input('result_btn','n_clicks'),
+             State('session_token','data'),
+             State('url','search'),
+             prevent_initial_call=True)(return_test_results_session)
+else:
+    callback(*return_test_results_outputs,
+             Input('result_btn','n_clicks'),
+             State('test_results_stored','data'),
+             State('troll_entered_name','data'),
+             State('url','search'),
+             State('bank_stored','data'),
+             State('q_index_stored','data'),
+             prevent_initial_call=True)(return_test_results)
+
+reset_results_outputs = [
     Output('result_plot','figure',allow_duplicate=True),
     Output('results_graph_div','hidden',allow_duplicate=True),
     Output('test_results_stored','data',allow_duplicate=True),
@@ -439,15 +866,29 @@ def return_test_results(n,test_results: dict, stored_name: str):
     Output('troll_div','hidden',allow_duplicate=True),
     Output('troll_entered_name','data',allow_duplicate=True),
     Output('troll_name','value',allow_duplicate=True),
-    Input('reset_btn','n_clicks'),
-    prevent_initial_call=True
-)
+]
+
+@timed()
 def reset_results(n):
-    fig = get_base_image()
+    fig = get_result_patch() # clear the result trace
     q_index = 0
     hide_plot = True
     reset_name = ""
-    return fig, hide_plot, deepcopy(original_results), q_index, True, True, True, reset_name, reset_name
+    return fig, hide_plot, dict(original_results), q_index, True, True, True, reset_name, reset_name
+
+@timed()
+def reset_results_session(n):
+    """ reset_results for SESSION_STORE, cycle_questions_session already starts a fresh session on reset
+    """
+    fig, hide_plot, _, _, hide_meta, hide_screenshot_msg, hide_troll_question, _, reset_name = reset_results(n)
+    return fig, hide_plot, hide_meta, hide_screenshot_msg, hide_troll_question, reset_name
+
+if SESSION_STORE is not None:
+    callback(*[output for output in reset_results_outputs if output.component_id not in browser_state_stores],
+             Input('reset_btn','n_clicks'),
+             prevent_initial_call=True)(reset_results_session)
+else:
+    callback(*reset_results_outputs, Input('reset_btn','n_clicks'), prevent_initial_call=True)(reset_results)
 
 @callback(
     Output('next_btn','disabled',allow_duplicate=True),
@@ -464,6 +905,33 @@ def enable_next_btn(v, name_input,troll_div_hidden):
         return False
     return True
 
+@callback(
+    Output('analytics_summary','children'),
+    Output('analytics_teams','figure'),
+    Output('analytics_traits','figure'),
+    Output('analytics_meta','figure'),
+    Input('analytics_page','hidden'),
+    Input('analytics_interval','n_intervals'),
+    prevent_initial_call=True,
+)
+@timed()
+def update_analytics(hidden, n):
+    """ Fill the analytics page from the results log aggregates, only the rows logged since the last refresh are read
+    """
+    if hidden:
+        raise PreventUpdate
+    if RESULTS_LOG is None:
+        return "Results are not being logged, start the app with PERSONALITY_RESULTS_LOG=<directory>.", {}, {}, {}
+    aggregates = RESULTS_LOG.refresh()
+    return (get_summary(aggregates),
+            get_team_overlay(aggregates, RESULTS_LOG.teams, background_url),
+            get_trait_distributions(aggregates, TRAITS),
+            get_meta_frequencies(aggregates, RESULTS_LOG.meta_types))
+
+mark_startup("layout and callbacks")
+if os.environ.get("PERSONALITY_STARTUP_REPORT", "0") == "1":
+    print("startup: " + ", ".join(f"{stage} {seconds:.3f} s" for stage, seconds in startup_timings.items()))
+
 if __name__ == '__main__':
     # -- For "production"
     # Run this at every start up in order to enable 8080 port forwarding
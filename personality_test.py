@@ -2,107 +2,165 @@ import numpy as np
 import plotly.graph_objects as go
 from PIL import Image
 import json
-from dash import html
+from copy import deepcopy
+from functools import lru_cache
+from dash import html, Patch
 
-# Lambda functions 
-axes_to_polar = lambda points: np.array([np.linalg.norm(points[1]-points[0]), np.atan2(points[1][1] - points[0][1], points[1][0] - points[0][0])])
-get_position = lambda r, polar, points: points[0] + polar[0] * r**2.5 * np.array([np.cos(polar[1]),np.sin(polar[1])])
+from meta_types import MetaTypeIndex, ArchetypeIndex
+from instrumentation import timed
+from bundle import get_app_data
 
-# source = Image.open("./images/personality.jpg") # use this when running from the .bat file
-source = Image.open("./personality_test_app/images/results_dark_mode.png")
+# Lambda function: [low[x,y],high[x,y]] axis -> [length, angle]
+axes_to_polar = lambda points: np.array([np.linalg.norm(points[1]-points[0]), np.atan2(points[1][1] - points[0][1], points[1][0] - points[0][0])])
 
-def get_base_image() -> go.Figure:
-    """ Get the base image figure for the results
+# Axes of traits in results order: [clown, hater, grinder, brick, sender, yapper, wanderer, organizer]
+# ----------------------- [low[x,y],high[x,y]]
+TRAIT_AXES = np.array([[[616,320],[519,91]],    # clown
+                       [[781,388],[1013,294]],  # hater
+                       [[548,484],[317,581]],   # grinder
+                       [[781,484],[1013,581]],  # brick
+                       [[713,320],[809,91]],    # sender
+                       [[548,388],[317,294]],   # yapper
+                       [[713,552],[809,785]],   # wanderer
+                       [[616,552],[520,785]]])  # organizer
+AXES_POLAR = np.array([axes_to_polar(axis) for axis in TRAIT_AXES]) # [length, angle] of every axis
+AXES_ORIGIN = TRAIT_AXES[:, 0].astype(float)
+AXES_DIRECTION = AXES_POLAR[:, [0]] * np.stack([np.cos(AXES_POLAR[:, 1]), np.sin(AXES_POLAR[:, 1])], axis=1)
+# Order the vertices go around the hexagon: clown, sender, hater, brick, wanderer, organizer, grinder, yapper
+POLYGON_ORDER = np.array([0, 4, 1, 3, 6, 7, 2, 5])
+for _table in (TRAIT_AXES, AXES_POLAR, AXES_ORIGIN, AXES_DIRECTION, POLYGON_ORDER):
+    _table.setflags(write=False)
+del _table
+
+def build_base_layout(path: str) -> dict:
+    """ Layout of the base figure with the background embedded as a base64 data uri, the expensive part.
+    bundle.py runs this once at build time.
     """
     fig = go.Figure()
-    sizex, sizey = source.size
-
-    # Add the hexagon plot to the image
-    fig.add_layout_image(
-        x=0,
-        sizex=sizex,
-        y=0,
-        sizey=sizey,
-        xref="x",
-        yref="y",
-        opacity=1.0,
-        layer="below",
-        source=source
-    )
+    with Image.open(path) as image:
+        sizex, sizey = image.size
+
+        # Add the hexagon plot to the image
+        fig.add_layout_image(
+            x=0,
+            sizex=sizex,
+            y=0,
+            sizey=sizey,
+            xref="x",
+            yref="y",
+            opacity=1.0,
+            layer="below",
+            source=image
+        )
     fig.update_xaxes(dict(showgrid=False, range=(0, sizex), visible=False))
     fig.update_yaxes(dict(showgrid=False, scaleanchor='x', range=(sizey, 0), visible=False))
     fig.update_layout(width=int(sizex * 0.75), height=int(sizey * 0.75), plot_bgcolor='#212121', paper_bgcolor='#212121')
 
-    return fig
+    return json.loads(fig.to_json())["layout"]
 
-def get_result_plot(results: np.ndarray) -> go.Figure:
-    """ Produce the test results
+@lru_cache(maxsize=None)
+def _base_figure(source_url: str = None) -> dict:
+    """ Base figure once per background source. With a url the browser fetches (and caches) the background
+    itself, otherwise it stays inlined as a data uri.
+    """
+    layout = deepcopy(get_app_data().base_layout)
+    if source_url is not None:
+        layout["images"][0]["source"] = source_url
+    return {"data": [], "layout": layout}
 
-    results: [clown, hater, grinder, brick, sender, yapper, wanderer, organizer]; values from 0.0 to 1.0
+@timed()
+def get_base_image(source_url: str = None) -> go.Figure:
+    """ Get the base image figure for the results
+    """
+    return go.Figure(deepcopy(_base_figure(source_url)))
+
+def get_result_trace(results: np.ndarray) -> dict:
+    """ Scatter trace for the result polygon, the only part of the result figure that changes per user
+    """
+    x, y = get_result_polygon(results)
+    return dict(type="scatter",
+                name="Result",
+                x=x.tolist(),
+                y=y.tolist(),
+                fill="toself",
+                fillcolor="cyan",
+                opacity=0.7)
+
+@timed()
+def get_result_template(source_url: str = None, results: np.ndarray = None) -> dict:
+    """ Base figure with the Result trace on top (empty unless results are given), as a plain figure dict.
+    Only the trace is new per call, the layout and the encoded background are shared with the cache.
+    """
+    fig = _base_figure(source_url)
+    trace = get_result_trace(results) if results is not None else dict(get_result_trace(np.zeros(8)), x=[], y=[])
+    return {"data": [trace], "layout": fig["layout"]}
+
+@timed()
+def get_result_patch(results: np.ndarray = None) -> Patch:
+    """ Partial update for a figure made by get_result_template: only the Result trace coordinates are sent,
+    results=None clears the polygon
+    """
+    x, y = get_result_polygon(results) if results is not None else (np.array([]), np.array([]))
+    patch = Patch()
+    patch['data'][0]['x'] = x.tolist()
+    patch['data'][0]['y'] = y.tolist()
+    return patch
+
+@timed()
+def get_result_polygons(results: np.ndarray) -> np.ndarray:
+    """ Vertices of the result polygons for many results at once
+
+    results: (N x 8) in the usual trait order; values from 0.0 to 1.0
+    returns: (N x 8 x 2) [x,y] vertices in drawing order around the hexagon
     """
     # Make sure none of the results are greater than 1.0 or less than 0.0
-    results[np.where(results>1.0)[0]] = 1.0
-    results[np.where(results<0.0)[0]] = 0.0
-
-    # Axes of traits 
-    # -------------------- [low[x,y],high[x,y]]
-    clown      = np.array([[616,320],[519,91]])
-    wanderer   = np.array([[713,552],[809,785]])
-    hater      = np.array([[781,388],[1013,294]])
-    grinder    = np.array([[548,484],[317,581]])
-    brick      = np.array([[781,484],[1013,581]])
-    organizer  = np.array([[616,552],[520,785]])
-    yapper     = np.array([[548,388],[317,294]])
-    sender     = np.array([[713,320],[809,91]])
-
-    fig = get_base_image()
-
-    # Get positions of all the results
-    clown_out = get_position(results[0], axes_to_polar(clown), clown)
-    hater_out = get_position(results[1], axes_to_polar(hater), hater)
-    grinder_out = get_position(results[2], axes_to_polar(grinder), grinder)
-    brick_out = get_position(results[3], axes_to_polar(brick), brick)
-    sender_out = get_position(results[4], axes_to_polar(sender), sender)
-    yapper_out = get_position(results[5], axes_to_polar(yapper), yapper)
-    wanderer_out = get_position(results[6], axes_to_polar(wanderer), wanderer)
-    organizer_out = get_position(results[7], axes_to_polar(organizer), organizer)
+    results = np.clip(np.atleast_2d(np.asarray(results, dtype=float)), 0.0, 1.0)
+    positions = AXES_ORIGIN + results[:, :, None]**2.5 * AXES_DIRECTION
+    return positions[:, POLYGON_ORDER]
 
-    # plot the results on top of the image
-    fig.add_scatter(name="Result",
-                    x=[clown_out[0], sender_out[0], hater_out[0], brick_out[0], wanderer_out[0], organizer_out[0], grinder_out[0], yapper_out[0]],
-                    y=[clown_out[1], sender_out[1], hater_out[1], brick_out[1], wanderer_out[1], organizer_out[1], grinder_out[1], yapper_out[1]],
-                    fill="toself",
-                    fillcolor="cyan",
-                    opacity=0.7)
-    
-    return fig
-
-def get_meta_results(results: np.ndarray, meta_dict: dict):
-    """ Process results to see if there is a metatype 
+def get_result_polygon(results: np.ndarray) -> tuple:
+    """ Vertex coordinates of the result polygon on the base image
+
+    results: [clown, hater, grinder, brick, sender, yapper, wanderer, organizer]; values from 0.0 to 1.0
+    returns: x, y arrays in drawing order around the hexagon
+    """
+    polygon = get_result_polygons(results)[0]
+    return polygon[:, 0], polygon[:, 1]
+
+@timed()
+def get_result_plot(results: np.ndarray, source_url: str = None) -> go.Figure:
+    """ Produce the test results
 
-    returns: string for the name of the meta type
+    results: [clown, hater, grinder, brick, sender, yapper, wanderer, organizer]; values from 0.0 to 1.0
     """
+    # plot the results on top of the image
+    return go.Figure(get_result_template(source_url, results))
 
-    meta_array = np.array([list(meta.values())[0:-1] for meta in list(meta_dict.values())]).T
+@timed()
+def get_meta_results(results: np.ndarray, meta: MetaTypeIndex):
+    """ Process results to see if there is a metatype 
 
-    # using the square to eliminate all the irrelevant scores from each meta type and then comparing against the original array 
-    comparison = np.all(np.equal((results.reshape(8,1) * meta_array - meta_array**2) > 0, meta_array > 0),axis=0)
+    meta: MetaTypeIndex built once from meta_traits.json (a raw meta_traits dict also works, but is compiled on every call)
+    returns: names of up to 3 meta types, strongest match first
+    """
+    if isinstance(meta, dict):
+        meta = MetaTypeIndex.from_dict(meta)
+    return meta.match(results, k=3)
 
-    # get the index of the meta type
-    meta_results = []
-    if len(np.where(comparison)[0]) > 0:
-        meta_result_idx = np.where(comparison)[0]
+@timed()
+def get_nearest_archetypes(results: np.ndarray, archetypes: ArchetypeIndex, k: int = 3) -> list:
+    """ The k closest archetypes with how similar they are, for results no meta type matched
 
-        # get the top 3 meta traits
-        for i, idx in enumerate(meta_result_idx):
-            meta_results.append(list(meta_dict.values())[idx]['type'])
-            if i == 2:
-                break
+    returns: [(profile index, similarity in whole percent), ...] closest first, see format_archetypes
+    """
+    indices, distances = archetypes.nearest(results, k)
+    similarities = np.clip(np.rint(100 * (1.0 - distances[0])), 0, 100).astype(int) # opposite directions show as 0%
+    return [(int(i), int(similarity)) for i, similarity in zip(indices[0], similarities) if i >= 0]
 
-        return meta_results
-    
-    else:
-        return ["Yourself!"] # we can't figure out what you are :)
+def format_archetypes(nearest: list, archetypes: ArchetypeIndex) -> list:
+    """ Display names for what get_nearest_archetypes returned
+    """
+    return [f"{archetypes.names[i]} ({similarity}% similar)" for i, similarity in nearest]
 
 def construct_meta_list(results: list):
     """Just constructs the meta list object for display"""
@@ -110,8 +168,7 @@ def construct_meta_list(results: list):
     return children
 
 if __name__=="__main__":
-    with open('./personality_test_app/meta_traits.json', encoding="utf8") as f:
-        meta_json = json.load(f)
+    meta_json = get_app_data().meta_json
 
     # none testing
     # results = np.linspace(0,.1,8)
@@ -0,0 +1,201 @@
+""" Question banks that can be swapped while the app is running
+
+The default bank is questions.json and meta_traits.json next to the app. With PERSONALITY_BANKS=<directory>
+every subdirectory holding a questions.json is another bank named after it, with its own meta_traits.json or
+the default one:
+
+    banks/
+        platform/questions.json
+        sales/questions.json
+        sales/meta_traits.json
+
+A session picks its bank with ?bank=<name> on the test link. The registry checks the files at most every
+POLL_INTERVAL seconds; a changed bank is compiled and validated off to the side and then swapped in with a
+single assignment, so requests never see half a bank, and a broken edit keeps the previous version serving.
+Sessions pin the version they started with: recent versions stay available by (name, version) until
+MAX_VERSIONS newer ones have replaced them. Everything derived from a bank's files (engine, meta types,
+archetypes) hangs off its QuestionBank, so nothing built from the startup files outlives a reload.
+"""
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from scoring import ScoringEngine, TRAITS
+from meta_types import MetaTypeIndex, get_archetype_index
+from bundle import AppData, SOURCES
+from adaptive import AdaptiveSelector
+
+DEFAULT_BANK = "default"
+POLL_INTERVAL = 2.0 # seconds between checks of the bank files
+MAX_VERSIONS = 16 # old versions kept per bank for the sessions still using them
+
+class QuestionBank:
+    """ One version of a question bank, compiled and never modified afterwards
+    """
+    def __init__(self, name: str, version: str, questions_json: dict, meta_json: dict,
+                 engine: ScoringEngine = None, meta_index: MetaTypeIndex = None, archetypes: str = ""):
+        self.name = name
+        self.version = version
+        self.questions_json = questions_json
+        self.meta_json = meta_json
+        self.engine = engine if engine is not None else ScoringEngine(questions_json)
+        self.meta_index = meta_index if meta_index is not None else MetaTypeIndex.from_dict(meta_json)
+        self.question_ids = tuple(str(qid) for qid in self.engine.question_ids)
+        self.archetypes = archetypes # PERSONALITY_ARCHETYPES spec, see get_archetype_index
+        # built here rather than on first use, so threads on a freshly swapped-in version never build them twice
+        self.selector = AdaptiveSelector(self.engine, self.meta_index) # question picker for adaptive tests (see adaptive.py)
+        self.archetype_index = get_archetype_index(archetypes, meta_json) # shown when no meta type matches, None when disabled
+
+    @property
+    def ref(self) -> list:
+        """ What a session stores to find this exact version again
+        """
+        return [self.name, self.version]
+
+    @classmethod
+    def from_files(cls, name: str, questions_path: str, meta_path: str, archetypes: str = "") -> "QuestionBank":
+        """ Load and validate a bank, ValueError describes what is wrong with it
+        """
+        with open(questions_path, "rb") as f:
+            questions_bytes = f.read()
+        with open(meta_path, "rb") as f:
+            meta_bytes = f.read()
+        version = content_version(questions_bytes, meta_bytes)
+        try:
+            questions_json = json.loads(questions_bytes)
+            meta_json = json.loads(meta_bytes)
+            validate(questions_json, meta_json)
+            return cls(name, version, questions_json, meta_json, archetypes=archetypes)
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"Invalid question bank {name!r}: {e!r}") from None
+
+def content_version(questions_bytes: bytes, meta_bytes: bytes) -> str:
+    return hashlib.sha256(questions_bytes + b"\0" + meta_bytes).hexdigest()[:12]
+
+def file_version(questions_path: str, meta_path: str) -> str:
+    """ Version of a bank on disk, without compiling it
+    """
+    with open(questions_path, "rb") as f, open(meta_path, "rb") as g:
+        return content_version(f.read(), g.read())
+
+def validate(questions_json: dict, meta_json: dict):
+    if not isinstance(questions_json, dict) or not questions_json:
+        raise ValueError("questions.json must be a non-empty object")
+    for qid, question in questions_json.items():
+        if not isinstance(question, dict) or not isinstance(question.get("text"), str):
+            raise ValueError(f"Question {qid} needs a text")
+        types = question["type"] if isinstance(question["type"], list) else [question["type"]]
+        unknown = [trait for trait in types if trait not in TRAITS]
+        if unknown:
+            raise ValueError(f"Question {qid} has unknown types {unknown}")
+    if not isinstance(meta_json, dict):
+        raise ValueError("meta_traits.json must be an object")
+    for key, meta in meta_json.items():
+        missing = [field for field in TRAITS + ["type"] if field not in meta]
+        if missing:
+            raise ValueError(f"Meta type {key} is missing {missing}")
+
+class BankRegistry:
+    """ Current version of every bank plus the recent ones in-flight sessions still use
+    """
+    def __init__(self, default: QuestionBank, default_paths: tuple, directory: str = None, poll_interval: float = POLL_INTERVAL,
+                 archetypes: str = ""):
+        self.directory = directory
+        self.poll_interval = poll_interval
+        self.archetypes = archetypes
+        self._sources = {DEFAULT_BANK: default_paths} # name -> (questions path, meta path)
+        self._stamps = {DEFAULT_BANK: self._stamp(default_paths)}
+        self._current = {DEFAULT_BANK: default}
+        self._versions = OrderedDict({(DEFAULT_BANK, default.version): default}) # oldest first
+        self._lock = threading.Lock()
+        self._last_poll = 0.0
+        self.refresh(force=True)
+
+    @staticmethod
+    def _stamp(paths: tuple) -> tuple:
+        try:
+            return tuple((os.stat(path).st_size, os.stat(path).st_mtime_ns) for path in paths)
+        except OSError:
+            return None
+
+    def _discover(self) -> dict:
+        """ name -> (questions path, meta path) for the default bank and every bank directory
+        """
+        sources = {DEFAULT_BANK: self._sources[DEFAULT_BANK]}
+        if self.directory and os.path.isdir(self.directory):
+            for entry in sorted(os.scandir(self.directory), key=lambda e: e.name):
+                questions_path = os.path.join(entry.path, "questions.json")
+                if entry.is_dir() and entry.name != DEFAULT_BANK and os.path.isfile(questions_path):
+                    meta_path = os.path.join(entry.path, "meta_traits.json")
+                    sources[entry.name] = (questions_path, meta_path if os.path.isfile(meta_path) else sources[DEFAULT_BANK][1])
+        return sources
+
+    def refresh(self, force: bool = False):
+        """ Reload every bank whose files changed since the last look, at most every poll_interval seconds
+        """
+        now = time.monotonic()
+        if not force and now - self._last_poll < self.poll_interval:
+            return
+        if not self._lock.acquire(blocking=False):
+            return # another thread is already on it, keep serving the current versions
+        try:
+            self._last_poll = now
+            sources = self._discover()
+            for name, paths in sources.items():
+                stamp = self._stamp(paths)
+                if stamp is None or (stamp == self._stamps.get(name) and name in self._current):
+                    continue
+                self._stamps[name] = stamp
+                try:
+                    bank = QuestionBank.from_files(name, *paths, archetypes=self.archetypes)
+                except (OSError, ValueError) as e:
+                    print(f"Keeping the previous version of question bank {name!r}: {e}", file=sys.stderr)
+                    continue
+                if name in self._current and self._current[name].version == bank.version:
+                    continue
+                self._versions[(name, bank.version)] = bank
+                while sum(1 for bank_name, _ in self._versions if bank_name == name) > MAX_VERSIONS:
+                    del self._versions[next(key for key in self._versions if key[0] == name)]
+                current = dict(self._current)
+                current[name] = bank
+                self._current = current # one assignment, readers see the old or the new mapping
+            removed = [name for name in self._current if name not in sources]
+            if removed:
+                self._current = {name: bank for name, bank in self._current.items() if name in sources}
+            self._sources = sources
+        finally:
+            self._lock.release()
+
+    def names(self) -> list:
+        self.refresh()
+        return list(self._current)
+
+    def get(self, name: str = None, version: str = None):
+        """ A specific version (None once it's gone), or the current version of a bank (the default bank for
+        unknown names)
+        """
+        self.refresh()
+        if version is not None:
+            return self._versions.get((name, version))
+        current = self._current
+        return current.get(name) or current[DEFAULT_BANK]
+
+    def resolve(self, ref) -> "QuestionBank":
+        """ The bank a session stored with QuestionBank.ref, None when that version is no longer kept or the ref
+        isn't one (it comes back from the browser)
+        """
+        if not isinstance(ref, (list, tuple)) or len(ref) != 2 or not all(isinstance(part, str) for part in ref):
+            return None
+        return self.get(*ref)
+
+def get_bank_registry(app_data: AppData, directory: str = None, archetypes: str = "") -> BankRegistry:
+    """ Registry whose default bank starts out as the app data that is already loaded (bundle.py)
+    """
+    paths = (SOURCES["questions"], SOURCES["meta_traits"])
+    default = QuestionBank(DEFAULT_BANK, file_version(*paths), app_data.questions_json, app_data.meta_json,
+                           app_data.engine, app_data.meta_index, archetypes)
+    return BankRegistry(default, paths, directory, archetypes=archetypes)
@@ -0,0 +1,241 @@
+""" Static PNG/SVG cards of a result for sharing and link previews
+
+A card is the result polygon drawn on the results background with the meta types underneath. Cards are
+identified by a key that doubles as a shareable url: the result quantized to CARD_LEVELS steps per trait
+(so near-identical results share one card), followed by what the result page showed under it, as indices
+into the question bank it was scored with:
+
+    <result>                      two hex digits per trait, meta types are worked out again from the result
+    <result>m<meta>...            up to 3 meta type indices, two hex digits each; "m" alone is "Yourself!"
+    <result>a<profile><pct>...    closest archetypes, six hex digits of profile index and two of similarity
+
+Working the meta types out again from the quantized result can flip the ones close to a threshold, so
+cards for the result page always carry the indices. Rendered cards are kept in a CardCache: a
+byte-bounded LRU in memory, optionally backed by a byte-bounded directory every worker can reuse.
+"""
+import base64
+import io
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from xml.sax.saxutils import escape
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+from personality_test import get_result_polygon
+
+CARD_LEVELS = 100 # quantization steps per trait, results are clipped to 0..1 like the plot
+CARD_FORMATS = {"png": "image/png", "svg": "image/svg+xml"}
+CARD_SCALE = 0.75 # same as the result figure
+PANEL_HEIGHT = 170 # px below the background for the meta types, before scaling
+FILL_COLOR = (0, 255, 255) # cyan, like the Result trace
+LINE_COLOR = (99, 110, 250) # plotly's default trace color
+BACKGROUND_COLOR = (33, 33, 33)
+MAX_MEMORY_BYTES = 32 * 1024 * 1024
+MAX_DISK_BYTES = 256 * 1024 * 1024
+
+def quantize(results: np.ndarray) -> str:
+    """ Result -> card key, one hex byte per trait
+    """
+    levels = np.rint(np.clip(np.asarray(results, dtype=float), 0.0, 1.0) * CARD_LEVELS).astype(np.uint8)
+    return levels.tobytes().hex()
+
+def dequantize(key: str, n_traits: int = 8) -> np.ndarray:
+    """ Card key -> result, ValueError for anything quantize could not have produced
+    """
+    if len(key) != 2 * n_traits or not re.fullmatch(r"[0-9a-f]*", key):
+        raise ValueError(f"Invalid card key: {key!r}")
+    levels = np.frombuffer(bytes.fromhex(key), dtype=np.uint8)
+    if np.any(levels > CARD_LEVELS):
+        raise ValueError(f"Invalid card key: {key!r}")
+    return levels / CARD_LEVELS
+
+def card_key(results: np.ndarray, meta_indices: list = None, archetypes: list = None) -> str:
+    """ Key of the card showing exactly these meta types (indices into the bank's MetaTypeIndex, [] for
+    "Yourself!") or archetypes ([(profile index, similarity percent), ...])
+    """
+    key = quantize(results)
+    if archetypes is not None:
+        return key + "a" + "".join(f"{index:06x}{similarity:02x}" for index, similarity in archetypes[:3])
+    if meta_indices is not None:
+        return key + "m" + "".join(f"{index:02x}" for index in meta_indices[:3])
+    return key
+
+def parse_card_key(key: str, n_traits: int = 8) -> tuple:
+    """ Card key -> (result, meta type indices, archetypes), None for what the key doesn't say. ValueError
+    for anything card_key could not have produced
+    """
+    match = re.fullmatch(rf"([0-9a-f]{{{2 * n_traits}}})(?:m((?:[0-9a-f]{{2}}){{0,3}})|a((?:[0-9a-f]{{8}}){{1,3}}))?", key)
+    if match is None:
+        raise ValueError(f"Invalid card key: {key!r}")
+    results_key, meta, archetypes = match.groups()
+    if meta is not None:
+        meta = [int(meta[i:i + 2], 16) for i in range(0, len(meta), 2)]
+    if archetypes is not None:
+        archetypes = [(int(archetypes[i:i + 6], 16), int(archetypes[i + 6:i + 8], 16)) for i in range(0, len(archetypes), 8)]
+        if any(similarity > 100 for _, similarity in archetypes):
+            raise ValueError(f"Invalid card key: {key!r}")
+    return dequantize(results_key, n_traits), meta, archetypes
+
+@lru_cache(maxsize=None)
+def get_background_pixels(path: str) -> tuple:
+    """ Decoded background as ((width, height), RGBA bytes), decoded once and immutable so every thread can share it
+    """
+    with Image.open(path) as image:
+        image = image.convert("RGBA")
+        return image.size, image.tobytes()
+
+@lru_cache(maxsize=None)
+def get_background_data_uri(path: str) -> str:
+    """ The background file as a data: url, read once
+    """
+    with open(path, "rb") as f:
+        return "data:image/png;base64," + base64.b64encode(f.read()).decode("ascii")
+
+def get_background(path: str):
+    """ The background as a new PIL image, renders never share one
+    """
+    size, pixels = get_background_pixels(path)
+    return Image.frombytes("RGBA", size, pixels)
+
+def render_png(results: np.ndarray, meta_names: list, background_path: str) -> bytes:
+    background = get_background(background_path)
+    width, height = background.size
+    card = Image.new("RGBA", (width, height + PANEL_HEIGHT), BACKGROUND_COLOR + (255,))
+    card.paste(background, (0, 0))
+
+    x, y = get_result_polygon(results)
+    points = list(zip(x.tolist(), y.tolist()))
+    overlay = Image.new("RGBA", card.size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(overlay)
+    draw.polygon(points, fill=FILL_COLOR + (int(255 * 0.7),))
+    draw.line(points + points[:1], fill=LINE_COLOR + (int(255 * 0.7),), width=3, joint="curve")
+    card.alpha_composite(overlay)
+
+    draw = ImageDraw.Draw(card)
+    title_font = ImageFont.load_default(size=40)
+    font = ImageFont.load_default(size=30)
+    draw.text((40, height + 10), "Congrats! You're a ...", fill="white", font=title_font)
+    for i, name in enumerate(meta_names[:3]):
+        draw.text((60, height + 65 + 34 * i), f"- {name}", fill="white", font=font)
+
+    card = card.convert("RGB").resize((int(card.width * CARD_SCALE), int(card.height * CARD_SCALE)))
+    buffer = io.BytesIO()
+    card.save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
+
+def render_svg(results: np.ndarray, meta_names: list, background_path: str) -> bytes:
+    """ Vector card with the background embedded as a data: url, images and link previews never load what
+    an SVG links to
+    """
+    (width, height), _ = get_background_pixels(background_path)
+    background = get_background_data_uri(background_path)
+    x, y = get_result_polygon(results)
+    points = " ".join(f"{px:.1f},{py:.1f}" for px, py in zip(x, y))
+    lines = "".join(f'<text x="60" y="{height + 95 + 34 * i}" font-size="30">- {escape(name)}</text>' for i, name in enumerate(meta_names[:3]))
+    svg = (f'<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" '
+           f'width="{int(width * CARD_SCALE)}" height="{int((height + PANEL_HEIGHT) * CARD_SCALE)}" viewBox="0 0 {width} {height + PANEL_HEIGHT}">'
+           f'<rect width="100%" height="100%" fill="rgb{BACKGROUND_COLOR}"/>'
+           f'<image href="{background}" xlink:href="{background}" x="0" y="0" width="{width}" height="{height}"/>'
+           f'<polygon points="{points}" fill="rgb{FILL_COLOR}" stroke="rgb{LINE_COLOR}" stroke-width="3" opacity="0.7"/>'
+           f'<g fill="white" font-family="Comic Sans MS, Comic Sans, cursive">'
+           f'<text x="40" y="{height + 50}" font-size="40">Congrats! You\'re a ...</text>{lines}</g></svg>')
+    return svg.encode()
+
+class CardCache:
+    """ Rendered cards by name, a byte-bounded LRU in memory in front of an optional byte-bounded directory
+
+    The directory is shared by every worker, each one evicts the least recently used files (by mtime, which
+    is bumped on every hit) once its estimate of the directory size goes over max_disk_bytes.
+    """
+    def __init__(self, directory: str = None, max_memory_bytes: int = MAX_MEMORY_BYTES, max_disk_bytes: int = MAX_DISK_BYTES):
+        self.directory = directory
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self._cards = OrderedDict() # name -> bytes, least recently used first
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._disk_bytes = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._disk_bytes = sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+
+    def get(self, name: str):
+        with self._lock:
+            card = self._cards.get(name)
+            if card is not None:
+                self._cards.move_to_end(name)
+                return card
+        if self.directory:
+            path = os.path.join(self.directory, name)
+            try:
+                with open(path, "rb") as f:
+                    card = f.read()
+                os.utime(path)
+            except OSError:
+                return None
+            self._remember(name, card)
+        return card
+
+    def put(self, name: str, card: bytes):
+        self._remember(name, card)
+        if self.directory:
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(card)
+            os.replace(tmp_path, os.path.join(self.directory, name))
+            with self._lock:
+                self._disk_bytes += len(card)
+                evict = self._disk_bytes > self.max_disk_bytes
+            if evict:
+                self._evict_disk()
+
+    def get_or_render(self, name: str, render) -> bytes:
+        card = self.get(name)
+        if card is None:
+            card = render()
+            self.put(name, card)
+        return card
+
+    def _remember(self, name: str, card: bytes):
+        if len(card) > self.max_memory_bytes:
+            return
+        with self._lock:
+            previous = self._cards.pop(name, None)
+            if previous is not None:
+                self._memory_bytes -= len(previous)
+            self._cards[name] = card
+            self._memory_bytes += len(card)
+            while self._memory_bytes > self.max_memory_bytes:
+                _, oldest = self._cards.popitem(last=False)
+                self._memory_bytes -= len(oldest)
+
+    def _evict_disk(self):
+        """ Delete the least recently used files until the directory is down to 80% of its limit
+        """
+        entries = []
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.is_file() and not entry.name.endswith(".tmp"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            except OSError:
+                pass # deleted by another worker
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= 0.8 * self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+        with self._lock:
+            self._disk_bytes = total
+
+    def __len__(self):
+        return len(self._cards)
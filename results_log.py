@@ -0,0 +1,358 @@
+""" Append-only log of returned results, with running aggregates for the analytics page
+
+Enabled with PERSONALITY_RESULTS_LOG=<directory>. The log is columnar, one raw little-endian file per column
+that is only ever appended to and is read back with np.memmap:
+
+    scores.f4   float32 (N x traits)  trait vector as returned
+    meta.u4     uint32 bit mask of every matched meta type, bit i = meta_types[i] in schema.json, 0 = "Yourself!"
+    team.u2     uint16 index into teams.json, 0 = no team
+    time.f8     float64 unix time
+    mode.u1     uint8 how the test was taken: 0 = every question answered, 1 = adaptive test that stopped early
+
+schema.json only ever grows: meta type names that aren't in it yet (an edited meta_traits.json, another
+question bank) are appended under the lock, so a bit keeps its meaning for every row already written. Up to
+MAX_META_TYPES names fit in the mask, later ones are logged without a bit.
+
+The aggregates the analytics page shows (counts, sums, histograms, meta type and team counts) are updated
+incrementally: every process folds in the rows appended since it last looked and checkpoints them to
+aggregates.npz, so a fresh process only reads the tail of the log instead of all of it. Only full-length
+results go into them: an adaptive test that stopped early shows the expected full-length result (see
+adaptive.py), which would pull the distributions towards the model, so those rows are only counted.
+"""
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from copy import deepcopy
+
+import numpy as np
+
+from meta_types import NO_MATCH
+
+try:
+    import fcntl # appends from several workers are serialized with a lock file where the OS supports it
+except ImportError:
+    fcntl = None
+
+COLUMNS = {
+    "scores": ("scores.f4", np.dtype("<f4")),
+    "meta": ("meta.u4", np.dtype("<u4")),
+    "team": ("team.u2", np.dtype("<u2")),
+    "time": ("time.f8", np.dtype("<f8")),
+    "mode": ("mode.u1", np.dtype("<u1")),
+}
+MODE_FULL = 0 # every question answered
+MODE_ADAPTIVE = 1 # adaptive test that stopped early, the scores are partly imputed
+HIST_BINS = 20 # over the 0..1 range the result plot shows, values outside land in the first/last bin
+CHECKPOINT_ROWS = 1000 # new rows folded in before the aggregates are written back to disk
+MAX_TEAMS = 1000 # later teams are logged without one
+MAX_META_TYPES = 32 # bits in the meta column
+TEAM_NAME_LENGTH = 32
+
+def atomic_write(path: str, write):
+    """ Write through a temporary file so readers never see half of it
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+class ResultAggregates:
+    """ Everything the analytics page shows, computable from any prefix of the log and extendable row by row
+    """
+    def __init__(self, n_traits: int, n_meta: int):
+        self.rows = 0 # rows of the log folded in so far
+        self.results = 0 # full-length results among them, everything below is over these
+        self.adaptive = 0 # adaptive tests that stopped early, only counted
+        self.sums = np.zeros(n_traits)
+        self.squares = np.zeros(n_traits)
+        self.histograms = np.zeros((n_traits, HIST_BINS), dtype=np.int64)
+        self.meta_counts = np.zeros(n_meta, dtype=np.int64)
+        self.no_match = 0
+        self.team_counts = np.zeros(1, dtype=np.int64)
+        self.team_sums = np.zeros((1, n_traits))
+
+    def update(self, scores: np.ndarray, meta: np.ndarray, team: np.ndarray, mode: np.ndarray = None):
+        """ Fold in a block of rows, vectorized over the block
+        """
+        if len(scores) == 0:
+            return
+        self.rows += len(scores)
+        if mode is not None:
+            full = np.asarray(mode) == MODE_FULL
+            self.adaptive += int(np.count_nonzero(~full))
+            scores, meta, team = np.asarray(scores)[full], np.asarray(meta)[full], np.asarray(team)[full]
+            if len(scores) == 0:
+                return
+        scores = np.asarray(scores, dtype=float)
+        n_traits = scores.shape[1]
+        self.results += len(scores)
+        self.sums += scores.sum(axis=0)
+        self.squares += (scores**2).sum(axis=0)
+
+        bins = np.clip((scores * HIST_BINS).astype(int), 0, HIST_BINS - 1)
+        # one bincount over (trait, bin) pairs instead of a loop per trait
+        self.histograms += np.bincount((bins + np.arange(n_traits) * HIST_BINS).ravel(),
+                                       minlength=n_traits * HIST_BINS).reshape(n_traits, HIST_BINS)
+
+        meta = np.asarray(meta, dtype=np.uint32)
+        self.extend_meta(int(meta.max()).bit_length()) # types added to the schema since these aggregates were made
+        bits = (meta[:, None] >> np.arange(len(self.meta_counts), dtype=np.uint32)) & 1
+        self.meta_counts += bits.sum(axis=0, dtype=np.int64)
+        self.no_match += int(np.count_nonzero(meta == 0))
+
+        team = np.asarray(team, dtype=np.int64)
+        n_teams = max(len(self.team_counts), int(team.max()) + 1)
+        if n_teams > len(self.team_counts):
+            self.team_counts = np.pad(self.team_counts, (0, n_teams - len(self.team_counts)))
+            self.team_sums = np.pad(self.team_sums, ((0, n_teams - len(self.team_sums)), (0, 0)))
+        self.team_counts += np.bincount(team, minlength=n_teams)
+        np.add.at(self.team_sums, team, scores)
+
+    def extend_meta(self, n_meta: int):
+        """ Make room for n_meta meta types, the schema only ever appends
+        """
+        if n_meta > len(self.meta_counts):
+            self.meta_counts = np.pad(self.meta_counts, (0, n_meta - len(self.meta_counts)))
+
+    def means(self) -> np.ndarray:
+        return self.sums / max(self.results, 1)
+
+    def stds(self) -> np.ndarray:
+        return np.sqrt(np.maximum(self.squares / max(self.results, 1) - self.means()**2, 0.0))
+
+    def team_means(self) -> np.ndarray:
+        """ (teams x traits) average result per team, zeros for teams without results
+        """
+        return self.team_sums / np.maximum(self.team_counts, 1)[:, None]
+
+    def save(self, path: str):
+        atomic_write(path, lambda f: np.savez(f, rows=self.rows, results=self.results, adaptive=self.adaptive, sums=self.sums, squares=self.squares,
+                                              histograms=self.histograms, meta_counts=self.meta_counts,
+                                              no_match=self.no_match, team_counts=self.team_counts,
+                                              team_sums=self.team_sums))
+
+    @classmethod
+    def load(cls, path: str, n_traits: int, n_meta: int):
+        """ returns: the checkpoint, or None when it is missing, from an older version or doesn't fit the schema
+        """
+        try:
+            data = np.load(path, allow_pickle=False)
+        except (OSError, ValueError):
+            return None
+        with data:
+            aggregates = cls(n_traits, n_meta)
+            if data["histograms"].shape != aggregates.histograms.shape or len(data["meta_counts"]) > n_meta:
+                return None
+            try:
+                aggregates.rows = int(data["rows"])
+                aggregates.results = int(data["results"])
+                aggregates.adaptive = int(data["adaptive"])
+                aggregates.sums = data["sums"]
+                aggregates.squares = data["squares"]
+                aggregates.histograms = data["histograms"]
+                aggregates.meta_counts = data["meta_counts"]
+                aggregates.no_match = int(data["no_match"])
+                aggregates.team_counts = data["team_counts"]
+                aggregates.team_sums = data["team_sums"]
+            except KeyError:
+                return None # written before a field existed, rebuilt from the log
+        aggregates.extend_meta(n_meta)
+        return aggregates
+
+class ResultsLog:
+    """ The log directory, shared by every worker that writes to it
+    """
+    def __init__(self, directory: str, traits: list, meta_types: list):
+        if len(meta_types) > MAX_META_TYPES:
+            raise ValueError(f"The results log holds up to {MAX_META_TYPES} meta types, got {len(meta_types)}")
+        self.directory = directory
+        self.traits = list(traits)
+        self.meta_types = []
+        self._meta_bits = {}
+        self._thread_lock = threading.Lock()
+        self._aggregate_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+        with self._lock():
+            schema = self._load_schema()
+            if schema is not None and schema["traits"] != self.traits:
+                raise ValueError(f"{directory} was written with other traits, use a new directory")
+            self._set_meta_types(schema["meta_types"] if schema is not None else [])
+            self._append_meta_types(meta_types)
+            mode_path = self._path(COLUMNS["mode"][0])
+            if not os.path.exists(mode_path):
+                # a log from before the mode column, every test in it answered every question
+                rows = min(self._column_rows(name) for name in COLUMNS if name != "mode")
+                atomic_write(mode_path, lambda f: f.write(np.full(rows, MODE_FULL, dtype=COLUMNS["mode"][1]).tobytes()))
+            # a crash between column writes leaves some columns a row ahead, cut them back to the complete rows
+            rows = self.rows()
+            for name, (filename, dtype) in COLUMNS.items():
+                with open(self._path(filename), "ab") as f:
+                    f.truncate(rows * self._row_bytes(name))
+            self.teams = self._load_teams()
+
+        self._team_index = {team: i for i, team in enumerate(self.teams)}
+        self.aggregates = ResultAggregates.load(self._path("aggregates.npz"), len(self.traits), len(self.meta_types))
+        if self.aggregates is None or self.aggregates.rows > self.rows():
+            self.aggregates = ResultAggregates(len(self.traits), len(self.meta_types))
+        self._checkpointed = self.aggregates.rows
+
+    def _path(self, filename: str) -> str:
+        return os.path.join(self.directory, filename)
+
+    def _row_bytes(self, column: str) -> int:
+        _, dtype = COLUMNS[column]
+        return dtype.itemsize * (len(self.traits) if column == "scores" else 1)
+
+    @contextmanager
+    def _lock(self):
+        with self._thread_lock, open(self._path(".lock"), "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def _load_schema(self):
+        try:
+            with open(self._path("schema.json"), encoding="utf8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _set_meta_types(self, meta_types: list):
+        self.meta_types = list(meta_types)
+        self._meta_bits = {name: 1 << i for i, name in enumerate(self.meta_types)}
+
+    def _append_meta_types(self, names: list):
+        """ Add the names the schema doesn't have yet, call with the lock held and the schema freshly loaded
+        """
+        new = [name for name in dict.fromkeys(names) if name not in self._meta_bits and name != NO_MATCH]
+        if not new:
+            return
+        fitting = new[:MAX_META_TYPES - len(self.meta_types)]
+        if len(fitting) < len(new):
+            print(f"Results log is full ({MAX_META_TYPES} meta types), not logging {new[len(fitting):]}", file=sys.stderr)
+        if fitting:
+            self._set_meta_types(self.meta_types + fitting)
+            schema = {"traits": self.traits, "meta_types": self.meta_types}
+            atomic_write(self._path("schema.json"), lambda f: f.write(json.dumps(schema).encode()))
+
+    def add_meta_types(self, names: list):
+        """ Register meta type names, e.g. after meta_traits.json was edited, keeping the bits of the known ones
+        """
+        if all(name in self._meta_bits or name == NO_MATCH for name in names):
+            return
+        with self._lock():
+            self._set_meta_types(self._load_schema()["meta_types"]) # another worker may have added some
+            self._append_meta_types(names)
+
+    def _load_teams(self) -> list:
+        try:
+            with open(self._path("teams.json"), encoding="utf8") as f:
+                return json.load(f)
+        except OSError:
+            return [""]
+
+    def rows(self) -> int:
+        """ Complete rows in the log, a row only counts once every column has it
+        """
+        return min(self._column_rows(name) for name in COLUMNS)
+
+    def _column_rows(self, name: str) -> int:
+        try:
+            return os.path.getsize(self._path(COLUMNS[name][0])) // self._row_bytes(name)
+        except OSError:
+            return 0
+
+    def column(self, name: str, start: int = 0, stop: int = None) -> np.ndarray:
+        """ Read-only memory map of rows start:stop of one column
+        """
+        stop = self.rows() if stop is None else stop
+        filename, dtype = COLUMNS[name]
+        shape = (stop - start, len(self.traits)) if name == "scores" else (stop - start,)
+        if stop <= start:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(self._path(filename), dtype=dtype, mode="r", offset=start * self._row_bytes(name), shape=shape)
+
+    def team_index(self, team: str) -> int:
+        """ Index of a team in teams.json, registering it on first use. 0 (no team) once MAX_TEAMS is reached
+        """
+        team = (team or "").strip().lower()[:TEAM_NAME_LENGTH]
+        if team in self._team_index:
+            return self._team_index[team]
+        with self._lock():
+            self.teams = self._load_teams() # another worker may have added some
+            if team not in self.teams and len(self.teams) < MAX_TEAMS:
+                self.teams.append(team)
+                atomic_write(self._path("teams.json"), lambda f: f.write(json.dumps(self.teams).encode()))
+            self._team_index = {name: i for i, name in enumerate(self.teams)}
+        return self._team_index.get(team, 0)
+
+    def meta_mask(self, matches: list) -> int:
+        """ Matched meta type names -> bit mask, names new to the schema are added to it. "Yourself!" sets no bits.
+        """
+        self.add_meta_types(matches)
+        mask = 0
+        for name in matches:
+            mask |= self._meta_bits.get(name, 0)
+        return mask
+
+    def append_batch(self, scores: np.ndarray, meta: np.ndarray, team: np.ndarray, timestamps: np.ndarray = None,
+                     mode: np.ndarray = None):
+        """ Append N rows, every column is written under one lock so the columns never interleave. mode defaults
+        to MODE_FULL for every row
+        """
+        scores = np.atleast_2d(np.asarray(scores, dtype=COLUMNS["scores"][1]))
+        timestamps = np.full(len(scores), time.time()) if timestamps is None else timestamps
+        columns = {
+            "scores": scores,
+            "meta": np.asarray(meta, dtype=COLUMNS["meta"][1]).reshape(len(scores)),
+            "team": np.asarray(team, dtype=COLUMNS["team"][1]).reshape(len(scores)),
+            "time": np.asarray(timestamps, dtype=COLUMNS["time"][1]).reshape(len(scores)),
+            "mode": np.full(len(scores), MODE_FULL, dtype=COLUMNS["mode"][1]) if mode is None
+                    else np.asarray(mode, dtype=COLUMNS["mode"][1]).reshape(len(scores)),
+        }
+        with self._lock():
+            for name, (filename, _) in COLUMNS.items():
+                with open(self._path(filename), "ab") as f:
+                    f.write(columns[name].tobytes())
+
+    def append(self, scores: np.ndarray, matches: list, team: str = "", mode: int = MODE_FULL):
+        """ Log one result with every meta type it matches (MetaTypeIndex.match_all), not just the ones shown
+        """
+        self.append_batch(scores, [self.meta_mask(matches)], [self.team_index(team)], mode=[mode])
+
+    def refresh(self) -> ResultAggregates:
+        """ Fold in the rows appended since the last refresh (by any worker) -> snapshot of the aggregates
+        """
+        with self._aggregate_lock:
+            start, stop = self.aggregates.rows, self.rows()
+            if stop > start:
+                team = self.column("team", start, stop)
+                if team.max() >= len(self.teams):
+                    self.teams = self._load_teams()
+                    self._team_index = {name: i for i, name in enumerate(self.teams)}
+                meta = self.column("meta", start, stop)
+                if int(meta.max()).bit_length() > len(self.meta_types):
+                    with self._lock():
+                        self._set_meta_types(self._load_schema()["meta_types"]) # names another worker added
+                self.aggregates.update(self.column("scores", start, stop), meta, team, self.column("mode", start, stop))
+                if self.aggregates.rows - self._checkpointed >= CHECKPOINT_ROWS:
+                    self.aggregates.save(self._path("aggregates.npz"))
+                    self._checkpointed = self.aggregates.rows
+            self.aggregates.extend_meta(len(self.meta_types))
+            return deepcopy(self.aggregates)
+
+def get_results_log(directory: str, traits: list, meta_types: list):
+    """ returns: None for an empty directory setting, meaning results are not logged
+    """
+    if not directory:
+        return None
+    return ResultsLog(directory, traits, meta_types)
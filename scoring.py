@@ -0,0 +1,114 @@
+import numpy as np
+
+# Order of the traits everywhere results are handled as arrays
+TRAITS = ["clown", "hater", "grinder", "brick", "sender", "yapper", "wanderer", "organizer"]
+
+FORM_OPTIONS = ["Strongly Agree", "Agree", "Slightly Agree", "Slightly Disagree", "Disagree", "Strongly Disagree"]
+FORM_CONVERSION = np.array([3.25, 3.0, 2.0, 1.0, 0.0, -0.25])
+FORM_CONVERSION.setflags(write=False)
+SCORE_NORMALIZATION = 18.0
+
+class ScoringEngine:
+    """ Question bank compiled into a dense (questions x traits) weight matrix
+
+    An answer sheet is a vector of converted answer values in `question_ids` order, so scoring one sheet is
+    a single matrix-vector product and scoring a batch of sheets (N x questions) is a single matrix-matrix product.
+
+    normalization: a scalar (the historical 18.0), an array with one divisor per trait, or "max" to divide
+    each trait by the highest raw score the bank allows for it
+    """
+    def __init__(self, questions: dict, conversion: np.ndarray = FORM_CONVERSION, options: list = FORM_OPTIONS,
+                 normalization=SCORE_NORMALIZATION, traits: list = TRAITS):
+        question_ids = list(questions.keys())
+        trait_index = {trait: i for i, trait in enumerate(traits)}
+
+        weights = np.zeros((len(question_ids), len(traits)))
+        for row, question in enumerate(questions.values()):
+            architype = question['type'] if type(question['type']) == list else [question['type']]
+            scale = question['scale'] if type(question['scale']) == list else [question['scale']]
+            if len(architype) != len(scale):
+                raise ValueError(f"Question {question_ids[row]} has {len(architype)} types but {len(scale)} scales")
+            for item, s in zip(architype, scale):
+                weights[row, trait_index[item]] += s
+
+        if isinstance(normalization, str) and normalization == "max":
+            # best case answer on every question, picking the extreme that pushes the trait up
+            conversion = np.asarray(conversion, dtype=float)
+            best = np.maximum(weights * conversion.max(), weights * conversion.min())
+            normalization = best.sum(axis=0)
+        self._setup(question_ids, weights, normalization, conversion, options, traits)
+
+    @classmethod
+    def from_compiled(cls, question_ids, weights: np.ndarray, normalization, conversion: np.ndarray = FORM_CONVERSION,
+                      options: list = FORM_OPTIONS, traits: list = TRAITS) -> "ScoringEngine":
+        """ Engine from an already compiled weight matrix, e.g. the one stored in bundle.npz
+        """
+        engine = cls.__new__(cls)
+        engine._setup(question_ids, weights, normalization, conversion, options, traits)
+        return engine
+
+    def _setup(self, question_ids, weights, normalization, conversion, options, traits):
+        self.traits = list(traits)
+        self.options = list(options)
+        self.conversion = np.array(conversion, dtype=float)
+        self.question_ids = np.array(question_ids)
+        self.question_index = {str(qid): i for i, qid in enumerate(self.question_ids)}
+        self.option_index = {option: i for i, option in enumerate(self.options)}
+        self.weights = np.array(weights, dtype=float)
+        if self.weights.shape != (len(self.question_ids), len(self.traits)):
+            raise ValueError(f"Expected weights of shape {(len(self.question_ids), len(self.traits))}, got {self.weights.shape}")
+        self.normalization = np.broadcast_to(np.asarray(normalization, dtype=float), (len(self.traits),)).copy()
+        if np.any(self.normalization <= 0):
+            raise ValueError("Normalization must be positive for every trait")
+        # shared by every request thread, so nothing may change them after compiling
+        for array in (self.conversion, self.question_ids, self.weights, self.normalization):
+            array.setflags(write=False)
+
+    def __len__(self):
+        return len(self.question_ids)
+
+    def encode(self, selections) -> np.ndarray:
+        """ Convert answers (option text or option index) into answer values, keeping the input shape
+        """
+        selections = np.asarray(selections, dtype=object)
+        flat = selections.ravel()
+        idx = np.empty(flat.shape, dtype=int)
+        for i, selection in enumerate(flat):
+            if isinstance(selection, str):
+                if selection not in self.option_index:
+                    raise ValueError(f"Unknown answer: {selection!r}")
+                idx[i] = self.option_index[selection]
+            elif isinstance(selection, (int, np.integer)) and 0 <= selection < len(self.options):
+                idx[i] = selection
+            else:
+                raise ValueError(f"Unknown answer: {selection!r}")
+        return self.conversion[idx].reshape(selections.shape)
+
+    def encode_sheet(self, sheet: dict) -> np.ndarray:
+        """ Convert a {question_id: answer} mapping into an answer value vector in `question_ids` order
+        """
+        missing = [qid for qid in self.question_ids if qid not in sheet]
+        if missing:
+            raise ValueError(f"Missing answers for {', '.join(missing)}")
+        return self.encode([sheet[qid] for qid in self.question_ids])
+
+    def score(self, values: np.ndarray) -> np.ndarray:
+        """ Score a single sheet of answer values -> (traits,)
+        """
+        return np.asarray(values, dtype=float) @ self.weights / self.normalization
+
+    def score_batch(self, values: np.ndarray) -> np.ndarray:
+        """ Score a batch of sheets (N x questions) -> (N x traits)
+        """
+        return np.atleast_2d(np.asarray(values, dtype=float)) @ self.weights / self.normalization
+
+    def score_answer(self, question_id: str, selection) -> np.ndarray:
+        """ Contribution of a single answer to every trait, what the app adds after each question
+        """
+        value = self.conversion[self.option_index[selection]] if isinstance(selection, str) else self.encode([selection])[0]
+        return value * self.weights[self.question_index[question_id]] / self.normalization
+
+    def to_dict(self, scores: np.ndarray) -> dict:
+        """ Trait vector -> {trait: score} like the test_results dictionary
+        """
+        return {trait: float(score) for trait, score in zip(self.traits, scores)}
@@ -0,0 +1,3 @@
+#!/bin/sh
+# Production server (gunicorn does not run on Windows, use server.bat there)
+exec gunicorn -c "$(dirname "$0")/gunicorn.conf.py" "$@"
@@ -0,0 +1,208 @@
+""" Server-side storage for the per-user test state
+
+The browser only keeps a small session token, the state itself (results so far, question order, question
+index and name) lives in one of these stores:
+
+    memory[:max_sessions]   in-process LRU, fastest but every worker process has its own
+    file:<directory>        one json file per session, shared by every worker on the machine
+    sqlite:<path>           single sqlite database, shared by every worker on the machine
+
+Every store drops sessions that have not been touched for `ttl` seconds.
+"""
+import json
+import os
+from abc import ABC, abstractmethod
+import secrets
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_TTL = 2 * 60 * 60 # seconds
+DEFAULT_MAX_SESSIONS = 10000
+
+class SessionStore(ABC):
+    """ Interface shared by the backends, states are json-serializable dicts
+    """
+    def __init__(self, ttl: float = DEFAULT_TTL):
+        self.ttl = ttl
+
+    @staticmethod
+    def new_token() -> str:
+        return secrets.token_urlsafe(16)
+
+    @abstractmethod
+    def get(self, token: str):
+        """ The state, None when the session is unknown or expired
+        """
+
+    @abstractmethod
+    def set(self, token: str, state: dict):
+        pass
+
+    @abstractmethod
+    def delete(self, token: str):
+        pass
+
+class MemorySessionStore(SessionStore):
+    """ In-process LRU with TTL eviction. States are kept as json like in the other stores, so every get
+    returns a new dict and concurrent requests never share one
+    """
+    def __init__(self, max_sessions: int = DEFAULT_MAX_SESSIONS, ttl: float = DEFAULT_TTL):
+        super().__init__(ttl)
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict() # token -> (last touched, state as json)
+        self._lock = threading.Lock()
+
+    def get(self, token: str):
+        with self._lock:
+            entry = self._sessions.get(token)
+            if entry is None:
+                return None
+            touched, state = entry
+            now = time.monotonic()
+            if now - touched > self.ttl:
+                del self._sessions[token]
+                return None
+            self._sessions[token] = (now, state)
+            self._sessions.move_to_end(token)
+        return json.loads(state)
+
+    def set(self, token: str, state: dict):
+        state = json.dumps(state)
+        with self._lock:
+            now = time.monotonic()
+            self._sessions[token] = (now, state)
+            self._sessions.move_to_end(token)
+            # least recently used sessions are at the front
+            while self._sessions:
+                oldest, (touched, _) = next(iter(self._sessions.items()))
+                if len(self._sessions) <= self.max_sessions and now - touched <= self.ttl:
+                    break
+                del self._sessions[oldest]
+
+    def delete(self, token: str):
+        with self._lock:
+            self._sessions.pop(token, None)
+
+    def __len__(self):
+        return len(self._sessions)
+
+class FileSessionStore(SessionStore):
+    """ One json file per session, written atomically so concurrent workers never read half a state
+    """
+    cleanup_interval = 60 # seconds between sweeps for expired files
+
+    def __init__(self, directory: str, ttl: float = DEFAULT_TTL):
+        super().__init__(ttl)
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._last_cleanup = 0.0
+
+    def _path(self, token: str) -> str:
+        # tokens come from the browser, so never let them pick the path
+        if not token or not all(c.isalnum() or c in "-_" for c in token):
+            raise ValueError("Invalid session token")
+        return os.path.join(self.directory, f"{token}.json")
+
+    def get(self, token: str):
+        try:
+            path = self._path(token)
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                self.delete(token)
+                return None
+            with open(path, encoding="utf8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def set(self, token: str, state: dict):
+        path = self._path(token)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf8") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, path)
+        self._cleanup()
+
+    def delete(self, token: str):
+        try:
+            os.remove(self._path(token))
+        except (OSError, ValueError):
+            pass
+
+    def _cleanup(self):
+        now = time.time()
+        if now - self._last_cleanup < self.cleanup_interval:
+            return
+        self._last_cleanup = now
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.name.endswith(".json") and now - entry.stat().st_mtime > self.ttl:
+                    os.remove(entry.path)
+            except OSError:
+                pass # another worker got to it first
+
+class SQLiteSessionStore(SessionStore):
+    """ Sessions in a single sqlite table, one connection per thread
+    """
+    cleanup_interval = 60 # seconds between sweeps for expired rows
+
+    def __init__(self, path: str, ttl: float = DEFAULT_TTL):
+        super().__init__(ttl)
+        self.path = path
+        self._local = threading.local()
+        self._pid = os.getpid()
+        self._last_cleanup = 0.0
+        with self._connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS sessions (token TEXT PRIMARY KEY, state TEXT NOT NULL, updated REAL NOT NULL)")
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._pid != os.getpid():
+            # connections must not cross a fork (e.g. gunicorn preload_app), every worker opens its own
+            self._local = threading.local()
+            self._pid = os.getpid()
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, token: str):
+        row = self._connection().execute("SELECT state, updated FROM sessions WHERE token = ?", (token,)).fetchone()
+        if row is None:
+            return None
+        if time.time() - row[1] > self.ttl:
+            self.delete(token)
+            return None
+        return json.loads(row[0])
+
+    def set(self, token: str, state: dict):
+        now = time.time()
+        with self._connection() as conn:
+            conn.execute("INSERT OR REPLACE INTO sessions (token, state, updated) VALUES (?, ?, ?)", (token, json.dumps(state), now))
+            if now - self._last_cleanup > self.cleanup_interval:
+                self._last_cleanup = now
+                conn.execute("DELETE FROM sessions WHERE updated < ?", (now - self.ttl,))
+
+    def delete(self, token: str):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM sessions WHERE token = ?", (token,))
+
+def get_session_store(spec: str, ttl: float = DEFAULT_TTL):
+    """ Build a store from a spec like "memory", "memory:5000", "file:/tmp/sessions" or "sqlite:sessions.db"
+
+    returns: None for an empty spec, meaning the state stays in the browser
+    """
+    if not spec:
+        return None
+    kind, _, arg = spec.partition(":")
+    if kind == "memory":
+        return MemorySessionStore(int(arg) if arg else DEFAULT_MAX_SESSIONS, ttl)
+    if kind == "file" and arg:
+        return FileSessionStore(arg, ttl)
+    if kind == "sqlite" and arg:
+        return SQLiteSessionStore(arg, ttl)
+    raise ValueError(f"Unknown session store: {spec!r}")
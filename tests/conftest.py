@@ -0,0 +1,8 @@
+""" The app modules live in the repository root, next to this folder
+"""
+import os
+import sys
+
+app_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if app_folder not in sys.path:
+    sys.path.insert(0, app_folder)
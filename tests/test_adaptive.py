@@ -0,0 +1,43 @@
+import pytest
+
+from results_log import ResultsLog, MODE_FULL, MODE_ADAPTIVE
+
+@pytest.fixture(scope="module")
+def app_module():
+    import personality_app
+    return personality_app
+
+def take_test(app, adaptive: bool, trait: str = "clown") -> tuple:
+    """ advance_questions from start to finish, answering as someone high in one trait -> (final outputs,
+    every question text shown)
+    """
+    engine = app.question_banks.get().engine
+    def answer(qid: str) -> str:
+        weight = engine.weights[engine.question_index[qid], engine.traits.index(trait)]
+        return "Strongly Agree" if weight > 0 else "Strongly Disagree" if weight < 0 else "Slightly Disagree"
+
+    start = app.advance_questions("start_btn", None, 0, dict(app.original_results), None, "", "", seed=1, adaptive=adaptive)
+    outputs = app.advance_questions("next_btn", None, 0, start[8], start[10], "tester", "", adaptive=adaptive)
+    texts = [outputs[0]]
+    while outputs[2]: # result button still hidden
+        outputs = app.advance_questions("next_btn", answer(outputs[10][outputs[9]]), outputs[9], outputs[8], outputs[10], "tester", "tester", adaptive=adaptive)
+        texts.append(outputs[0])
+    return outputs, [text for text in texts if text]
+
+def test_counter_shows_the_most_questions_there_can_be(app_module):
+    n = len(app_module.question_banks.get().question_ids)
+    _, full = take_test(app_module, adaptive=False)
+    _, adaptive = take_test(app_module, adaptive=True)
+    assert full[0].startswith(f"Q1/{n}: ") and len(full) == n
+    assert adaptive[0].startswith(f"Q1 of at most {n}: ") and len(adaptive) < n
+
+def test_early_stop_is_logged_as_adaptive(app_module, tmp_path, monkeypatch):
+    log = ResultsLog(str(tmp_path), app_module.TRAITS, list(app_module.meta_index.names))
+    monkeypatch.setattr(app_module, "RESULTS_LOG", log)
+    for adaptive in (False, True):
+        outputs, _ = take_test(app_module, adaptive)
+        app_module.return_test_results(1, outputs[8], "tester", "", None, outputs[9])
+    assert log.column("mode").tolist() == [MODE_FULL, MODE_ADAPTIVE]
+    aggregates = log.refresh()
+    assert (aggregates.results, aggregates.adaptive) == (1, 1)
+    assert "1 adaptive tests that stopped early are left out" in app_module.get_summary(aggregates)
@@ -0,0 +1,124 @@
+import asyncio
+import json
+import os
+import threading
+
+import flask
+import numpy as np
+import pytest
+
+from api import ScoreBatcher, register_api, get_asgi_app, encode_sheets, APIError, MAX_SHEETS
+from scoring import ScoringEngine, FORM_OPTIONS
+from meta_types import MetaTypeIndex
+from results_log import ResultsLog
+
+app_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture(scope="module")
+def engine() -> ScoringEngine:
+    with open(os.path.join(app_folder, "questions.json"), encoding="utf8") as f:
+        return ScoringEngine(json.load(f))
+
+@pytest.fixture(scope="module")
+def meta_index() -> MetaTypeIndex:
+    with open(os.path.join(app_folder, "meta_traits.json"), encoding="utf8") as f:
+        return MetaTypeIndex.from_dict(json.load(f))
+
+@pytest.fixture
+def batcher(engine, meta_index) -> ScoreBatcher:
+    return ScoreBatcher(engine, meta_index, window=0.05)
+
+def sheet(engine, answer=0) -> dict:
+    return {str(qid): answer for qid in engine.question_ids}
+
+def test_batcher_scores_like_the_engine(batcher, engine, meta_index):
+    values = np.stack([engine.encode_sheet(sheet(engine, i)) for i in range(6)])
+    scores, meta_types = batcher.score(values, timeout=5)
+    np.testing.assert_allclose(scores, engine.score_batch(values))
+    assert meta_types == meta_index.match_batch(scores, k=3)
+
+def test_cancelled_request_keeps_the_batcher_running(batcher, engine):
+    """ A client that goes away cancels its future before the batch is scored, the next request must still get an answer
+    """
+    values = engine.encode_sheet(sheet(engine))
+
+    async def cancel_then_score():
+        request = asyncio.ensure_future(batcher.score_async(values))
+        await asyncio.sleep(0.001) # queued, the batch window is still open
+        request.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await request
+        await asyncio.sleep(0.1) # the batch with the cancelled request has been scored
+        return await asyncio.wait_for(batcher.score_async(values), 5)
+
+    scores, _ = asyncio.run(cancel_then_score())
+    np.testing.assert_allclose(scores[0], batcher.engine.score(values))
+    assert any(thread.name == "score-batcher" and thread.is_alive() for thread in threading.enumerate())
+
+def test_bad_batch_keeps_the_batcher_running(batcher, engine):
+    with pytest.raises(ValueError):
+        batcher.score(np.zeros((1, 3)), timeout=5)
+    scores, _ = batcher.score(engine.encode_sheet(sheet(engine)), timeout=5)
+    assert scores.shape == (1, len(engine.traits))
+
+@pytest.fixture
+def client(batcher):
+    server = flask.Flask(__name__)
+    register_api(server, batcher)
+    return server.test_client()
+
+@pytest.mark.parametrize("body, message", [
+    (None, "Expected a JSON object"),
+    ({"answers": {}, "sheets": []}, "Expected a JSON object"),
+    ({"sheets": []}, '"sheets" must be a list'),
+    ({"sheets": [{}] * (MAX_SHEETS + 1)}, '"sheets" must be a list'),
+    ({"sheets": ["H1"]}, "sheet 0: expected an object"),
+    ({"answers": {"NOPE": 0}}, "unknown questions NOPE"),
+    ({"answers": {"H1": 0}}, "Missing answers"),
+])
+def test_invalid_requests(client, body, message):
+    response = client.post("/api/score", data=json.dumps(body), content_type="application/json")
+    assert response.status_code == 400
+    assert message in response.get_json()["error"]
+
+@pytest.mark.parametrize("answer", [True, "Maybe", 6, 2.5])
+def test_invalid_answers(client, engine, answer):
+    response = client.post("/api/score", json={"answers": dict(sheet(engine), H1=answer)})
+    assert response.status_code == 400
+
+def test_not_json(client):
+    response = client.post("/api/score", data="not json", content_type="application/json")
+    assert response.status_code == 400
+
+def test_single_and_batch(client, engine):
+    single = client.post("/api/score", json={"answers": sheet(engine, "Agree")}).get_json()
+    assert set(single) == {"scores", "meta_types"}
+    assert single["scores"] == pytest.approx(engine.to_dict(engine.score(engine.encode_sheet(sheet(engine, 1)))))
+    batch = client.post("/api/score", json={"sheets": [sheet(engine, i) for i in range(len(FORM_OPTIONS))]}).get_json()
+    assert len(batch["results"]) == len(FORM_OPTIONS) and batch["results"][1] == single
+
+def test_encode_sheets_names_the_sheet(engine):
+    with pytest.raises(APIError, match="sheet 1"):
+        encode_sheets({"sheets": [sheet(engine), dict(sheet(engine), H1="Maybe")]}, engine)
+
+def call_asgi(app, body: bytes) -> tuple:
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "path": "/api/score", "method": "POST"}
+    asyncio.run(app(scope, receive, send))
+    return sent[0]["status"], json.loads(sent[1]["body"])
+
+def test_asgi_app_scores_and_logs(batcher, engine, tmp_path):
+    log = ResultsLog(str(tmp_path), engine.traits, list(batcher.meta_index.names))
+    app = get_asgi_app(batcher, results_log=log)
+    status, payload = call_asgi(app, json.dumps({"sheets": [sheet(engine, 0), sheet(engine, 5)], "team": "a"}).encode())
+    assert status == 200 and len(payload["results"]) == 2
+    assert log.rows() == 2 and log.teams == ["", "a"]
+    assert call_asgi(app, b"{broken")[0] == 400
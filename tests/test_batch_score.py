@@ -0,0 +1,52 @@
+import csv
+import json
+
+import pytest
+
+import batch_score
+from scoring import FORM_OPTIONS
+
+@pytest.fixture(scope="module")
+def question_ids() -> list:
+    batch_score.init_worker(batch_score._questions_path, batch_score._meta_path)
+    return [str(qid) for qid in batch_score._engine.question_ids]
+
+def write_csv(path, question_ids: list, rows: list):
+    with open(path, "w", encoding="utf8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=["id", *question_ids])
+        writer.writeheader()
+        writer.writerows(rows)
+
+def test_bad_row_is_reported_and_the_rest_scored(tmp_path, question_ids, capsys):
+    good = {"id": "a", **{qid: FORM_OPTIONS[i % 6] for i, qid in enumerate(question_ids)}}
+    bad = dict(good, id="b", **{question_ids[0]: "Maybe"})
+    write_csv(tmp_path / "in.csv", question_ids, [good, bad, dict(good, id="c")])
+
+    status = batch_score.main([str(tmp_path / "in.csv"), str(tmp_path / "out.csv")])
+
+    with open(tmp_path / "out.csv", encoding="utf8", newline="") as f:
+        rows = list(csv.DictReader(f))
+    assert status == 1
+    assert [row["id"] for row in rows] == ["a", "b", "c"]
+    assert rows[0]["error"] == "" and rows[2]["error"] == ""
+    assert rows[1]["error"].startswith("line 3: Unknown answer") and rows[1]["clown"] == ""
+    assert rows[0]["clown"] == rows[2]["clown"] != ""
+    assert "line 3" in capsys.readouterr().err
+
+def test_invalid_jsonl_lines(tmp_path, question_ids):
+    good = {"id": "a", **{qid: 0 for qid in question_ids}}
+    missing = {"id": "b", **{qid: 0 for qid in question_ids[1:]}}
+    (tmp_path / "in.jsonl").write_text("\n".join([json.dumps(good), "{not json", json.dumps(missing), "[1, 2]"]) + "\n")
+
+    status = batch_score.main([str(tmp_path / "in.jsonl"), str(tmp_path / "out.jsonl")])
+
+    records = [json.loads(line) for line in (tmp_path / "out.jsonl").read_text().splitlines()]
+    assert status == 1
+    assert "error" not in records[0] and records[0]["meta_types"]
+    assert records[1]["error"] == "line 2: not a JSON object"
+    assert records[2]["error"].startswith(f"line 3: Missing answers for {question_ids[0]}") and records[2]["id"] == "b"
+    assert records[3]["error"] == "line 4: not a JSON object"
+
+def test_clean_run_exits_zero(tmp_path, question_ids):
+    write_csv(tmp_path / "in.csv", question_ids, [{"id": str(i), **{qid: i % 6 for qid in question_ids}} for i in range(5)])
+    assert batch_score.main([str(tmp_path / "in.csv"), str(tmp_path / "out.csv"), "--chunk-size", "2"]) == 0
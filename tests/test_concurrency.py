@@ -0,0 +1,92 @@
+import argparse
+import os
+import random
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+app_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The app reads PERSONALITY_SESSION_STORE and registers its callbacks once at import, so every store runs the
+# sessions in a process of its own (the __main__ part below)
+@pytest.mark.parametrize("store", ["browser", "memory", "file", "sqlite"])
+def test_concurrent_sessions_score_like_the_engine(store, tmp_path):
+    setting = {"browser": "", "memory": "memory", "file": f"file:{tmp_path}", "sqlite": f"sqlite:{tmp_path / 'sessions.db'}"}[store]
+    env = {name: value for name, value in os.environ.items() if not name.startswith("PERSONALITY_")}
+    env["PERSONALITY_SESSION_STORE"] = setting
+    run = subprocess.run([sys.executable, os.path.abspath(__file__), "--sessions", "16", "--threads", "16"],
+                         env=env, capture_output=True, text=True, timeout=600)
+    assert run.returncode == 0, run.stdout + run.stderr
+
+def run_sessions(n_sessions: int, threads: int) -> list:
+    """ Full-length tests from many threads at once through the Dash endpoints -> what went wrong
+    """
+    sys.path[:0] = [app_folder, os.path.join(app_folder, "benchmarks")]
+    import numpy as np
+    from dash_client import FlaskTransport, DashSession
+    import personality_app as app
+
+    setup = FlaskTransport(app.app.server)
+    dependencies, layout = setup.get_json("/_dash-dependencies"), setup.get_json("/_dash-layout")
+    bank = app.question_banks.get()
+
+    def test_results(session: DashSession) -> dict:
+        if app.SESSION_STORE is None:
+            return session.get("test_results_stored", "data")
+        return app.SESSION_STORE.get(session.get("session_token", "data"))["test_results"]
+
+    def seed(session: DashSession) -> int:
+        if app.SESSION_STORE is None:
+            return session.get("seed_stored", "data")
+        return app.SESSION_STORE.get(session.get("session_token", "data"))["seed"]
+
+    def run(i: int) -> list:
+        rng = random.Random(i)
+        session = DashSession.connect(FlaskTransport(app.app.server), dependencies, layout)
+        session.set("url", "search", "?mode=full")
+        session.click("start_btn")
+        replay = seed(session) # a test started without ?seed= keeps its own
+        session.set("url", "search", f"?seed={i}&mode=full")
+        session.click("start_btn")
+        if seed(session) != i or not isinstance(replay, int):
+            return [f"session {i}: seed {seed(session)} kept instead of {i}, {replay} without ?seed="]
+        session.set("troll_name", "value", f"user{i}")
+        session.click("next_btn")
+        sheet = {}
+        for qid in app.get_question_order(bank, i): # the order ?seed= gives
+            sheet[qid] = rng.choice(app.form_options)
+            session.set("form_select", "value", sheet[qid])
+            session.click("next_btn")
+        if session.get("result_btn", "hidden", True):
+            return [f"session {i}: no results after {len(sheet)} answers"]
+
+        expected = bank.engine.score(bank.engine.encode_sheet(sheet))
+        problems = []
+        scores = np.array([test_results(session)[trait] for trait in bank.engine.traits])
+        if not np.allclose(scores, expected):
+            problems.append(f"session {i}: scores {scores.round(3)} instead of {expected.round(3)}")
+        updated = session.click("result_btn")
+        _, key = app.get_shown_results(scores, bank) # the scores checked above, expected may round into another key
+        if updated.get("share_link.href") != app.app.get_relative_path(f"/share/{key}") + app.get_card_query(bank):
+            problems.append(f"session {i}: share link {updated.get('share_link.href')} doesn't match the scores")
+        card = app.app.server.test_client().get(f"/cards/{key}.png" + app.get_card_query(bank))
+        if card.status_code != 200 or not card.data.startswith(b"\x89PNG"):
+            problems.append(f"session {i}: card {key} failed with {card.status_code}")
+        updated = session.click("reset_btn")
+        if updated.get("results_graph_div.hidden") is not True:
+            problems.append(f"session {i}: the result is still shown after a reset")
+        return problems
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        return [problem for problems in pool.map(run, range(n_sessions)) for problem in problems]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=32)
+    parser.add_argument("--threads", type=int, default=16)
+    args = parser.parse_args()
+    problems = run_sessions(args.sessions, args.threads)
+    print("\n".join(problems[:10]))
+    sys.exit(1 if problems else 0)
@@ -0,0 +1,23 @@
+import flask
+import pytest
+
+from instrumentation import may_read_metrics
+
+app = flask.Flask(__name__)
+
+def allowed(token: str = "", remote_addr: str = "127.0.0.1", **headers) -> bool:
+    with app.test_request_context("/metrics", headers=headers, environ_base={"REMOTE_ADDR": remote_addr}):
+        return may_read_metrics(flask.request, token)
+
+def test_local_requests_without_a_token():
+    assert allowed()
+    assert not allowed(remote_addr="10.0.0.5")
+
+@pytest.mark.parametrize("header", ["Forwarded", "X-Forwarded-For", "X-Real-IP"])
+def test_proxied_requests_need_the_token(header):
+    assert not allowed(**{header: "203.0.113.9"})
+
+def test_token():
+    assert allowed("secret", remote_addr="10.0.0.5", Authorization="Bearer secret")
+    assert not allowed("secret", Authorization="Bearer wrong")
+    assert not allowed("secret")
@@ -0,0 +1,62 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from meta_types import MetaTypeIndex, NO_MATCH
+
+app_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture(scope="module")
+def meta_json() -> dict:
+    with open(os.path.join(app_folder, "meta_traits.json"), encoding="utf8") as f:
+        return json.load(f)
+
+def matches_loop(results: np.ndarray, meta_dict: dict) -> list:
+    """ Every matching type in file order, the rule get_meta_results used before MetaTypeIndex (which kept
+    the first 3 of these)
+    """
+    meta_array = np.array([list(meta.values())[0:-1] for meta in list(meta_dict.values())]).T
+    comparison = np.all(np.equal((results.reshape(8,1) * meta_array - meta_array**2) > 0, meta_array > 0),axis=0)
+    return [list(meta_dict.values())[idx]['type'] for idx in np.where(comparison)[0]]
+
+def sample_results(n: int, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).uniform(0.3, 1.0, size=(n, 8))
+
+def test_same_types_match_as_the_loop(meta_json):
+    index = MetaTypeIndex.from_dict(meta_json)
+    results = sample_results(2000)
+    every_match = index.match_batch(results, k=len(index), fallback=None)
+    for result, matched in zip(results, every_match):
+        assert sorted(matched) == sorted(matches_loop(result, meta_json))
+
+def test_up_to_three_matches_agree_with_the_loop(meta_json):
+    """ Where at most 3 types match, the loop's first 3 in file order are the same types, strongest first here
+    """
+    index = MetaTypeIndex.from_dict(meta_json)
+    results = sample_results(2000, seed=1)
+    compared = 0
+    for result, matched in zip(results, index.match_batch(results, k=3)):
+        expected = matches_loop(result, meta_json)
+        if len(expected) <= 3:
+            assert sorted(matched) == sorted(expected or [NO_MATCH])
+            compared += 1
+    assert compared > 100
+
+def test_more_than_three_matches_keep_the_strongest(meta_json):
+    index = MetaTypeIndex.from_dict(meta_json)
+    results = sample_results(2000, seed=2)
+    margins = index.margins(results)
+    for result, row, matched in zip(results, margins, index.match_batch(results, k=3)):
+        expected = matches_loop(result, meta_json)
+        if len(expected) > 3:
+            assert len(matched) == 3 and set(matched) <= set(expected)
+            weakest_shown = min(row[list(index.names).index(name)] for name in matched)
+            assert all(row[list(index.names).index(name)] <= weakest_shown for name in set(expected) - set(matched))
+
+def test_nothing_matches():
+    index = MetaTypeIndex(["a", "b"], [[0.5] + [0.0] * 7, [0.0, 0.5] + [0.0] * 6])
+    assert index.match(np.zeros(8)) == [NO_MATCH]
+    assert index.match(np.zeros(8), fallback=None) == []
+    assert index.match(np.array([0.6, 0.7] + [0.0] * 6)) == ["b", "a"]
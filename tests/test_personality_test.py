@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+from personality_test import TRAIT_AXES, get_result_polygon, get_result_polygons, axes_to_polar
+
+# Vertex order around the hexagon, as trait indices into the results
+POLYGON_TRAITS = [0, 4, 1, 3, 6, 7, 2, 5] # clown, sender, hater, brick, wanderer, organizer, grinder, yapper
+
+def polygon_loop(results: np.ndarray) -> tuple:
+    """ One axis at a time, the way the result plot was drawn before get_result_polygons
+    """
+    results = np.clip(np.array(results, dtype=float), 0.0, 1.0)
+    get_position = lambda r, polar, points: points[0] + polar[0] * r**2.5 * np.array([np.cos(polar[1]), np.sin(polar[1])])
+    positions = [get_position(results[i], axes_to_polar(TRAIT_AXES[i]), TRAIT_AXES[i]) for i in POLYGON_TRAITS]
+    return np.array([p[0] for p in positions]), np.array([p[1] for p in positions])
+
+@pytest.mark.parametrize("results", [np.zeros(8), np.ones(8), np.linspace(0, 1, 8), np.linspace(-0.5, 1.5, 8)])
+def test_polygon_matches_loop(results):
+    x, y = get_result_polygon(results)
+    expected_x, expected_y = polygon_loop(results)
+    np.testing.assert_allclose(x, expected_x, atol=1e-9)
+    np.testing.assert_allclose(y, expected_y, atol=1e-9)
+
+def test_polygons_batch_matches_single():
+    results = np.random.default_rng(0).uniform(-0.2, 1.2, size=(20, 8))
+    polygons = get_result_polygons(results)
+    assert polygons.shape == (20, 8, 2)
+    for result, polygon in zip(results, polygons):
+        np.testing.assert_allclose(polygon.T, polygon_loop(result), atol=1e-9)
+
+def test_polygon_leaves_the_results_alone():
+    results = np.array([1.5, -0.5, 0.5, 0.5, 0.5, 0.5, 0.5, 0.5])
+    get_result_polygon(results)
+    assert results[0] == 1.5 and results[1] == -0.5
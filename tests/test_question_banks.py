@@ -0,0 +1,92 @@
+import json
+import os
+import shutil
+
+import pytest
+
+import question_banks
+from question_banks import BankRegistry, QuestionBank, DEFAULT_BANK
+
+app_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture
+def bank_files(tmp_path) -> tuple:
+    """ Copies of the default bank plus a PERSONALITY_BANKS directory holding a "team" bank
+    """
+    paths = []
+    for name in ("questions.json", "meta_traits.json"):
+        shutil.copy(os.path.join(app_folder, name), tmp_path / name)
+        paths.append(str(tmp_path / name))
+    (tmp_path / "banks" / "team").mkdir(parents=True)
+    shutil.copy(os.path.join(app_folder, "questions.json"), tmp_path / "banks" / "team" / "questions.json")
+    return tuple(paths), str(tmp_path / "banks")
+
+def make_registry(bank_files, archetypes: str = "") -> BankRegistry:
+    paths, directory = bank_files
+    default = QuestionBank.from_files(DEFAULT_BANK, *paths, archetypes=archetypes)
+    return BankRegistry(default, paths, directory, poll_interval=0, archetypes=archetypes)
+
+def edit_question(path: str, text: str):
+    with open(path, encoding="utf8") as f:
+        questions = json.load(f)
+    questions[next(iter(questions))]["text"] = text
+    with open(path, "w", encoding="utf8") as f:
+        json.dump(questions, f)
+
+def team_questions(bank_files) -> str:
+    return os.path.join(bank_files[1], "team", "questions.json")
+
+def test_banks_are_discovered(bank_files):
+    registry = make_registry(bank_files)
+    assert registry.names() == [DEFAULT_BANK, "team"]
+    assert registry.get("unknown").name == DEFAULT_BANK
+    assert registry.resolve(None) is None
+
+@pytest.mark.parametrize("ref", ["default", ["default"], ["default", "v", "extra"], [1, 2], {"name": "default"}])
+def test_tampered_refs_resolve_to_nothing(bank_files, ref):
+    assert make_registry(bank_files).resolve(ref) is None
+
+def test_sessions_keep_their_version_across_a_reload(bank_files):
+    registry = make_registry(bank_files)
+    old = registry.get("team")
+    edit_question(team_questions(bank_files), "Edited")
+    new = registry.get("team")
+    assert new.version != old.version
+    assert registry.resolve(old.ref) is old
+    assert registry.resolve(new.ref) is new
+    assert new.questions_json[new.question_ids[0]]["text"] == "Edited"
+
+def test_broken_edit_keeps_the_previous_version(bank_files, capsys):
+    registry = make_registry(bank_files)
+    before = registry.get("team")
+    with open(team_questions(bank_files), "w") as f:
+        f.write("{broken")
+    assert registry.get("team") is before
+    assert "Keeping the previous version" in capsys.readouterr().err
+
+def test_old_versions_are_evicted(bank_files, monkeypatch):
+    monkeypatch.setattr(question_banks, "MAX_VERSIONS", 2)
+    registry = make_registry(bank_files)
+    refs = [registry.get("team").ref]
+    for i in range(3):
+        edit_question(team_questions(bank_files), f"Edit {i}")
+        refs.append(registry.get("team").ref)
+    assert [registry.resolve(ref) is not None for ref in refs] == [False, False, True, True]
+    assert registry.get(DEFAULT_BANK) is not None # other banks keep theirs
+
+def test_archetypes_follow_the_reloaded_meta_types(bank_files):
+    paths, _ = bank_files
+    registry = make_registry(bank_files, archetypes="meta")
+    old = registry.get()
+    with open(paths[1], encoding="utf8") as f:
+        meta = json.load(f)
+    meta[next(iter(meta))]["type"] = "renamed"
+    with open(paths[1], "w", encoding="utf8") as f:
+        json.dump(meta, f)
+    new = registry.get()
+    assert new.version != old.version
+    assert "renamed" not in old.archetype_index.names and "renamed" in new.archetype_index.names
+    assert registry.resolve(old.ref).archetype_index is old.archetype_index
+
+def test_no_archetypes_by_default(bank_files):
+    assert make_registry(bank_files).get().archetype_index is None
@@ -0,0 +1,86 @@
+import os
+import re
+import time
+
+import flask
+import numpy as np
+import pytest
+
+from result_cards import CardCache, card_key, parse_card_key, quantize, dequantize, render_svg
+
+def test_key_round_trip():
+    results = np.array([0.854, 0.86, 0.1, 0.1, 0.1, 0.87, 0.1, 1.4])
+    np.testing.assert_allclose(dequantize(quantize(results)), [0.85, 0.86, 0.1, 0.1, 0.1, 0.87, 0.1, 1.0])
+    assert parse_card_key(card_key(results))[1:] == (None, None)
+    assert parse_card_key(card_key(results, meta_indices=[4, 0]))[1:] == ([4, 0], None)
+    assert parse_card_key(card_key(results, meta_indices=[]))[1:] == ([], None)
+    assert parse_card_key(card_key(results, archetypes=[(70000, 86), (3, 0)]))[1:] == (None, [(70000, 86), (3, 0)])
+
+@pytest.mark.parametrize("key", ["", "00" * 7, "00" * 9, "65" + "00" * 7, "zz" * 8, "00" * 8 + "m" + "01" * 4,
+                                 "00" * 8 + "a", "00" * 8 + "a00000165", "00" * 8 + "x01"])
+def test_invalid_keys(key):
+    with pytest.raises(ValueError):
+        parse_card_key(key)
+
+def test_memory_cache_evicts_least_recently_used():
+    cache = CardCache(max_memory_bytes=25)
+    cache.put("a", b"x" * 10)
+    cache.put("b", b"x" * 10)
+    cache.get("a")
+    cache.put("c", b"x" * 10)
+    assert cache.get("b") is None and cache.get("a") is not None and cache.get("c") is not None
+    cache.put("huge", b"x" * 26) # never kept in memory
+    assert cache.get("huge") is None and len(cache) == 2
+
+def test_disk_cache_is_shared_and_bounded(tmp_path):
+    first = CardCache(str(tmp_path), max_memory_bytes=0, max_disk_bytes=100)
+    second = CardCache(str(tmp_path), max_memory_bytes=0, max_disk_bytes=100)
+    first.put("a", b"x" * 40)
+    assert second.get("a") == b"x" * 40
+    past = time.time() - 60
+    os.utime(tmp_path / "a", (past, past))
+    first.put("b", b"x" * 40)
+    first.put("c", b"x" * 40) # over the limit: down to 80 bytes, the oldest goes first
+    assert sorted(os.listdir(tmp_path)) == ["b", "c"]
+
+def test_get_or_render_renders_once():
+    cache = CardCache()
+    calls = []
+    render = lambda: calls.append(1) or b"card"
+    assert cache.get_or_render("k", render) == cache.get_or_render("k", render) == b"card"
+    assert len(calls) == 1
+
+@pytest.fixture(scope="module")
+def app_module():
+    import personality_app
+    return personality_app
+
+def card_names(client, share_href: str) -> list:
+    share = client.get(share_href).get_data(as_text=True)
+    card_url = re.search(r'og:image" content="http://localhost([^"]+)"', share).group(1).replace("&amp;", "&")
+    svg = client.get(card_url.replace(".png", ".svg")).get_data(as_text=True)
+    return re.findall(r">- ([^<]+)<", svg)
+
+def test_card_shows_what_the_page_showed(app_module):
+    """ Close to a threshold the quantized result alone would match other meta types than the page showed
+    """
+    client = app_module.app.server.test_client()
+    results = np.random.default_rng(0).uniform(0.5, 1.0, size=(300, 8))
+    results[0] = [0.854, 0.86, 0.1, 0.1, 0.1, 0.87, 0.1, 0.1]
+    for result in results:
+        outputs = app_module.return_test_results(1, dict(zip(app_module.TRAITS, result)), "sam")
+        shown = [item.children for item in outputs[5][0].children]
+        assert card_names(client, outputs[-1]) == shown
+
+def test_share_page_escapes_the_host(app_module, monkeypatch):
+    """ Werkzeug rejects most hostile Host headers already, the page must not rely on it
+    """
+    monkeypatch.setattr(flask.Request, "host_url", property(lambda request: 'http://x"><script>alert(1)</script>/'))
+    client = app_module.app.server.test_client()
+    page = client.get(f"/share/{card_key(np.full(8, 0.5), meta_indices=[])}").get_data(as_text=True)
+    assert "<script>" not in page and page.count("&lt;script&gt;") == 3
+
+def test_svg_card_embeds_its_background():
+    background_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "images", "results_dark_mode.png")
+    svg = render_svg(np.full(8, 0.5), ["doomscroller"], background_path).decode()
+    assert re.findall(r'\bhref="([^"]{0,22})', svg) == ["data:image/png;base64,"] * 2
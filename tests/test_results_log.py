@@ -0,0 +1,92 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from results_log import ResultsLog, ResultAggregates, MAX_META_TYPES, MODE_FULL, MODE_ADAPTIVE
+from meta_types import MetaTypeIndex, NO_MATCH
+from scoring import TRAITS
+
+META = ["puppet master", "evil jingles", "doomscroller"]
+
+def test_round_trip(tmp_path):
+    log = ResultsLog(str(tmp_path), TRAITS, META)
+    log.append(np.full(8, 0.5), ["evil jingles", "doomscroller"], "Platform")
+    log.append(np.zeros(8), [NO_MATCH])
+    assert log.rows() == 2
+    assert log.column("meta").tolist() == [0b110, 0]
+    assert log.column("team").tolist() == [1, 0] and log.teams == ["", "platform"]
+    aggregates = log.refresh()
+    assert aggregates.meta_counts.tolist() == [0, 1, 1] and aggregates.no_match == 1
+    np.testing.assert_allclose(aggregates.means(), np.full(8, 0.25))
+
+def test_new_meta_types_are_appended(tmp_path):
+    log = ResultsLog(str(tmp_path), TRAITS, META)
+    log.append(np.ones(8), ["puppet master"])
+    reopened = ResultsLog(str(tmp_path), TRAITS, ["doomscroller", "touch grass", "puppet master"])
+    assert reopened.meta_types == META + ["touch grass"]
+    reopened.append(np.ones(8), ["touch grass", "puppet master"])
+    with open(tmp_path / "schema.json", encoding="utf8") as f:
+        assert json.load(f)["meta_types"] == META + ["touch grass"]
+    assert reopened.column("meta").tolist() == [0b1, 0b1001]
+    assert reopened.refresh().meta_counts.tolist() == [2, 0, 0, 1]
+
+def test_names_logged_by_another_worker_show_up(tmp_path):
+    writer = ResultsLog(str(tmp_path), TRAITS, META)
+    reader = ResultsLog(str(tmp_path), TRAITS, META)
+    reader.refresh()
+    writer.append(np.ones(8), ["brand new"])
+    aggregates = reader.refresh()
+    assert reader.meta_types == META + ["brand new"]
+    assert aggregates.meta_counts.tolist() == [0, 0, 0, 1]
+
+def test_other_traits_still_need_a_new_directory(tmp_path):
+    ResultsLog(str(tmp_path), TRAITS, META)
+    with pytest.raises(ValueError):
+        ResultsLog(str(tmp_path), TRAITS[:-1], META)
+
+def test_names_past_the_mask_are_not_logged(tmp_path, capsys):
+    names = [f"type {i}" for i in range(MAX_META_TYPES)]
+    log = ResultsLog(str(tmp_path), TRAITS, names)
+    assert log.meta_mask(["one too many", "type 0"]) == 1
+    assert log.meta_types == names and "one too many" in capsys.readouterr().err
+
+def test_checkpoint_from_a_smaller_schema(tmp_path):
+    aggregates = ResultAggregates(len(TRAITS), 2)
+    aggregates.update(np.ones((3, 8)), np.array([1, 2, 3]), np.zeros(3, dtype=int))
+    aggregates.save(str(tmp_path / "aggregates.npz"))
+    loaded = ResultAggregates.load(str(tmp_path / "aggregates.npz"), len(TRAITS), 4)
+    assert loaded.meta_counts.tolist() == [2, 2, 0, 0]
+
+def test_every_match_is_counted(tmp_path):
+    """ Results matching more than 3 types count for all of them, not only for the 3 shown
+    """
+    index = MetaTypeIndex([f"t{i}" for i in range(5)], np.eye(5, 8) * 0.5)
+    log = ResultsLog(str(tmp_path), TRAITS, list(index.names))
+    result = np.array([0.9, 0.8, 0.7, 0.6, 0.55, 0.0, 0.0, 0.0])
+    assert len(index.match(result)) == 3
+    log.append(result, index.match_all(result)[0])
+    assert log.refresh().meta_counts.tolist() == [1, 1, 1, 1, 1]
+
+def test_adaptive_results_are_kept_out_of_the_aggregates(tmp_path):
+    log = ResultsLog(str(tmp_path), TRAITS, META)
+    log.append(np.full(8, 0.5), ["puppet master"], "a")
+    log.append(np.full(8, 0.9), ["evil jingles"], "a", mode=MODE_ADAPTIVE)
+    assert log.column("mode").tolist() == [MODE_FULL, MODE_ADAPTIVE]
+    aggregates = log.refresh()
+    assert (aggregates.rows, aggregates.results, aggregates.adaptive) == (2, 1, 1)
+    assert aggregates.meta_counts.tolist() == [1, 0, 0] and aggregates.team_counts.tolist() == [0, 1]
+    np.testing.assert_allclose(aggregates.means(), np.full(8, 0.5))
+
+def test_log_without_a_mode_column_is_backfilled(tmp_path):
+    log = ResultsLog(str(tmp_path), TRAITS, META)
+    log.append_batch(np.ones((3, 8)), [1, 2, 4], [0, 0, 0])
+    log.refresh().save(str(tmp_path / "aggregates.npz"))
+    os.remove(tmp_path / "mode.u1")
+    with np.load(tmp_path / "aggregates.npz") as data: # a checkpoint from before the mode column
+        np.savez(tmp_path / "aggregates.npz", **{key: data[key] for key in data.files if key not in ("results", "adaptive")})
+    reopened = ResultsLog(str(tmp_path), TRAITS, META)
+    assert reopened.rows() == 3 and reopened.column("mode").tolist() == [MODE_FULL] * 3
+    aggregates = reopened.refresh()
+    assert aggregates.results == 3 and aggregates.meta_counts.tolist() == [1, 1, 1]
@@ -0,0 +1,88 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from scoring import ScoringEngine, TRAITS, FORM_OPTIONS, FORM_CONVERSION
+
+app_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture(scope="module")
+def questions_json() -> dict:
+    with open(os.path.join(app_folder, "questions.json"), encoding="utf8") as f:
+        return json.load(f)
+
+def score_loop(questions_json: dict, answers: dict) -> dict:
+    """ The per-question loop the app used before ScoringEngine
+    """
+    results = {trait: 0.0 for trait in TRAITS}
+    for qid, selection in answers.items():
+        scale = questions_json[qid]['scale']
+        architype = questions_json[qid]['type']
+        value = FORM_CONVERSION[np.where(selection == np.array(FORM_OPTIONS))][0]
+        if type(architype) == list:
+            for idx, item in enumerate(architype):
+                results[item] = results[item] + value * scale[idx] / 18.0
+        else:
+            results[architype] = results[architype] + value * scale / 18.0
+    return results
+
+def random_sheets(questions_json: dict, n: int, seed: int = 0) -> list:
+    rng = np.random.default_rng(seed)
+    return [{qid: FORM_OPTIONS[i] for qid, i in zip(questions_json, rng.integers(0, len(FORM_OPTIONS), len(questions_json)))}
+            for _ in range(n)]
+
+def test_score_matches_loop(questions_json):
+    engine = ScoringEngine(questions_json)
+    for sheet in random_sheets(questions_json, 50):
+        expected = score_loop(questions_json, sheet)
+        assert engine.to_dict(engine.score(engine.encode_sheet(sheet))) == pytest.approx(expected, abs=1e-12)
+
+def test_score_batch_matches_loop(questions_json):
+    engine = ScoringEngine(questions_json)
+    sheets = random_sheets(questions_json, 50, seed=1)
+    scores = engine.score_batch(np.array([engine.encode_sheet(sheet) for sheet in sheets]))
+    for sheet, result in zip(sheets, scores):
+        assert engine.to_dict(result) == pytest.approx(score_loop(questions_json, sheet), abs=1e-12)
+
+def test_score_answer_sums_to_sheet_score(questions_json):
+    """ What the app adds after each question adds up to the whole sheet, in any order
+    """
+    engine = ScoringEngine(questions_json)
+    sheet = random_sheets(questions_json, 1, seed=2)[0]
+    total = np.zeros(len(TRAITS))
+    for qid in reversed(list(sheet)):
+        total += engine.score_answer(qid, sheet[qid])
+    np.testing.assert_allclose(total, engine.score(engine.encode_sheet(sheet)), atol=1e-12)
+
+def test_encode_accepts_option_indices(questions_json):
+    engine = ScoringEngine(questions_json)
+    sheet = random_sheets(questions_json, 1, seed=3)[0]
+    indices = {qid: FORM_OPTIONS.index(answer) for qid, answer in sheet.items()}
+    np.testing.assert_array_equal(engine.encode_sheet(indices), engine.encode_sheet(sheet))
+
+@pytest.mark.parametrize("answer", ["Maybe", 6, -1, 1.5, None])
+def test_encode_rejects_unknown_answers(questions_json, answer):
+    engine = ScoringEngine(questions_json)
+    sheet = dict(random_sheets(questions_json, 1)[0], H1=answer)
+    with pytest.raises(ValueError):
+        engine.encode_sheet(sheet)
+
+def test_encode_sheet_reports_missing_questions(questions_json):
+    engine = ScoringEngine(questions_json)
+    sheet = random_sheets(questions_json, 1)[0]
+    del sheet["H1"]
+    with pytest.raises(ValueError, match="H1"):
+        engine.encode_sheet(sheet)
+
+def test_compiled_arrays_are_read_only(questions_json):
+    engine = ScoringEngine(questions_json)
+    with pytest.raises(ValueError):
+        engine.weights[0, 0] = 1.0
+
+def test_from_compiled_matches(questions_json):
+    engine = ScoringEngine(questions_json)
+    compiled = ScoringEngine.from_compiled(engine.question_ids, engine.weights, engine.normalization)
+    sheet = engine.encode_sheet(random_sheets(questions_json, 1)[0])
+    np.testing.assert_array_equal(compiled.score(sheet), engine.score(sheet))
@@ -0,0 +1,71 @@
+import pytest
+
+from session_store import SessionStore, MemorySessionStore, get_session_store
+
+STATE = {"test_results": {"clown": 0.25, "hater": -0.1}, "q_index": 3, "question_ids": ["H1", "Y3"],
+         "entered_name": "sam", "bank": ["default", "abc"], "seed": 42}
+
+@pytest.fixture(params=["memory", "file", "sqlite"])
+def store(request, tmp_path):
+    spec = {"memory": "memory", "file": f"file:{tmp_path / 'sessions'}", "sqlite": f"sqlite:{tmp_path / 'sessions.db'}"}
+    return get_session_store(spec[request.param])
+
+def test_round_trip(store):
+    token = store.new_token()
+    assert store.get(token) is None
+    store.set(token, STATE)
+    assert store.get(token) == STATE
+    store.set(token, dict(STATE, q_index=4))
+    assert store.get(token)["q_index"] == 4
+    store.delete(token)
+    assert store.get(token) is None
+    store.delete(token) # deleting twice is fine
+
+def test_get_returns_a_copy(store):
+    token = store.new_token()
+    store.set(token, STATE)
+    store.get(token)["test_results"]["clown"] = 1.0
+    assert store.get(token) == STATE
+
+def test_sessions_are_separate(store):
+    first, second = store.new_token(), store.new_token()
+    store.set(first, STATE)
+    store.set(second, dict(STATE, entered_name="alex"))
+    assert store.get(first)["entered_name"] == "sam"
+    assert store.get(second)["entered_name"] == "alex"
+
+def test_expired_sessions_are_gone(store):
+    token = store.new_token()
+    store.set(token, STATE)
+    store.ttl = -1
+    assert store.get(token) is None
+
+def test_file_store_rejects_path_tokens(tmp_path):
+    store = get_session_store(f"file:{tmp_path}")
+    assert store.get("../secret") is None
+    with pytest.raises(ValueError):
+        store.set("../secret", STATE)
+
+def test_memory_store_evicts_least_recently_used():
+    store = MemorySessionStore(max_sessions=2)
+    for token in ["a", "b"]:
+        store.set(token, STATE)
+    store.get("a")
+    store.set("c", STATE)
+    assert store.get("b") is None and store.get("a") == STATE and len(store) == 2
+
+def test_incomplete_store_fails_when_created():
+    class GetOnly(SessionStore):
+        def get(self, token):
+            return None
+
+    with pytest.raises(TypeError):
+        GetOnly()
+
+@pytest.mark.parametrize("spec", ["redis", "file", "sqlite:"])
+def test_unknown_spec(spec):
+    with pytest.raises(ValueError):
+        get_session_store(spec)
+
+def test_empty_spec_keeps_state_in_the_browser():
+    assert get_session_store("") is None
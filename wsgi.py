@@ -0,0 +1,18 @@
+""" Production entry point, serve with gunicorn instead of the Flask dev server in personality_app.py
+
+    gunicorn -c personality_test_app/gunicorn.conf.py
+
+gunicorn.conf.py preloads this module in the master process, so the question bank, meta traits, compiled
+scoring matrices, the background image and the compressed component bundles are loaded once and shared
+copy-on-write by every forked worker.
+"""
+from personality_app import app, background_url
+from personality_test import get_result_template
+from compression import precompress
+
+# Build the cached base figures before the workers fork (the data itself is loaded by importing the app)
+get_result_template(background_url)
+get_result_template()
+
+server = app.server
+precompress(app) # compressed component bundles, shared by the workers like the rest